@@ -0,0 +1,188 @@
+import collections
+import math
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Callable, Counter, Dict, FrozenSet, Optional, Set
+
+from metrics import registry
+
+# Cosine similarity of character n-gram TF-IDF vectors at which a cached
+# answer is served. Changes of spelling and punctuation stay around 0.9,
+# while adding a word to a short question already gives ~0.82.
+MIN_SIMILARITY = 0.88
+# A one word swap, e.g. "seid" for "seit", can still score above
+# MIN_SIMILARITY and change the answer. Words may only be added or dropped,
+# or misspelled if long, and at least this share of them is shared.
+MIN_WORD_OVERLAP = 0.75
+# Added or dropped, these words change the question.
+NEGATIONS = frozenset([
+  "not", "never", "without", "cannot", "don", "doesn", "didn", "isn", "aren",
+  "nicht", "nie", "niemals", "kein", "keine", "keinen", "keinem", "keiner",
+  "ohne"
+])
+# Shorter words, like "s" in "what's", are not compared.
+MIN_TOKEN_CHARS = 3
+# Words one edit apart are a typo from this length on. Shorter ones often
+# differ in meaning, e.g. "seid" and "seit" or "seinen" and "seiner".
+MIN_TYPO_CHARS = 8
+MAX_ENTRIES = 5000
+TTL_SECONDS = 7 * 24 * 3600
+NGRAM_SIZES = (3, 4)
+# Shorter messages, e.g. "und das?", depend on the conversation.
+MIN_QUESTION_CHARS = 12
+# Candidates are the entries sharing the query's rarest n-grams.
+QUERY_NGRAMS = 20
+MAX_CANDIDATES = 50
+
+cache_lookups = registry.counter("bot_answer_cache_lookups_total",
+                                 "Answer cache lookups by result", ["result"])
+cache_evictions = registry.counter("bot_answer_cache_evictions_total",
+                                   "Answers evicted from the cache",
+                                   ["reason"])
+
+
+def normalize(text: str) -> str:
+  text = unicodedata.normalize("NFC", text).casefold()
+  return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def tokens(text: str) -> FrozenSet[str]:
+  return frozenset(token for token in text.split()
+                   if len(token) >= MIN_TOKEN_CHARS)
+
+
+def _one_edit_apart(a: str, b: str) -> bool:
+  if len(a) > len(b):
+    a, b = b, a
+  if len(a) < MIN_TYPO_CHARS or len(b) - len(a) > 1:
+    return False
+  i = 0
+  while i < len(a) and a[i] == b[i]:
+    i += 1
+  skip = 1 if len(a) == len(b) else 0
+  return a[i + skip:] == b[i + 1:]
+
+
+def words_match(a: FrozenSet[str], b: FrozenSet[str],
+                min_overlap: float = MIN_WORD_OVERLAP) -> bool:
+  """Whether questions with the words `a` and `b` ask the same, i.e. no
+  word was replaced by another one and most words are shared."""
+  only_a, only_b = a - b, b - a
+  typos = {word for word in only_a
+           if any(_one_edit_apart(word, other) for other in only_b)}
+  only_a -= typos
+  only_b = {word for word in only_b
+            if not any(_one_edit_apart(word, other) for other in typos)}
+  if (only_a and only_b) or (only_a | only_b) & NEGATIONS:
+    return False
+  union = len(a | b) - len(typos)
+  return not union or 1 - (len(only_a) + len(only_b)) / union >= min_overlap
+
+
+def ngrams(text: str) -> Counter[str]:
+  padded = f" {text} "
+  return collections.Counter(padded[i:i + n] for n in NGRAM_SIZES
+                             for i in range(len(padded) - n + 1))
+
+
+@dataclass
+class _Entry:
+  answer: str
+  counts: Counter[str]
+  tokens: FrozenSet[str]
+  created: float
+
+
+class AnswerCache:
+  """Answers of past free-form questions, served again for near duplicate
+  questions. Questions are compared by cosine similarity of character
+  n-gram TF-IDF vectors, found through an inverted index of n-grams, and
+  must share their words up to additions and typos (`words_match`).
+  Least recently used entries are evicted beyond `max_entries`, and
+  entries expire after `ttl` seconds."""
+
+  def __init__(self,
+               min_similarity: float = MIN_SIMILARITY,
+               max_entries: int = MAX_ENTRIES,
+               ttl: float = TTL_SECONDS,
+               clock: Callable[[], float] = time.monotonic,
+               min_word_overlap: float = MIN_WORD_OVERLAP):
+    self.min_similarity = min_similarity
+    self.min_word_overlap = min_word_overlap
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.clock = clock
+    self._entries: "collections.OrderedDict[str, _Entry]" = (
+      collections.OrderedDict())
+    # n-gram -> normalized questions containing it.
+    self._postings: Dict[str, Set[str]] = {}
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def _idf(self, gram: str) -> float:
+    df = len(self._postings.get(gram, ()))
+    return math.log((1 + len(self._entries)) / (1 + df)) + 1
+
+  def _similarity(self, a: Counter[str], b: Counter[str]) -> float:
+    weights_a = {gram: count * self._idf(gram) for gram, count in a.items()}
+    weights_b = {gram: count * self._idf(gram) for gram, count in b.items()}
+    dot = sum(weight * weights_b.get(gram, 0.0)
+              for gram, weight in weights_a.items())
+    norm = (math.sqrt(sum(w * w for w in weights_a.values())) *
+            math.sqrt(sum(w * w for w in weights_b.values())))
+    return dot / norm if norm else 0.0
+
+  def _remove(self, key: str, reason: str):
+    entry = self._entries.pop(key)
+    for gram in entry.counts:
+      keys = self._postings[gram]
+      keys.discard(key)
+      if not keys:
+        del self._postings[gram]
+    cache_evictions.inc(reason=reason)
+
+  def lookup(self, question: str) -> Optional[str]:
+    key = normalize(question)
+    if len(key) < MIN_QUESTION_CHARS:
+      return None
+    entry = self._entries.get(key)
+    if entry is None:
+      counts, words = ngrams(key), tokens(key)
+      rare = sorted((gram for gram in counts if gram in self._postings),
+                    key=lambda gram: len(self._postings[gram]))[:QUERY_NGRAMS]
+      overlaps = collections.Counter(
+        candidate for gram in rare for candidate in self._postings[gram])
+      best = 0.0
+      for candidate, _ in overlaps.most_common(MAX_CANDIDATES):
+        if not words_match(words, self._entries[candidate].tokens,
+                           self.min_word_overlap):
+          continue
+        similarity = self._similarity(counts, self._entries[candidate].counts)
+        if similarity > best:
+          best, key = similarity, candidate
+      entry = self._entries[key] if best >= self.min_similarity else None
+    if entry is not None and self.clock() - entry.created > self.ttl:
+      self._remove(key, "expired")
+      entry = None
+    if entry is None:
+      cache_lookups.inc(result="miss")
+      return None
+    cache_lookups.inc(result="hit")
+    self._entries.move_to_end(key)
+    return entry.answer
+
+  def add(self, question: str, answer: str):
+    key = normalize(question)
+    if len(key) < MIN_QUESTION_CHARS or not answer:
+      return
+    if key in self._entries:
+      self._remove(key, "replaced")
+    entry = _Entry(answer, ngrams(key), tokens(key), self.clock())
+    self._entries[key] = entry
+    for gram in entry.counts:
+      self._postings.setdefault(gram, set()).add(key)
+    while len(self._entries) > self.max_entries:
+      self._remove(next(iter(self._entries)), "size")
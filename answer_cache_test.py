@@ -0,0 +1,115 @@
+import unittest
+
+from langchain.schema import Generation, LLMResult
+
+from answer_cache import AnswerCache, cache_lookups, words_match
+from ask_anything_extractor import AskAnythingExtractor
+from model_router import ModelRouter, ModelTier
+
+
+class TestAnswerCache(unittest.TestCase):
+
+  def setUp(self):
+    self.now = 0.0
+    self.cache = AnswerCache(max_entries=3, ttl=100,
+                             clock=lambda: self.now)
+    self.cache.add("Why is the verb at the end after dass?", "dass answer")
+    self.cache.add("What is the difference between wenn and als?",
+                   "wenn answer")
+
+  def test_serves_near_duplicates(self):
+    hits = cache_lookups.get(result="hit")
+    self.assertEqual(
+      self.cache.lookup("why is the verb at the end after 'dass'"),
+      "dass answer")
+    self.assertEqual(
+      self.cache.lookup("What's the difference between wenn and als?"),
+      "wenn answer")
+    self.assertEqual(cache_lookups.get(result="hit") - hits, 2)
+
+  def test_misses_other_questions(self):
+    self.assertIsNone(
+      self.cache.lookup("Why is the verb at the end after weil?"))
+    self.assertIsNone(self.cache.lookup("How do I use the Genitiv?"))
+    # Too short to be answered without context.
+    self.cache.add("und das?", "no")
+    self.assertIsNone(self.cache.lookup("und das?"))
+
+  def test_misses_one_word_swaps(self):
+    self.cache.add("When do I use the dative case after mit?", "dative")
+    self.cache.add("Please correct my sentence: Ich bin gestern nach Hause "
+                   "gegangen.", "bin")
+    self.cache.add("What is the difference between seid and seitdem?", "seid")
+    self.assertIsNone(
+      self.cache.lookup("When do I use the accusative case after mit?"))
+    self.assertIsNone(
+      self.cache.lookup("Please correct my sentence: Ich habe gestern nach "
+                        "Hause gegangen."))
+    self.assertIsNone(
+      self.cache.lookup("What is the difference between seit and seitdem?"))
+
+  def test_tolerates_typos_and_added_words(self):
+    self.cache.add("Can you explain when I should use the Konjunktiv II in "
+                   "indirect speech?", "konjunktiv")
+    self.assertEqual(
+      self.cache.lookup("Can you explain when I should use the Konjuntiv II "
+                        "in indirect speech"), "konjunktiv")
+    self.assertEqual(
+      self.cache.lookup("Can you please explain when I should use the "
+                        "Konjunktiv II in indirect speech?"), "konjunktiv")
+
+  def test_words_match(self):
+    words = frozenset(["why", "the", "verb", "end", "after", "dass"])
+    self.assertTrue(words_match(words, words | {"always"}))
+    self.assertFalse(words_match(words, words - {"dass"} | {"weil"}))
+    self.assertFalse(words_match(words, words | {"not"}))
+    self.assertFalse(words_match(words, frozenset(["dass", "word", "order"])))
+
+  def test_eviction(self):
+    self.cache.lookup("Why is the verb at the end after dass?")
+    self.cache.add("How do I form the Perfekt of reflexive verbs?", "perfekt")
+    self.cache.add("When do I use the Dativ after prepositions?", "dativ")
+    self.assertEqual(len(self.cache), 3)
+    # The least recently used entry went.
+    self.assertIsNone(
+      self.cache.lookup("What is the difference between wenn and als?"))
+    self.assertEqual(
+      self.cache.lookup("Why is the verb at the end after dass?"),
+      "dass answer")
+
+    self.now = 101
+    self.assertIsNone(
+      self.cache.lookup("Why is the verb at the end after dass?"))
+    self.assertEqual(len(self.cache), 2)
+
+
+class FakeChain:
+
+  def __init__(self):
+    self.calls = 0
+
+  async def agenerate(self, inputs):
+    self.calls += 1
+    return LLMResult(generations=[[Generation(text=f"answer {self.calls}")]])
+
+
+class TestAskAnythingCache(unittest.IsolatedAsyncioTestCase):
+
+  async def test_only_callers_using_the_cache_share_answers(self):
+    chain = FakeChain()
+    router = ModelRouter([ModelTier("fake", "fake")],
+                         chain_factory=lambda prompt, tier: chain)
+    extractor = AskAnythingExtractor(router=router,
+                                     answer_cache=AnswerCache())
+    story = "Give me an interesting story for the A1 level."
+    self.assertEqual(await extractor.extract_response(story), "answer 1")
+    self.assertEqual(await extractor.extract_response(story), "answer 2")
+    question = "Why is the verb at the end after dass?"
+    self.assertEqual(
+      await extractor.extract_response(question, use_cache=True), "answer 3")
+    self.assertEqual(
+      await extractor.extract_response(question, use_cache=True), "answer 3")
+
+
+if __name__ == '__main__':
+  unittest.main()
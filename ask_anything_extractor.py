@@ -1,21 +1,32 @@
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import PromptTemplate
+from model_router import ModelRouter
 
 
 class AskAnythingExtractor:
 
-  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7):
-    self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
+  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7,
+               router=None, answer_cache=None):
+    self.router = router or ModelRouter.single(model_name, temperature)
+    # AnswerCache of earlier answers, served for near duplicate requests of
+    # callers passing use_cache.
+    self.answer_cache = answer_cache
 
     self.ask_anything_template = PromptTemplate(template=(
       "You are a friendly and helpful German Tutor bot, who helps me "
       "learn high German while having fun. Be concise and don't add motivation speech at the end. My request:\n\n{request}"),
                                                 input_variables=["request"])
 
-    self.ask_anything_chain = LLMChain(prompt=self.ask_anything_template,
-                                       llm=self.model,
-                                       verbose=True)
-
-  async def extract_response(self, request: str) -> str:
-    response = await self.ask_anything_chain.apredict(request=request)
-    return response.strip()
+  async def extract_response(self, request: str,
+                             use_cache: bool = False) -> str:
+    use_cache = use_cache and self.answer_cache is not None
+    if use_cache:
+      cached = self.answer_cache.lookup(request)
+      if cached is not None:
+        return cached
+    response, _ = await self.router.run(self.ask_anything_template,
+                                        "ask_anything", "ask",
+                                        request=request)
+    response = response.strip()
+    if use_cache:
+      self.answer_cache.add(request, response)
+    return response
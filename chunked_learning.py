@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import math
+import re
+from typing import Awaitable, Callable, List, Optional, Sequence, TypeVar
+
+import nltk
+
+from data_models import Keyword, Question, vocab_key
+from token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# About the 1500 characters a /learn text used to be truncated to.
+MAX_CHUNK_TOKENS = 400
+# Longer texts are cut at a chunk boundary, which bounds the LLM cost.
+MAX_CHUNKS = 8
+# A text yields as many questions and keywords as a single extractor call
+# did before chunking, each chunk is asked for its share.
+MAX_QUESTIONS = 10
+MAX_KEYWORDS = 25
+# LLM calls in flight per extraction step of one session.
+CHUNK_CONCURRENCY = 4
+# Sentence boundaries when the nltk punkt model is not available.
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+  try:
+    return nltk.sent_tokenize(text, language="german")
+  except LookupError:
+    return [s for s in _SENTENCE_END_RE.split(text.strip()) if s]
+
+
+def chunk_text(text: str,
+               max_tokens: int = MAX_CHUNK_TOKENS,
+               max_chunks: Optional[int] = MAX_CHUNKS,
+               count: Callable[[str], int] = count_tokens) -> List[str]:
+  """Packs whole sentences into chunks of at most `max_tokens` tokens. A
+  sentence longer than that is split between words."""
+  pieces = []
+  for sentence in split_sentences(text):
+    tokens = count(sentence)
+    if tokens <= max_tokens:
+      pieces.append((sentence, tokens))
+      continue
+    part, part_tokens = [], 0
+    for word in sentence.split():
+      tokens = count(word)
+      if part and part_tokens + tokens > max_tokens:
+        pieces.append((" ".join(part), part_tokens))
+        part, part_tokens = [], 0
+      part.append(word)
+      part_tokens += tokens
+    if part:
+      pieces.append((" ".join(part), part_tokens))
+
+  chunks, current, current_tokens = [], [], 0
+  for piece, tokens in pieces:
+    if current and current_tokens + tokens > max_tokens:
+      chunks.append(" ".join(current))
+      current, current_tokens = [], 0
+    current.append(piece)
+    current_tokens += tokens
+  if current:
+    chunks.append(" ".join(current))
+  if max_chunks is not None and len(chunks) > max_chunks:
+    logger.info(f"Learning only {max_chunks} of {len(chunks)} chunks")
+    chunks = chunks[:max_chunks]
+  return chunks
+
+
+def interleave(lists: Sequence[Sequence[T]]) -> List[T]:
+  """Round robin over the lists, e.g. to spread questions across chunks."""
+  merged = []
+  for i in range(max((len(items) for items in lists), default=0)):
+    merged.extend(items[i] for items in lists if i < len(items))
+  return merged
+
+
+def share(total: int, parts: int) -> int:
+  return math.ceil(total / max(parts, 1))
+
+
+def merge_words(word_lists: Sequence[List[str]]) -> List[str]:
+  seen, merged = set(), []
+  for word in interleave(word_lists):
+    if word.lower() not in seen:
+      seen.add(word.lower())
+      merged.append(word)
+  return merged
+
+
+def merge_keywords(keyword_lists: Sequence[List[Keyword]]) -> List[Keyword]:
+  # Each chunk lists its most difficult keywords first, so interleaving keeps
+  # those at the top of the keyboard.
+  seen, merged = set(), []
+  for keyword in interleave(keyword_lists):
+    key = vocab_key(keyword.root)
+    if key not in seen:
+      seen.add(key)
+      merged.append(keyword)
+  return merged
+
+
+async def map_chunks(func: Callable[[str], Awaitable[T]],
+                     chunks: Sequence[str],
+                     concurrency: int = CHUNK_CONCURRENCY) -> List[T]:
+  """Runs `func` on every chunk with bounded concurrency. A failed chunk
+  yields None instead of failing the whole text."""
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def run(chunk: str):
+    async with semaphore:
+      try:
+        return await func(chunk)
+      except Exception:
+        logger.exception("Failed to process a chunk")
+        return None
+
+  return await asyncio.gather(*[run(chunk) for chunk in chunks])
+
+
+class ChunkedLearner:
+  """Runs the keyword, question and translation extractors on the chunks of
+  a long text concurrently, so wall time stays close to a single chunk's."""
+
+  def __init__(self,
+               keyword_extractor,
+               question_extractor,
+               translation_extractor,
+               max_chunk_tokens: int = MAX_CHUNK_TOKENS,
+               max_chunks: int = MAX_CHUNKS,
+               concurrency: int = CHUNK_CONCURRENCY):
+    self.keyword_extractor = keyword_extractor
+    self.question_extractor = question_extractor
+    self.translation_extractor = translation_extractor
+    self.max_chunk_tokens = max_chunk_tokens
+    self.max_chunks = max_chunks
+    self.concurrency = concurrency
+
+  def chunks(self, text: str) -> List[str]:
+    return chunk_text(text, self.max_chunk_tokens, self.max_chunks)
+
+  def prepare_text(self, text: str) -> str:
+    """The part of `text` that is learned, i.e. at most max_chunks chunks.
+    The text is cut after the last learned word, keeping its line breaks."""
+    chunks = chunk_text(text, self.max_chunk_tokens, None)
+    if len(chunks) <= self.max_chunks:
+      return text
+    logger.info(f"Learning only {self.max_chunks} of {len(chunks)} chunks")
+    # Chunks are made of the text's words in order.
+    end = 0
+    for word in " ".join(chunks[:self.max_chunks]).split():
+      end = text.find(word, end)
+      if end < 0:
+        return " ".join(chunks[:self.max_chunks])
+      end += len(word)
+    return text[:end]
+
+  async def extract_keywords(self, text: str) -> List[Keyword]:
+    chunks = self.chunks(text)
+    max_keywords = share(MAX_KEYWORDS, len(chunks))
+    results = await map_chunks(
+      lambda chunk: self.keyword_extractor.list_keywords(chunk, max_keywords),
+      chunks, self.concurrency)
+    # The merged words are defined at once, and only those kept.
+    words = merge_words([words or [] for words in results])[:MAX_KEYWORDS]
+    keywords = merge_keywords(
+      [await self.keyword_extractor.define_keywords(words)])[:MAX_KEYWORDS]
+    await self.keyword_extractor.find_snippets(keywords, text)
+    return keywords
+
+  async def extract_questions(self, text: str) -> List[Question]:
+    chunks = self.chunks(text)
+    num_questions = share(MAX_QUESTIONS, len(chunks))
+    results = await map_chunks(
+      lambda chunk: self.question_extractor.extract_questions(
+        chunk, num_questions), chunks, self.concurrency)
+    return interleave([questions or []
+                       for questions in results])[:MAX_QUESTIONS]
+
+  async def extract_translation(self, text: str) -> str:
+    results = await map_chunks(self.translation_extractor.extract_translation,
+                               self.chunks(text), self.concurrency)
+    return "\n\n".join(translation for translation in results if translation)
@@ -0,0 +1,148 @@
+import asyncio
+import time
+import unittest
+
+import chunked_learning
+
+from chunked_learning import (ChunkedLearner, chunk_text, interleave,
+                              merge_keywords)
+from data_models import Keyword, Question
+
+
+def count_words(text):
+  return len(text.split())
+
+
+def keyword(root):
+  return Keyword(root=root, word=root, pos="Noun", snippet="",
+                 definition=root)
+
+
+class FakeExtractor:
+
+  def __init__(self, delay=0.0):
+    self.delay = delay
+    self.running = self.max_running = 0
+    self.requested = []
+    self.defined = []
+
+  async def _run(self, text):
+    self.running += 1
+    self.max_running = max(self.max_running, self.running)
+    await asyncio.sleep(self.delay)
+    self.running -= 1
+
+  async def list_keywords(self, text, max_keywords):
+    await self._run(text)
+    self.requested.append(max_keywords)
+    return ["das Haus", text.split()[0]]
+
+  async def define_keywords(self, words):
+    self.defined.append(words)
+    return [keyword(word) for word in words]
+
+  async def find_snippets(self, keywords, text):
+    for kw in keywords:
+      kw.snippet = text
+
+  async def extract_questions(self, text, num_questions):
+    await self._run(text)
+    self.requested.append(num_questions)
+    return [
+      Question(question=f"{text.split()[0]} {i}?", options=["a", "b"],
+               correct_idx=0, explanation="") for i in range(num_questions)
+    ]
+
+  async def extract_translation(self, text):
+    if text.startswith("Kaputt"):
+      raise RuntimeError("LLM failed")
+    return text.upper()
+
+
+class TestChunkText(unittest.TestCase):
+
+  def test_packs_sentences_within_budget(self):
+    text = "Eins zwei drei. Vier fünf. Sechs sieben acht neun. Zehn."
+    self.assertEqual(
+      chunk_text(text, max_tokens=5, count=count_words),
+      ["Eins zwei drei. Vier fünf.", "Sechs sieben acht neun. Zehn."])
+
+  def test_splits_long_sentences_between_words(self):
+    text = "a b c d e f g."
+    self.assertEqual(chunk_text(text, max_tokens=3, count=count_words),
+                     ["a b c", "d e f", "g."])
+
+  def test_caps_number_of_chunks(self):
+    text = "Eins. Zwei. Drei. Vier."
+    self.assertEqual(
+      chunk_text(text, max_tokens=1, max_chunks=2, count=count_words),
+      ["Eins.", "Zwei."])
+
+  def test_merge_keywords_dedupes_by_root(self):
+    merged = merge_keywords([[keyword("das Haus"), keyword("gehen")],
+                             [keyword("Haus"), keyword("laufen")]])
+    self.assertEqual([k.root for k in merged], ["das Haus", "gehen", "laufen"])
+
+  def test_interleave(self):
+    self.assertEqual(interleave([[1, 2, 3], [4], [5, 6]]), [1, 4, 5, 2, 6, 3])
+
+
+class TestChunkedLearner(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.extractor = FakeExtractor(delay=0.05)
+    self.learner = ChunkedLearner(self.extractor, self.extractor,
+                                  self.extractor, max_chunk_tokens=5,
+                                  concurrency=2)
+    self.learner.chunks = lambda text: chunk_text(text, 5, 8, count_words)
+    self.text = " ".join(f"Satz{i} hat vier Wörter." for i in range(4))
+
+  async def test_extracts_chunks_concurrently(self):
+    start = time.monotonic()
+    keywords = await self.learner.extract_keywords(self.text)
+    elapsed = time.monotonic() - start
+    self.assertEqual([k.root for k in keywords],
+                     ["das Haus", "Satz0", "Satz1", "Satz2", "Satz3"])
+    self.assertEqual(self.extractor.max_running, 2)
+    self.assertLess(elapsed, 0.15)
+    # Each chunk lists its share, the merged words are defined at once.
+    self.assertEqual(self.extractor.requested, [7] * 4)
+    self.assertEqual(self.extractor.defined,
+                     [["das Haus", "Satz0", "Satz1", "Satz2", "Satz3"]])
+    self.assertEqual(keywords[1].snippet, self.text)
+
+  async def test_spreads_questions_across_chunks(self):
+    questions = await self.learner.extract_questions(self.text)
+    self.assertEqual([q.question for q in questions[:4]],
+                     ["Satz0 0?", "Satz1 0?", "Satz2 0?", "Satz3 0?"])
+    self.assertEqual(self.extractor.requested, [3] * 4)
+    self.assertEqual(len(questions), chunked_learning.MAX_QUESTIONS)
+
+  async def test_caps_questions_of_long_texts(self):
+    text = " ".join(f"Satz{i} hat vier Wörter." for i in range(8))
+    questions = await self.learner.extract_questions(text)
+    self.assertEqual(len(questions), chunked_learning.MAX_QUESTIONS)
+    self.assertEqual(questions[7].question, "Satz7 0?")
+    self.assertEqual(self.extractor.requested, [2] * 8)
+
+  def test_prepare_text_keeps_line_breaks(self):
+    learner = ChunkedLearner(None, None, None, max_chunk_tokens=20,
+                             max_chunks=2)
+    dialog = "A: Wie geht's?\nB: Gut, danke.\nA: Schön."
+    self.assertEqual(learner.prepare_text(dialog), dialog)
+    poem = "\n".join(f"Zeile {i} ist ein kurzer Vers." for i in range(20))
+    prepared = learner.prepare_text(poem)
+    self.assertTrue(poem.startswith(prepared))
+    self.assertLess(len(prepared), len(poem))
+    self.assertIn("\n", prepared)
+    self.assertTrue(prepared.endswith("Vers."))
+
+  async def test_failed_chunk_is_skipped(self):
+    with self.assertLogs("chunked_learning", "ERROR"):
+      translation = await self.learner.extract_translation(
+        "Kaputt ist das. Das geht gut.")
+    self.assertEqual(translation, "DAS GEHT GUT.")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+from typing import Dict, Optional, Set
+
+from telegram.ext import (BasePersistence, ContextTypes, ConversationHandler,
+                          PersistenceInput)
+
+from data_models import UserProfileDB
+
+# Changed states are written at this interval, see
+# BasePersistence.update_interval.
+UPDATE_INTERVAL_SECONDS = 5
+
+
+class ConversationStore(BasePersistence):
+  """Keeps the states of ConversationHandlers in the user profiles, as
+  journaled "conversation" events. No other bot data is persisted.
+
+  Nothing is loaded at startup. `restore` runs before the other handlers of
+  an update, and loads the states of the user on their first update.
+  """
+
+  def __init__(self, db: UserProfileDB,
+               update_interval: float = UPDATE_INTERVAL_SECONDS):
+    super().__init__(store_data=PersistenceInput(bot_data=False,
+                                                 chat_data=False,
+                                                 user_data=False,
+                                                 callback_data=False),
+                     update_interval=update_interval)
+    self.db = db
+    self._handlers: Dict[str, ConversationHandler] = {}
+    self._restored: Set[int] = set()
+    self._restoring: Dict[int, asyncio.Task] = {}
+
+  def register(self, handler: ConversationHandler) -> None:
+    self._handlers[handler.name] = handler
+
+  async def get_conversations(self, name: str) -> dict:
+    return {}
+
+  async def update_conversation(self, name: str, key: tuple,
+                                new_state: Optional[object]) -> None:
+    # Keys end with the user id, conversations are per user.
+    await self.db.record(key[-1], "conversation", name, key, new_state)
+
+  def set_state(self, name: str, key: tuple, state: object) -> None:
+    """Moves a conversation to `state` outside of its handlers, END ends
+    it."""
+    # ConversationHandler has no public setter. Its dict tracks writes, so
+    # update_conversation follows.
+    conversations = self._handlers[name]._conversations
+    if state == ConversationHandler.END:
+      conversations.pop(key, None)
+    else:
+      conversations[key] = state
+
+  async def restore(self, update: object,
+                    context: ContextTypes.DEFAULT_TYPE) -> None:
+    user = getattr(update, "effective_user", None)
+    if user is None or user.id in self._restored:
+      return
+    task = self._restoring.get(user.id)
+    if task is None:
+      task = asyncio.create_task(self._restore(user.id))
+      self._restoring[user.id] = task
+      task.add_done_callback(lambda _: self._restoring.pop(user.id, None))
+    # Concurrent first updates of the user wait for the same load.
+    await asyncio.shield(task)
+
+  async def _restore(self, user_id: int) -> None:
+    user_profile = await self.db.get_user_profile(user_id)
+    for (name, key), state in user_profile.conversations.items():
+      handler = self._handlers.get(name)
+      # States set since startup are newer than the saved ones.
+      if handler is None or key in handler._conversations:
+        continue
+      handler._conversations.update_no_track({key: state})
+    self._restored.add(user_id)
+
+  async def get_user_data(self) -> dict:
+    return {}
+
+  async def get_chat_data(self) -> dict:
+    return {}
+
+  async def get_bot_data(self) -> dict:
+    return {}
+
+  async def get_callback_data(self) -> None:
+    return None
+
+  async def update_user_data(self, user_id: int, data) -> None:
+    pass
+
+  async def update_chat_data(self, chat_id: int, data) -> None:
+    pass
+
+  async def update_bot_data(self, data) -> None:
+    pass
+
+  async def update_callback_data(self, data) -> None:
+    pass
+
+  async def drop_chat_data(self, chat_id: int) -> None:
+    pass
+
+  async def drop_user_data(self, user_id: int) -> None:
+    pass
+
+  async def refresh_user_data(self, user_id: int, user_data) -> None:
+    pass
+
+  async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+    pass
+
+  async def refresh_bot_data(self, bot_data) -> None:
+    pass
+
+  async def flush(self) -> None:
+    # Events are on disk once recorded.
+    pass
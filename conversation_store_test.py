@@ -0,0 +1,72 @@
+import asyncio
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from telegram.ext import ConversationHandler
+
+from conversation_store import ConversationStore
+from data_models import UserProfileDB
+
+
+def update(user_id):
+  return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+class TestConversationStore(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.db = UserProfileDB(self.tmp_dir.name)
+    self.db.journal.window = 0
+
+  async def asyncTearDown(self):
+    self.db.manifest.close()
+    self.tmp_dir.cleanup()
+
+  async def make_store(self):
+    store = ConversationStore(self.db)
+    handler = ConversationHandler(entry_points=[], states={}, fallbacks=[],
+                                  name="learn", persistent=True)
+    store.register(handler)
+    # What Application.initialize does for persistent handlers.
+    await handler._initialize_persistence(SimpleNamespace(persistence=store))
+    return store, handler
+
+  async def test_states_are_restored_on_first_update(self):
+    store, _ = await self.make_store()
+    await store.update_conversation("learn", (10, 1), 1)
+    await store.update_conversation("learn", (10, 2), 0)
+    await store.update_conversation("learn", (10, 2), None)
+
+    # After a restart, nothing is loaded up front.
+    store, handler = await self.make_store()
+    self.assertEqual(handler._conversations, {})
+    await asyncio.gather(store.restore(update(1), None),
+                         store.restore(update(1), None))
+    await store.restore(update(2), None)
+    self.assertEqual(dict(handler._conversations), {(10, 1): 1})
+    # Restoring does not write the states back.
+    self.assertEqual(list(handler._conversations.pop_accessed_write_items()),
+                     [])
+
+  async def test_states_set_since_startup_win(self):
+    store, _ = await self.make_store()
+    await store.update_conversation("learn", (10, 1), 0)
+    store, handler = await self.make_store()
+    store.set_state("learn", (10, 1), 1)
+    await store.restore(update(1), None)
+    self.assertEqual(handler._conversations[(10, 1)], 1)
+
+  async def test_set_state_to_end_removes_it(self):
+    store, handler = await self.make_store()
+    store.set_state("learn", (10, 1), 1)
+    handler._conversations.pop_accessed_write_items()
+    store.set_state("learn", (10, 1), ConversationHandler.END)
+    self.assertNotIn((10, 1), handler._conversations)
+    self.assertEqual(list(handler._conversations.pop_accessed_write_items()),
+                     [((10, 1), handler._conversations.DELETED)])
+
+
+if __name__ == '__main__':
+  unittest.main()
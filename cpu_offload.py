@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 0 runs everything inline on the event loop.
+CPU_OFFLOAD_WORKERS = int(os.environ.get('CPU_OFFLOAD_WORKERS',
+                                         min(4, os.cpu_count() or 1)))
+# Inputs shorter than this (in characters) are cheaper to handle inline than
+# to send to another process.
+INLINE_THRESHOLD = 2000
+
+
+class CpuOffloader:
+  """Runs CPU-bound functions in a process pool, keeping the event loop free
+  for other handlers. `func` and its arguments must be picklable, so only
+  module-level functions can be offloaded."""
+
+  def __init__(self, max_workers: int = CPU_OFFLOAD_WORKERS,
+               inline_threshold: int = INLINE_THRESHOLD):
+    self.max_workers = max_workers
+    self.inline_threshold = inline_threshold
+    self._executor: Optional[ProcessPoolExecutor] = None
+
+  def _get_executor(self) -> ProcessPoolExecutor:
+    if self._executor is None:
+      self._executor = ProcessPoolExecutor(self.max_workers)
+    return self._executor
+
+  async def run(self, size: int, func: Callable, *args: Any) -> Any:
+    if self.max_workers <= 0 or size < self.inline_threshold:
+      return func(*args)
+    loop = asyncio.get_running_loop()
+    try:
+      return await loop.run_in_executor(self._get_executor(), func, *args)
+    except RuntimeError:
+      # E.g. the pool broke because a worker was killed, retry inline.
+      logger.exception("Process pool failed, running inline")
+      self._executor = None
+      return func(*args)
+
+  def shutdown(self):
+    if self._executor is not None:
+      self._executor.shutdown(cancel_futures=True)
+      self._executor = None
+
+
+offloader = CpuOffloader()
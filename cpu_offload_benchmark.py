@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+
+from cpu_offload import CpuOffloader
+from keyword_extractor import parse_keywords
+from question_extractor import parse_questions
+
+HEARTBEAT_INTERVAL = 0.01
+
+
+def fake_keywords_output(num_lines: int) -> str:
+  return "".join(
+    f"input=Wort{i};root=Wort{i};pos=Noun;art=das;def=word number {i}\n"
+    for i in range(num_lines))
+
+
+def fake_questions_output(num_lines: int) -> str:
+  return "".join(
+    f"text=Frage {i}?;a=eins;b=zwei;c=drei;d=vier;ans=c;expl=Weil {i}.\n"
+    for i in range(num_lines))
+
+
+async def heartbeat(lags: List[float], stop: asyncio.Event):
+  while not stop.is_set():
+    start = time.perf_counter()
+    await asyncio.sleep(HEARTBEAT_INTERVAL)
+    lags.append(time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+
+async def learn_session(offloader: CpuOffloader, num_lines: int):
+  # LLM responses of concurrent sessions arrive at about the same time.
+  await asyncio.sleep(random.random() * 0.05)
+  keywords_output = fake_keywords_output(num_lines)
+  questions_output = fake_questions_output(num_lines)
+  await offloader.run(len(keywords_output), parse_keywords, keywords_output)
+  await offloader.run(len(questions_output), parse_questions, questions_output)
+
+
+async def measure(offloader: CpuOffloader, sessions: int, num_lines: int):
+  lags, stop = [], asyncio.Event()
+  heartbeat_task = asyncio.create_task(heartbeat(lags, stop))
+  start = time.perf_counter()
+  await asyncio.gather(
+    *[learn_session(offloader, num_lines) for _ in range(sessions)])
+  elapsed = time.perf_counter() - start
+  stop.set()
+  await heartbeat_task
+  lags.sort()
+  return elapsed, lags[len(lags) // 2], lags[-1]
+
+
+async def main(args):
+  for name, workers in (("inline", 0), ("process pool", args.workers)):
+    offloader = CpuOffloader(max_workers=workers)
+    # Warm up the pool so process start-up is not measured.
+    await offloader.run(offloader.inline_threshold, parse_keywords, "")
+    elapsed, median_lag, max_lag = await measure(offloader, args.sessions,
+                                                 args.lines)
+    offloader.shutdown()
+    print(f"{name}: {args.sessions} sessions in {elapsed:.2f}s, event loop "
+          f"lag median={median_lag * 1000:.1f}ms max={max_lag * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Event loop lag under concurrent learn sessions")
+  parser.add_argument("--sessions", type=int, default=50)
+  parser.add_argument("--lines", type=int, default=2000,
+                      help="lines per fake LLM output")
+  parser.add_argument("--workers", type=int, default=4)
+  asyncio.run(main(parser.parse_args()))
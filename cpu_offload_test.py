@@ -0,0 +1,33 @@
+import unittest
+
+from cpu_offload import CpuOffloader
+from question_extractor import parse_questions
+
+QUESTION_LINE = ("text=Wohin fährt der Zug?;a=Berlin;b=Hamburg;c=München;"
+                 "d=Köln;ans=b;expl=Der Zug fährt nach Hamburg.\n")
+
+
+class TestCpuOffloader(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncTearDown(self):
+    self.offloader.shutdown()
+
+  async def test_pool_and_inline_agree(self):
+    self.offloader = CpuOffloader(max_workers=1, inline_threshold=100)
+    output = QUESTION_LINE * 10
+    pooled = await self.offloader.run(len(output), parse_questions, output)
+    self.assertIsNotNone(self.offloader._executor)
+    self.assertEqual(pooled, parse_questions(output))
+    self.assertEqual(len(pooled), 10)
+    self.assertEqual(pooled[0].correct_idx, 1)
+
+  async def test_small_inputs_run_inline(self):
+    self.offloader = CpuOffloader(max_workers=1, inline_threshold=10000)
+    questions = await self.offloader.run(len(QUESTION_LINE), parse_questions,
+                                         QUESTION_LINE)
+    self.assertEqual(len(questions), 1)
+    self.assertIsNone(self.offloader._executor)
+
+
+if __name__ == '__main__':
+  unittest.main()
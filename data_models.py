@@ -1,15 +1,26 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, asdict, fields, MISSING
 from dacite import from_dict
 
 from replit import db
 
-from typing import List, Optional, Dict, Any
-from datetime import datetime, date, timedelta
+from typing import List, Optional, Dict, Any, Deque, Iterator
+from datetime import datetime, date, time, timedelta
 from pydantic import BaseModel, Field
-import heapq
+import hashlib
+import json
 import os
+import tempfile
 import pickle
 import random
+import unicodedata
+import weakref
+import asyncio
+from collections import deque, OrderedDict
+
+from metrics import db_bytes
+from profile_journal import (EventJournal, ProfileEvent, HISTORY_SUFFIX,
+                             JOURNAL_SUFFIX, SNAPSHOT_EVERY, read_events)
+from profile_manifest import Manifest, ManifestEntry
 
 @dataclass
 class Question:
@@ -67,6 +78,36 @@ class VocabEncounter:
     return f"{self.word} ({self.pos}): {self.definition}{optional_snipet}"
 
 
+@dataclass(frozen=True)
+class SM2Params:
+  """Constants of the SM-2 update in `Vocab.update`, see srs_engine for
+  evaluating alternatives."""
+  min_ease: float = 1.3
+  # ease += ease_step - (5 - q) * (ease_linear + (5 - q) * ease_quadratic)
+  ease_step: float = 0.1
+  ease_linear: float = 0.08
+  ease_quadratic: float = 0.02
+  # Answers below this quality restart the repetitions.
+  pass_quality: int = 3
+  first_interval: int = 1
+  second_interval: int = 6
+  correct_quality: int = 5
+  wrong_quality: int = 2
+  click_quality: int = 3
+  define_quality: int = 1
+
+
+# Replaced at startup to tune the schedule, see sm2_params_from_env.
+SM2_PARAMS = SM2Params()
+
+
+def sm2_params_from_env() -> SM2Params:
+  """SM2Params with the overrides of the SM2_PARAMS environment variable,
+  a JSON object, e.g. {"second_interval": 4}."""
+  overrides = json.loads(os.environ.get("SM2_PARAMS") or "{}")
+  return SM2Params(**overrides)
+
+
 @dataclass
 class Vocab:
   root: str
@@ -79,17 +120,20 @@ class Vocab:
   quiz: List[Question] = field(default_factory=list)
 
   @classmethod
-  def from_keyword(cls, keyword: Keyword, session_id: int):
+  def from_keyword(cls, keyword: Keyword, session_id: int,
+                   time: Optional[datetime] = None):
     vocab = cls(root=keyword.root)
-    vocab.encounter_keyword(keyword, session_id)
+    vocab.encounter_keyword(keyword, session_id, time)
     return vocab
 
-  def encounter_keyword(self, keyword: Keyword, session_id: int):
+  def encounter_keyword(self, keyword: Keyword, session_id: int,
+                        time: Optional[datetime] = None):
     self.encounters.append(VocabEncounter(session_id=session_id,
                                           word=keyword.word,
                                           pos=keyword.pos,
                                           snippet=keyword.snippet,
-                                          definition=keyword.definition))
+                                          definition=keyword.definition,
+                                          time=time or datetime.now()))
 
   def random_word(self):
     if self.encounters:
@@ -97,57 +141,158 @@ class Vocab:
     else:
       return self.root
 
-  def correct_answer(self):
-    self.update(quality=5)
+  def correct_answer(self, today: Optional[date] = None):
+    self.update(quality=SM2_PARAMS.correct_quality, today=today)
 
-  def wrong_answer(self):
-    self.update(quality=2)
+  def wrong_answer(self, today: Optional[date] = None):
+    self.update(quality=SM2_PARAMS.wrong_quality, today=today)
 
-  def update(self, quality: int):
+  def update(self, quality: int, params: Optional[SM2Params] = None,
+             today: Optional[date] = None):
     if quality < 0 or quality > 5:
       raise ValueError("Quality should be between 0 and 5.")
+    params = params or SM2_PARAMS
 
-    self.ease_factor += 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    self.ease_factor += params.ease_step - (5 - quality) * (
+      params.ease_linear + (5 - quality) * params.ease_quadratic)
 
-    if self.ease_factor < 1.3:
-      self.ease_factor = 1.3
+    if self.ease_factor < params.min_ease:
+      self.ease_factor = params.min_ease
 
     self.repetitions += 1
 
-    if quality < 3:
+    if quality < params.pass_quality:
       self.repetitions = 0
 
     if self.repetitions == 1:
-      self.interval = 1
+      self.interval = params.first_interval
     elif self.repetitions == 2:
-      self.interval = 6
+      self.interval = params.second_interval
     else:
       self.interval = int(self.interval * self.ease_factor)
 
-    self.last_review = date.today()
-    self.next_review = date.today() + timedelta(days=self.interval)
+    self.last_review = today or date.today()
+    self.next_review = self.last_review + timedelta(days=self.interval)
+
+
+ARTICLES = ("der", "die", "das")
+
+
+def vocab_key(word: str) -> str:
+  """Canonical form of a root or word: NFC, casefolded, without article.
+  "der Informationsschalter" and "informationsschalter" share a key."""
+  key = " ".join(unicodedata.normalize("NFC", word).casefold().split())
+  article, _, rest = key.partition(" ")
+  if article in ARTICLES and rest:
+    return rest
+  return key
+
+
+def _merge_vocabs(vocabs: List[Vocab]) -> Vocab:
+  # The SRS state of the most recently reviewed duplicate is the current one.
+  vocabs = sorted(vocabs,
+                  key=lambda vocab: (vocab.last_review or date.min,
+                                     len(vocab.encounters)),
+                  reverse=True)
+  merged = vocabs[0]
+  # Roots are the definite form, keep one with the article.
+  merged.root = next((vocab.root for vocab in vocabs
+                      if vocab.root.split(" ", 1)[0].lower() in ARTICLES),
+                     merged.root)
+  merged.encounters = sorted(
+    (encounter for vocab in vocabs for encounter in vocab.encounters),
+    key=lambda encounter: encounter.time)
+  questions = {}
+  for vocab in vocabs:
+    for question in vocab.quiz:
+      questions.setdefault(question.question, question)
+  merged.quiz = list(questions.values())
+  return merged
 
 
 @dataclass
 class Vocabs:
+  # Keyed by vocab_key(vocab.root), use `get` to look up roots and words.
   dictionary: Dict[str, Vocab] = field(default_factory=dict)
-
-  def _encounter_keyword(self, keyword: Keyword, session_id: int, quality: int):
-    root = keyword.root
-    if root not in self.dictionary:
-      vocab = Vocab.from_keyword(keyword, session_id) 
-      self.dictionary[keyword.root] = vocab
+  # vocab_key of encountered words -> dictionary key.
+  surface_index: Dict[str, str] = field(default_factory=dict)
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    _fill_missing_fields(self)
+    if any(key != vocab_key(vocab.root)
+           for key, vocab in self.dictionary.items()):
+      # Keyed by raw roots before, merge the duplicates.
+      self.merge_duplicates()
+
+  def find_key(self, word: str) -> Optional[str]:
+    key = vocab_key(word)
+    if key in self.dictionary:
+      return key
+    return self.surface_index.get(key)
+
+  def get(self, word: str) -> Optional[Vocab]:
+    """The vocab of a root or of a word encountered before, in any case and
+    with or without article."""
+    key = self.find_key(word)
+    return self.dictionary[key] if key is not None else None
+
+  def _index(self, key: str, vocab: Vocab):
+    for encounter in vocab.encounters:
+      surface = vocab_key(encounter.word)
+      if surface != key and surface not in self.dictionary:
+        self.surface_index[surface] = key
+
+  def merge_duplicates(self) -> int:
+    """Rebuilds the keys and the surface index, merging vocabs whose roots
+    only differ in case, article or Unicode form. Returns the number of
+    vocabs merged away."""
+    groups: Dict[str, List[Vocab]] = {}
+    for vocab in self.dictionary.values():
+      groups.setdefault(vocab_key(vocab.root), []).append(vocab)
+    self.dictionary = {
+      key: vocabs[0] if len(vocabs) == 1 else _merge_vocabs(vocabs)
+      for key, vocabs in groups.items()
+    }
+    self.surface_index = {}
+    for key, vocab in self.dictionary.items():
+      self._index(key, vocab)
+    return sum(len(vocabs) - 1 for vocabs in groups.values())
+
+  def _encounter_keyword(self, keyword: Keyword, session_id: int, quality: int,
+                         now: Optional[datetime] = None):
+    key = self.find_key(keyword.root)
+    if key is None:
+      key = vocab_key(keyword.root)
+      vocab = Vocab.from_keyword(keyword, session_id, now)
+      self.dictionary[key] = vocab
+      self.surface_index.pop(key, None)
     else:
-      vocab = self.dictionary[root]
-      vocab.encounter_keyword(keyword, session_id)
+      vocab = self.dictionary[key]
+      vocab.encounter_keyword(keyword, session_id, now)
+    self._index(key, vocab)
+
+    vocab.update(quality, today=now.date() if now else None)
 
-    vocab.update(quality)
+  def define_vocab(self, keyword: Keyword, session_id: int,
+                   now: Optional[datetime] = None):
+    self._encounter_keyword(keyword, session_id,
+                            quality=SM2_PARAMS.define_quality, now=now)
 
-  def define_vocab(self, keyword: Keyword, session_id: int):
-    self._encounter_keyword(keyword, session_id, quality=1)
+  def click_keyword(self, keyword: Keyword, session_id: int,
+                    now: Optional[datetime] = None):
+    self._encounter_keyword(keyword, session_id,
+                            quality=SM2_PARAMS.click_quality, now=now)
 
-  def click_keyword(self, keyword: Keyword, session_id: int):
-    self._encounter_keyword(keyword, session_id, quality=3)
+  def import_vocab(self, vocab: Vocab) -> bool:
+    """Adds an imported vocab, keeping the one already learned if any."""
+    if self.find_key(vocab.root) is not None:
+      return False
+    key = vocab_key(vocab.root)
+    self.dictionary[key] = vocab
+    self.surface_index.pop(key, None)
+    self._index(key, vocab)
+    return True
 
   def due_vocabs(self, n: int):
     due_vocabs = [
@@ -173,6 +318,9 @@ class LearningSession:
   current_keyword_page: int = 0
   # Stores the vocab root corresponding to the quiz, when text="VocabQuiz".
   vocab_roots: List[str] = field(default_factory=list) 
+  # Keywords and questions are being extracted from the text, resumed at
+  # startup if the bot stopped.
+  extracting: bool = False
 
   def summary_quiz(self) -> str:
     duration = self.end_time - self.start_time if self.end_time else datetime.now(
@@ -190,33 +338,304 @@ class LearningSession:
     return f"{self.summary_quiz()}\nKeywords: {keywords_str}"
 
 
+@dataclass
+class SessionStats:
+  sessions: int = 0
+  answers: int = 0
+  correct_answers: int = 0
+  minutes: float = 0.0
+  last_session_id: int = -1
+
+  def add_session(self, session: LearningSession):
+    self.sessions += 1
+    answered = [q for q in session.quiz if q.answer_idx is not None]
+    self.answers += len(answered)
+    self.correct_answers += sum(1 for q in answered if q.is_correct())
+    if session.end_time is not None:
+      self.minutes += (session.end_time -
+                       session.start_time).total_seconds() / 60
+    self.last_session_id = max(self.last_session_id, session.session_id)
+
+  def accuracy(self) -> float:
+    return self.correct_answers / self.answers if self.answers else 0.0
+
+
+RECENT_VOCABS = 100
+STATS_DAYS = 90
+
+
+@dataclass
+class ProfileStats:
+  session_count: int = 0
+  total_minutes: float = 0.0
+  # day -> [answers, correct answers], for the last STATS_DAYS days.
+  daily_answers: Dict[date, List[int]] = field(default_factory=dict)
+  recent_vocabs: Deque[str] = field(
+    default_factory=lambda: deque(maxlen=RECENT_VOCABS))
+
+  @classmethod
+  def from_history(cls, user_profile: "UserProfile") -> "ProfileStats":
+    # One-off rebuild for profiles created before the stats existed.
+    stats = cls(session_count=user_profile.archived_stats.sessions,
+                total_minutes=user_profile.archived_stats.minutes)
+    for session in user_profile.sessions:
+      stats.start_session()
+      if session.end_time is not None:
+        stats.end_session(session)
+      for question in session.quiz:
+        if question.answer_time is not None:
+          stats.record_answer(question.is_correct(),
+                              question.answer_time.date())
+    encounters = sorted(((vocab.encounters[-1].time, vocab.root)
+                         for vocab in user_profile.vocabs.dictionary.values()
+                         if vocab.encounters))
+    for _, root in encounters[-RECENT_VOCABS:]:
+      stats.record_vocab(root)
+    return stats
+
+  def start_session(self):
+    self.session_count += 1
+
+  def end_session(self, session: LearningSession):
+    self.total_minutes += (session.end_time -
+                           session.start_time).total_seconds() / 60
+
+  def record_answer(self, correct: bool, day: Optional[date] = None):
+    day = day or date.today()
+    if day not in self.daily_answers:
+      self.daily_answers[day] = [0, 0]
+      # Days are inserted in order, the oldest ones come first.
+      cutoff = day - timedelta(days=STATS_DAYS)
+      while next(iter(self.daily_answers)) < cutoff:
+        del self.daily_answers[next(iter(self.daily_answers))]
+    self.daily_answers[day][0] += 1
+    self.daily_answers[day][1] += int(correct)
+
+  def record_vocab(self, root: str):
+    # "Apfel" and "der Apfel" are the same vocab.
+    key = vocab_key(root)
+    for recent in [r for r in self.recent_vocabs if vocab_key(r) == key]:
+      self.recent_vocabs.remove(recent)
+    self.recent_vocabs.append(root)
+
+
+# Polls sent but not answered yet, per user. Older ones are forgotten.
+MAX_TRACKED_POLLS = 200
+
+
+@dataclass
+class PollRef:
+  """Where the answer to a quiz poll goes."""
+  session_id: int
+  question_idx: int
+  vocab_root: Optional[str] = None
+
+
+def _fill_missing_fields(obj):
+  # Objects pickled by older versions miss the fields added since.
+  for f in fields(obj):
+    if f.name in obj.__dict__:
+      continue
+    if f.default_factory is not MISSING:
+      setattr(obj, f.name, f.default_factory())
+    elif f.default is not MISSING:
+      setattr(obj, f.name, f.default)
+
+
 @dataclass
 class UserProfile:
   user_id: int
   sessions: List[LearningSession] = field(default_factory=list)
   vocabs: Vocabs = field(default_factory=Vocabs)
+  # Daily reminder in the user's local time, None disables reminders.
+  reminder_time: Optional[time] = time(hour=10)
+  timezone: str = "Europe/Berlin"
+  # Aggregates of the sessions moved to the SessionArchive.
+  archived_stats: SessionStats = field(default_factory=SessionStats)
+  stats: ProfileStats = field(default_factory=ProfileStats)
+  # poll_id -> PollRef of the unanswered polls, oldest first.
+  polls: Dict[str, PollRef] = field(default_factory=dict)
+  # Sequence numbers of the last journaled event applied, and of the last
+  # one included in the snapshot.
+  journal_seq: int = 0
+  snapshot_seq: int = 0
+  # (ConversationHandler name, conversation key) -> state.
+  conversations: Dict[tuple, Any] = field(default_factory=dict)
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    _fill_missing_fields(self)
+    if "stats" not in state:
+      self.stats = ProfileStats.from_history(self)
+
+  def new_session_id(self) -> int:
+    # Session ids stay stable when old sessions are archived.
+    if self.sessions:
+      return self.sessions[-1].session_id + 1
+    return self.archived_stats.last_session_id + 1
+
+  def get_session(self, session_id: int) -> Optional[LearningSession]:
+    # Session ids are consecutive, so the id gives the position directly.
+    if not self.sessions:
+      return None
+    idx = session_id - self.sessions[0].session_id
+    if 0 <= idx < len(self.sessions) and (self.sessions[idx].session_id
+                                          == session_id):
+      return self.sessions[idx]
+    # Archived, or ids from before they were consecutive.
+    return next((s for s in self.sessions if s.session_id == session_id),
+                None)
+
+  def start_session(self, session: LearningSession):
+    self.sessions.append(session)
+    self.stats.start_session()
+
+  def end_session(self, session: LearningSession,
+                  now: Optional[datetime] = None):
+    # /stoplearn may be sent again, the time is only counted once.
+    if session.end_time is None:
+      session.end_time = now or datetime.now()
+      self.stats.end_session(session)
+
+  def track_poll(self, poll_id: str, session: LearningSession,
+                 question_idx: int):
+    vocab_root = (session.vocab_roots[question_idx]
+                  if question_idx < len(session.vocab_roots) else None)
+    self.polls[poll_id] = PollRef(session.session_id, question_idx,
+                                  vocab_root)
+    while len(self.polls) > MAX_TRACKED_POLLS:
+      del self.polls[next(iter(self.polls))]
+
+  def pending_polls(self, session_id: int) -> int:
+    return sum(1 for ref in self.polls.values()
+               if ref.session_id == session_id)
+
+  def answer_poll(self, poll_id: str, answer_idx: int,
+                  now: Optional[datetime] = None) -> Optional[LearningSession]:
+    """Records the answer to a poll of any session, in any order. Returns
+    the session, or None if the poll is unknown or already answered."""
+    now = now or datetime.now()
+    ref = self.polls.pop(poll_id, None)
+    if ref is None:
+      # Sent before polls were tracked, one poll at a time.
+      if (self.polls or not self.sessions or
+          not self.sessions[-1].next_question_idx):
+        return None
+      session = self.sessions[-1]
+      idx = session.next_question_idx - 1
+      ref = PollRef(session.session_id, idx,
+                    session.vocab_roots[idx]
+                    if idx < len(session.vocab_roots) else None)
+    session = self.get_session(ref.session_id)
+    if session is None or ref.question_idx >= len(session.quiz):
+      return None
+    question = session.quiz[ref.question_idx]
+    if question.answer_idx is not None:
+      return None
+    question.answer_time = now
+    question.answer_idx = answer_idx
+    self.stats.record_answer(question.is_correct(), now.date())
+    # Update vocab progress if it's a VocabQuiz
+    vocab = self.vocabs.get(ref.vocab_root) if ref.vocab_root else None
+    if vocab is not None:
+      if question.is_correct():
+        vocab.correct_answer(now.date())
+      else:
+        vocab.wrong_answer(now.date())
+    return session
+
+  def define_vocab(self, keyword: Keyword, session_id: int,
+                   now: Optional[datetime] = None):
+    self.vocabs.define_vocab(keyword, session_id, now)
+    self.stats.record_vocab(self.vocabs.get(keyword.root).root)
+
+  def click_keyword(self, keyword: Keyword, session_id: int,
+                    now: Optional[datetime] = None):
+    self.vocabs.click_keyword(keyword, session_id, now)
+    self.stats.record_vocab(self.vocabs.get(keyword.root).root)
+
+  def apply(self, event: ProfileEvent):
+    """Applies a journaled event, when recorded and when replayed on the
+    snapshot. Returns the result of the mutation."""
+    self.journal_seq = event.seq
+    if event.kind == "answer":
+      poll_id, answer_idx = event.args
+      return self.answer_poll(poll_id, answer_idx, event.time)
+    if event.kind == "conversation":
+      name, key, state = event.args
+      if state is None:
+        self.conversations.pop((name, key), None)
+      else:
+        self.conversations[(name, key)] = state
+      return state
+    if event.kind == "define":
+      keywords = [Keyword(**keyword) for keyword in event.args[0]]
+      for keyword in keywords:
+        self.define_vocab(keyword, -1, event.time)
+      return keywords
+    session = self.get_session(event.args[0])
+    if session is None:
+      # Archived since.
+      return None
+    if event.kind == "poll":
+      _, question_idx, poll_id = event.args
+      self.track_poll(poll_id, session, question_idx)
+      session.next_question_idx = max(session.next_question_idx,
+                                      question_idx + 1)
+      return session
+    if event.kind == "click":
+      keyword = session.keywords[event.args[1]]
+      self.click_keyword(keyword, session.session_id, event.time)
+      return keyword
+    if event.kind == "page":
+      session.current_keyword_page = event.args[1]
+      return session
+    if event.kind == "end":
+      self.end_session(session, event.time)
+      return session
+    raise ValueError(f"Unknown profile event {event.kind}")
+
+  def manifest_entry(self, today: Optional[date] = None) -> ManifestEntry:
+    today = today or date.today()
+    next_reviews = [
+      vocab.next_review for vocab in self.vocabs.dictionary.values()
+      if vocab.next_review is not None
+    ]
+    latest_session = self.sessions[-1] if self.sessions else None
+    return ManifestEntry(
+      extracting=any(session.extracting for session in self.sessions),
+      next_review=min(next_reviews, default=None),
+      due_count=sum(1 for day in next_reviews if day <= today),
+      chat_id=latest_session.chat_id if latest_session else None,
+      last_activity=(latest_session.end_time or latest_session.start_time)
+      if latest_session else None,
+      reminder_time=self.reminder_time,
+      timezone=self.timezone,
+      updated=datetime.now())
+
+  def import_vocabs(self, vocabs: List[Vocab]) -> int:
+    added = 0
+    for vocab in vocabs:
+      if self.vocabs.import_vocab(vocab):
+        self.stats.record_vocab(vocab.root)
+        added += 1
+    return added
 
   def summary(self) -> str:
-    total_sessions = len(self.sessions)
-
-    total_time_spent = sum(
-      (session.end_time - session.start_time).total_seconds() / 60
-      for session in self.sessions if session.end_time is not None)
-
-    num_vocabs = len(self.vocabs)
-
-    # Select the 100 most recent vocab encounters
-    recent_vocabs = heapq.nlargest(
-      100,
-      self.vocabs,
-      key=lambda vocab: vocab.encounters[-1].session_id
-      if vocab.encounters else 0)
-    recent_vocabs_str = ', '.join([vocab.root for vocab in recent_vocabs])
+    # Only reads the incrementally maintained stats, never the history.
+    stats = self.stats
+    recent_vocabs_str = ', '.join(reversed(stats.recent_vocabs))
+    accuracy_lines = []
+    for day in sorted(stats.daily_answers)[-7:]:
+      answers, correct = stats.daily_answers[day]
+      accuracy_lines.append(f"  {day.isoformat()}: {correct} / {answers}")
+    accuracy_str = '\n'.join(accuracy_lines) or "  No answers yet"
 
     summary_str = (f"User Profile Summary:\n"
-                   f"Total sessions: {total_sessions}\n"
-                   f"Total time spent: {total_time_spent} minutes\n"
-                   f"Number of learned vocabs: {num_vocabs}\n"
+                   f"Total sessions: {stats.session_count}\n"
+                   f"Total time spent: {round(stats.total_minutes, 2)} minutes\n"
+                   f"Number of learned vocabs: {len(self.vocabs.dictionary)}\n"
+                   f"Quiz accuracy, last days:\n{accuracy_str}\n"
                    f"Recent vocabs: {recent_vocabs_str}")
 
     return summary_str
@@ -237,41 +656,219 @@ class UserProfile:
 #     user_id = str(user_profile.user_id)
 #     db[user_id] = asdict(user_profile)
 
+def _read_file(file_path: str) -> bytes:
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def _write_file(file_path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # Writes may run concurrently in threads, replace the file atomically.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+# Event kinds that may change the manifest entry of a profile. The entry of
+# all vocabs is not recomputed for the frequent others.
+MANIFEST_EVENT_KINDS = ("answer", "click", "define", "end")
+
+
 class UserProfileDB:
-    def __init__(self, directory: str = "user_profiles"):
+    # cache_size > 0 keeps recently used profiles in memory. Only safe when
+    # this process is the single writer of its users, e.g. a sharded worker.
+    # Each process writing profiles needs its own manifest_name.
+    def __init__(self, directory: str = "user_profiles", cache_size: int = 0,
+                 manifest_name: str = "manifest"):
         self.directory = directory
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._locks = weakref.WeakValueDictionary()
+        self.journal = EventJournal()
+        self._snapshot_tasks: Dict[int, asyncio.Task] = {}
+        # Sequence number of the last snapshot written, per user.
+        self._snapshot_seqs: Dict[int, int] = {}
         os.makedirs(directory, exist_ok=True)
+        self.manifest = Manifest(directory, manifest_name)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # Profiles used to be stored flat in the directory.
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(".pkl"):
+                continue
+            file_path = self.get_user_profile_file_path(file_name[:-4])
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            try:
+                os.replace(os.path.join(self.directory, file_name), file_path)
+            except FileNotFoundError:
+                # Moved by another process.
+                pass
+        if not self.manifest.exists:
+            for file_path in self._profile_paths():
+                user_profile = pickle.loads(_read_file(file_path))
+                self.manifest.update(user_profile.user_id,
+                                     user_profile.manifest_entry())
+
+    def _profile_paths(self) -> Iterator[str]:
+        for root, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.endswith(".pkl"):
+                    yield os.path.join(root, file_name)
+
+    def lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    def _cache_put(self, user_profile: UserProfile) -> None:
+        if self.cache_size <= 0:
+            return
+        self._cache[user_profile.user_id] = user_profile
+        self._cache.move_to_end(user_profile.user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
 
     def get_user_profile_file_path(self, user_id: str) -> str:
-        return os.path.join(self.directory, f"{user_id}.pkl")
+        # Two levels of 256 subdirectories keep directories small.
+        digest = hashlib.sha1(str(user_id).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:4],
+                            f"{user_id}.pkl")
+
+    def _journal_paths(self, user_id: int):
+        base = self.get_user_profile_file_path(str(user_id))[:-4]
+        return base + JOURNAL_SUFFIX, base + HISTORY_SUFFIX
+
+    async def _replay(self, user_profile: UserProfile) -> None:
+        journal_path, _ = self._journal_paths(user_profile.user_id)
+        if not os.path.exists(journal_path):
+            return
+        for event in await self.journal.read(journal_path):
+            if event.seq > user_profile.journal_seq:
+                user_profile.apply(event)
 
     async def get_user_profile(self, user_id: int) -> UserProfile:
+        if user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            return self._cache[user_id]
         file_path = self.get_user_profile_file_path(str(user_id))
 
         if os.path.exists(file_path):
-            with open(file_path, 'rb') as f:
-                return pickle.load(f)
+            # File I/O runs in a thread, unpickling stays on the loop as
+            # sending the profile to another process would pickle it again.
+            data = await asyncio.to_thread(_read_file, file_path)
+            db_bytes.inc(len(data), op="read")
+            user_profile = pickle.loads(data)
+            await self._replay(user_profile)
+            self._cache_put(user_profile)
+            return user_profile
         else:
             user_profile = UserProfile(user_id=user_id)
             await self.set_user_profile(user_profile)
             return user_profile
 
+    async def _catch_up(self, user_profile: UserProfile) -> None:
+        # A copy loaded before other handlers recorded events would drop
+        # them, and its sequence numbers would be reused.
+        journal_path, history_path = self._journal_paths(user_profile.user_id)
+        paths = [journal_path]
+        if (user_profile.journal_seq <
+                self._snapshot_seqs.get(user_profile.user_id, 0)):
+            # A snapshot since moved the events to the history.
+            paths.insert(0, history_path)
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            for event in await self.journal.read(path):
+                if event.seq > user_profile.journal_seq:
+                    user_profile.apply(event)
+
     async def set_user_profile(self, user_profile: UserProfile) -> None:
+        """Writes a snapshot of the profile. Callers modifying a loaded
+        profile should hold the user's lock, events recorded since it was
+        loaded are replayed on it otherwise."""
         file_path = self.get_user_profile_file_path(str(user_profile.user_id))
 
-        with open(file_path, 'wb') as f:
-            pickle.dump(user_profile, f)
+        await self._catch_up(user_profile)
+        user_profile.snapshot_seq = user_profile.journal_seq
+        data = pickle.dumps(user_profile)
+        await asyncio.to_thread(_write_file, file_path, data)
+        db_bytes.inc(len(data), op="write")
+        self.manifest.update(user_profile.user_id,
+                             user_profile.manifest_entry())
+        self._cache_put(user_profile)
+        self._snapshot_seqs[user_profile.user_id] = user_profile.snapshot_seq
+        journal_path, history_path = self._journal_paths(user_profile.user_id)
+        if os.path.exists(journal_path):
+            await self.journal.compact(journal_path, history_path,
+                                       user_profile.snapshot_seq)
+
+    async def record(self, user_id: int, kind: str, *args):
+        """Applies a small mutation to the user's profile and journals it,
+        instead of rewriting the profile. Returns the result of
+        `UserProfile.apply`."""
+        async with self.lock(user_id):
+            user_profile = await self.get_user_profile(user_id)
+            return await self.record_locked(user_profile, kind, *args)
+
+    async def record_locked(self, user_profile: UserProfile, kind: str, *args):
+        """`record` on a profile loaded while holding the user's lock."""
+        event = ProfileEvent(user_profile.journal_seq + 1, datetime.now(), kind,
+                             args)
+        result = user_profile.apply(event)
+        journal_path, _ = self._journal_paths(user_profile.user_id)
+        await self.journal.append(journal_path, event)
+        if kind in MANIFEST_EVENT_KINDS:
+            self.manifest.update(user_profile.user_id,
+                                 user_profile.manifest_entry())
+        self._cache_put(user_profile)
+        if (user_profile.journal_seq - user_profile.snapshot_seq >=
+                SNAPSHOT_EVERY):
+            self._snapshot_later(user_profile.user_id)
+        return result
+
+    def _snapshot_later(self, user_id: int) -> None:
+        if user_id in self._snapshot_tasks:
+            return
+        task = asyncio.create_task(self._snapshot(user_id))
+        self._snapshot_tasks[user_id] = task
+        task.add_done_callback(
+            lambda _: self._snapshot_tasks.pop(user_id, None))
+
+    async def _snapshot(self, user_id: int) -> None:
+        # Waits for the recording handler to release the lock.
+        async with self.lock(user_id):
+            await self.set_user_profile(await self.get_user_profile(user_id))
+
+    def events(self, user_id: int) -> Iterator[ProfileEvent]:
+        """All journaled events of the user, oldest first."""
+        seq = 0
+        for path in reversed(self._journal_paths(user_id)):
+            for event in read_events(path):
+                # Compaction interrupted by a crash repeats events.
+                if event.seq > seq:
+                    seq = event.seq
+                    yield event
 
     async def remove_user_profile(self, user_id: int) -> None:
+      self._cache.pop(user_id, None)
+      self._snapshot_seqs.pop(user_id, None)
+      self.manifest.remove(user_id)
       file_path = self.get_user_profile_file_path(str(user_id))
-      if os.path.exists(file_path):
-        os.remove(file_path)
+      for path in (file_path,) + self._journal_paths(user_id):
+        if os.path.exists(path):
+          os.remove(path)
 
     async def get_all_user_profiles(self) -> List[UserProfile]:
         profiles = []
-        for file_name in os.listdir(self.directory):
-            if file_name.endswith(".pkl"):
-                file_path = os.path.join(self.directory, file_name)
-                with open(file_path, "rb") as f:
-                    profiles.append(pickle.load(f))
+        for file_path in self._profile_paths():
+            with open(file_path, "rb") as f:
+                data = f.read()
+            db_bytes.inc(len(data), op="read")
+            user_profile = pickle.loads(data)
+            await self._replay(user_profile)
+            profiles.append(user_profile)
         return profiles
@@ -1,11 +1,17 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import os
+import pickle
+import tempfile
 import unittest
-from data_models import UserProfileDB, UserProfile, LearningSession
+from data_models import (UserProfileDB, UserProfile, LearningSession,
+                         ProfileStats, Keyword, Question, Vocab, Vocabs,
+                         STATS_DAYS, vocab_key)
 
 
 class TestUserProfileDB(unittest.IsolatedAsyncioTestCase):
   def setUp(self):
-    self.user_profile_db = UserProfileDB()
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.user_profile_db = UserProfileDB(self.tmp_dir.name)
     self.test_user_id = 999999999
     self.test_user_id2 = 999999998 
 
@@ -18,6 +24,8 @@ class TestUserProfileDB(unittest.IsolatedAsyncioTestCase):
     # Clean up the test user data from the database after running the tests
     await self.user_profile_db.remove_user_profile(self.test_user_id)
     await self.user_profile_db.remove_user_profile(self.test_user_id2)
+    self.user_profile_db.manifest.close()
+    self.tmp_dir.cleanup()
 
   async def test_get_user_profile(self):
     user_profile = await self.user_profile_db.get_user_profile(self.test_user_id)
@@ -56,5 +64,193 @@ class TestUserProfileDB(unittest.IsolatedAsyncioTestCase):
     self.assertIn(user_profile_2.user_id, retrieved_user_ids)
 
 
+class TestProfileStats(unittest.TestCase):
+
+  def make_keyword(self, root: str) -> Keyword:
+    return Keyword(root=root, word=root, pos="Noun", snippet="",
+                   definition="meaning")
+
+  def test_incremental_stats(self):
+    user_profile = UserProfile(user_id=1)
+    start_time = datetime.now() - timedelta(minutes=30)
+    session = LearningSession(session_id=user_profile.new_session_id(),
+                              chat_id="1", text="text", start_time=start_time)
+    user_profile.start_session(session)
+    user_profile.click_keyword(self.make_keyword("der Apfel"), 0)
+    user_profile.define_vocab(self.make_keyword("die Birne"), -1)
+    # The same vocab without its article.
+    user_profile.click_keyword(self.make_keyword("Apfel"), 0)
+    user_profile.stats.record_answer(True)
+    user_profile.stats.record_answer(False)
+    user_profile.end_session(session)
+    # Ending it again, e.g. by a second /stoplearn, counts nothing.
+    user_profile.end_session(session, start_time + timedelta(minutes=90))
+
+    stats = user_profile.stats
+    self.assertEqual(stats.session_count, 1)
+    self.assertAlmostEqual(stats.total_minutes, 30, places=1)
+    self.assertEqual(stats.daily_answers[date.today()], [2, 1])
+    self.assertEqual(list(stats.recent_vocabs), ["die Birne", "der Apfel"])
+
+    summary = user_profile.summary()
+    self.assertIn("Total sessions: 1", summary)
+    self.assertIn("Number of learned vocabs: 2", summary)
+    self.assertIn("Recent vocabs: der Apfel, die Birne", summary)
+
+  def test_old_days_are_dropped(self):
+    stats = ProfileStats()
+    today = date.today()
+    stats.record_answer(True, today - timedelta(days=STATS_DAYS + 5))
+    stats.record_answer(True, today)
+    self.assertEqual(list(stats.daily_answers), [today])
+
+  def test_rebuild_for_old_profiles(self):
+    user_profile = UserProfile(user_id=1)
+    session = LearningSession(session_id=0, chat_id="1", text="text",
+                              start_time=datetime.now())
+    user_profile.sessions.append(session)
+    user_profile.vocabs.click_keyword(self.make_keyword("der Apfel"), 0)
+    del user_profile.__dict__["stats"]
+
+    restored = pickle.loads(pickle.dumps(user_profile))
+    self.assertEqual(restored.stats.session_count, 1)
+    self.assertEqual(list(restored.stats.recent_vocabs), ["der Apfel"])
+
+
+class TestVocabs(unittest.TestCase):
+
+  def test_vocab_key(self):
+    self.assertEqual(vocab_key("der Informationsschalter"),
+                     "informationsschalter")
+    self.assertEqual(vocab_key(" Informationsschalter "),
+                     "informationsschalter")
+    # Decomposed umlaut.
+    self.assertEqual(vocab_key("die Bru\u0308cke"), "brücke")
+    self.assertEqual(vocab_key("die"), "die")
+
+  def test_variants_share_a_vocab(self):
+    vocabs = Vocabs()
+    for root, word in (("der Informationsschalter", "Informationsschalter"),
+                       ("informationsschalter", "informationsschalter"),
+                       ("der Zug", "Zügen")):
+      vocabs.click_keyword(
+        Keyword(root=root, word=word, pos="Noun", snippet="",
+                definition="x"), 0)
+    self.assertEqual(len(vocabs.dictionary), 2)
+    vocab = vocabs.get("Informationsschalter")
+    self.assertEqual(vocab.root, "der Informationsschalter")
+    self.assertEqual(len(vocab.encounters), 2)
+    self.assertIs(vocabs.get("zügen"), vocabs.get("der Zug"))
+    self.assertIsNone(vocabs.get("der Bus"))
+
+  def test_merges_duplicates_of_old_profiles(self):
+    vocabs = Vocabs()
+    old = Vocab(root="Informationsschalter", last_review=date(2023, 5, 1),
+                interval=1)
+    new = Vocab(root="der Informationsschalter",
+                last_review=date(2023, 5, 3), interval=6)
+    question = Question(question="q", options=["a", "b"], correct_idx=0,
+                        explanation="")
+    old.quiz.append(question)
+    new.quiz.append(question)
+    # Keyed by raw roots, as pickled by older versions.
+    vocabs.__dict__.pop("surface_index")
+    vocabs.dictionary = {old.root: old, new.root: new,
+                         "gehen": Vocab(root="gehen")}
+    vocabs = pickle.loads(pickle.dumps(vocabs))
+    self.assertEqual(sorted(vocabs.dictionary),
+                     ["gehen", "informationsschalter"])
+    merged = vocabs.get("informationsschalter")
+    self.assertEqual((merged.root, merged.interval),
+                     ("der Informationsschalter", 6))
+    self.assertEqual(len(merged.quiz), 1)
+
+
+class TestPolls(unittest.TestCase):
+
+  def setUp(self):
+    self.user_profile = UserProfile(user_id=1)
+    for root in ("der Apfel", "die Birne"):
+      self.user_profile.click_keyword(
+        Keyword(root=root, word=root, pos="Noun", snippet="",
+                definition=root), session_id=0)
+    self.session = LearningSession(
+      session_id=0, chat_id="1", text="VocabQuiz",
+      start_time=datetime.now(), vocab_roots=["der Apfel", "die Birne"],
+      quiz=[
+        Question(question=f"q{i}", options=["a", "b"], correct_idx=0,
+                 explanation="") for i in range(2)
+      ])
+    self.user_profile.start_session(self.session)
+    for i in range(2):
+      self.user_profile.track_poll(f"poll{i}", self.session, i)
+      self.session.next_question_idx += 1
+
+  def test_answers_in_any_order(self):
+    self.assertEqual(self.user_profile.pending_polls(0), 2)
+    apfel = self.user_profile.vocabs.get("der Apfel")
+    birne = self.user_profile.vocabs.get("die Birne")
+    apfel_interval = apfel.interval
+
+    self.assertIs(self.user_profile.answer_poll("poll1", 0), self.session)
+    self.assertEqual(self.session.quiz[1].answer_idx, 0)
+    self.assertIsNone(self.session.quiz[0].answer_idx)
+    self.assertEqual(birne.repetitions, 2)
+    self.assertEqual(apfel.interval, apfel_interval)
+
+    self.assertIs(self.user_profile.answer_poll("poll0", 1), self.session)
+    self.assertEqual(self.session.quiz[0].answer_idx, 1)
+    self.assertEqual(apfel.repetitions, 0)
+    self.assertEqual(self.user_profile.pending_polls(0), 0)
+
+    # Repeated and unknown polls are ignored.
+    self.assertIsNone(self.user_profile.answer_poll("poll0", 0))
+    self.assertEqual(self.user_profile.stats.daily_answers[date.today()],
+                     [2, 1])
+
+  def test_untracked_polls_of_older_versions(self):
+    self.user_profile.polls.clear()
+    self.assertIs(self.user_profile.answer_poll("old", 0), self.session)
+    self.assertEqual(self.session.quiz[1].answer_idx, 0)
+
+
+class TestProfileStore(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.directory = self.tmp_dir.name
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  async def test_migrates_flat_profiles_and_builds_manifest(self):
+    user_profile = UserProfile(user_id=5)
+    user_profile.sessions.append(
+      LearningSession(session_id=0, chat_id="55", text="text",
+                      start_time=datetime(2023, 5, 1)))
+    with open(os.path.join(self.directory, "5.pkl"), "wb") as f:
+      pickle.dump(user_profile, f)
+
+    db = UserProfileDB(self.directory)
+    file_path = db.get_user_profile_file_path("5")
+    self.assertTrue(os.path.exists(file_path))
+    self.assertNotEqual(os.path.dirname(file_path), self.directory)
+    self.assertEqual(db.manifest.entries[5].chat_id, "55")
+    self.assertEqual((await db.get_user_profile(5)).sessions[0].chat_id, "55")
+
+  async def test_manifest_tracks_due_vocabs(self):
+    db = UserProfileDB(self.directory)
+    user_profile = await db.get_user_profile(6)
+    self.assertIsNone(db.manifest.entries[6].next_review)
+    user_profile.click_keyword(
+      Keyword(root="gehen", word="gehen", pos="Verb", snippet="",
+              definition="to go"), session_id=0)
+    await db.set_user_profile(user_profile)
+    entry = UserProfileDB(self.directory).manifest.entries[6]
+    self.assertEqual(entry.next_review, date.today() + timedelta(days=1))
+    self.assertFalse(entry.has_due(date.today()))
+    self.assertTrue(entry.has_due(date.today() + timedelta(days=1)))
+
+
 if __name__ == '__main__':
     unittest.main()
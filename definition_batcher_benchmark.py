@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import random
+import re
+import time
+
+from langchain.schema import Generation, LLMResult
+
+from definition_extractor import DefinitionExtractor
+from model_router import ModelRouter, ModelTier
+
+
+class FakeLLM:
+  """Latency grows with the completion, and at most `concurrency` calls run
+  at once, like an API rate limit."""
+
+  def __init__(self, base_latency: float, per_word_latency: float,
+               concurrency: int):
+    self.base_latency = base_latency
+    self.per_word_latency = per_word_latency
+    self.semaphore = asyncio.Semaphore(concurrency)
+    self.calls = 0
+
+  async def agenerate(self, inputs):
+    words = ([inputs[0]["word"]] if "word" in inputs[0] else
+             re.findall(r"`([^`]+)`", inputs[0]["words"]))
+    async with self.semaphore:
+      self.calls += 1
+      await asyncio.sleep(self.base_latency +
+                          self.per_word_latency * len(words))
+    text = "".join(f"input={word};root={word};pos=Verb;art=;"
+                   f"def=meaning of {word};ex=Ich {word}.\n" for word in words)
+    return LLMResult(generations=[[Generation(text=text)]])
+
+
+async def run(args, window: float):
+  llm = FakeLLM(args.base_latency, args.per_word_latency, args.concurrency)
+  router = ModelRouter([ModelTier("fake", "fake")],
+                       chain_factory=lambda prompt, tier: llm)
+  extractor = DefinitionExtractor(router=router, batch_window=window,
+                                  max_batch_size=args.batch_size)
+  latencies = []
+
+  async def define(i: int):
+    start = time.perf_counter()
+    keywords = await extractor.extract_definitions(f"wort{i}")
+    assert keywords and keywords[0].word == f"wort{i}"
+    latencies.append(time.perf_counter() - start)
+
+  start = time.perf_counter()
+  tasks = []
+  for i in range(args.requests):
+    tasks.append(asyncio.create_task(define(i)))
+    await asyncio.sleep(random.expovariate(args.rate))
+  await asyncio.gather(*tasks)
+  elapsed = time.perf_counter() - start
+  latencies.sort()
+  return (llm.calls, latencies[len(latencies) // 2],
+          latencies[int(len(latencies) * 0.95)], args.requests / elapsed)
+
+
+async def main(args):
+  random.seed(0)
+  for window in args.windows:
+    calls, p50, p95, throughput = await run(args, window)
+    print(f"window={window * 1000:.0f}ms: {calls} LLM calls for "
+          f"{args.requests} requests, latency p50={p50 * 1000:.0f}ms "
+          f"p95={p95 * 1000:.0f}ms, {throughput:.1f} requests/s")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="/define latency and LLM calls with micro-batching against "
+    "a fake LLM")
+  parser.add_argument("--requests", type=int, default=400)
+  parser.add_argument("--rate", type=float, default=100,
+                      help="requests per second")
+  parser.add_argument("--base-latency", type=float, default=0.5)
+  parser.add_argument("--per-word-latency", type=float, default=0.1)
+  parser.add_argument("--concurrency", type=int, default=10)
+  parser.add_argument("--batch-size", type=int, default=8)
+  parser.add_argument("--windows", type=float, nargs="+",
+                      default=[0, 0.01, 0.05, 0.1])
+  asyncio.run(main(parser.parse_args()))
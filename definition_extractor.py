@@ -1,14 +1,39 @@
 import re
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import PromptTemplate
 from data_models import Keyword
-from typing import List
+from metrics import record_parse
+from micro_batcher import MAX_BATCH_SIZE, MicroBatcher
+from model_router import ModelRouter
+from typing import Dict, List
+
+
+def parse_definitions(output: str) -> List[Keyword]:
+  extracted_keywords = []
+  pattern = r"input=(.+);\s?root=(.*);\s?pos=(.+);\s?art=(.*);\s?def=(.+);\s?ex=(.+)"
+  for match in re.finditer(pattern, output):
+    word, root, pos, art, definition, example = match.groups()
+    # Models often echo the input as quoted in the prompt.
+    word = word.strip().strip("`'\"")
+    if not root:
+      root = word
+    if pos.lower() == "noun" and art:
+      root = f'{art} {root}'
+    keyword = Keyword(root=root, word=word, pos=pos, snippet=example,
+                      definition=definition)
+    extracted_keywords.append(keyword)
+  return extracted_keywords
 
 
 class DefinitionExtractor:
 
-  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7):
-    self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
+  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7,
+               lemma_dictionary=None, definition_log=None, router=None,
+               batch_window=0.0, max_batch_size=MAX_BATCH_SIZE):
+    # Known words are looked up in the LemmaDictionary, and new definitions
+    # recorded in the DefinitionLog it is built from.
+    self.lemma_dictionary = lemma_dictionary
+    self.definition_log = definition_log
+    self.router = router or ModelRouter.single(model_name, temperature)
 
     self.define_template = PromptTemplate(template=(
       "Return information about the German word `{word}` in English. "
@@ -23,24 +48,57 @@ class DefinitionExtractor:
       "input=fahren;root=Fahren;pos=Noun;art=das;def=driving;"
       "ex=Das Fahren mit dem Fahrrad macht Spaß (Riding a bicycle is fun)."),
                                           input_variables=["word"])
-
-    self.define_chain = LLMChain(prompt=self.define_template,
-                                 llm=self.model,
-                                 verbose=True)
+    self.define_words_template = PromptTemplate(template=(
+      "Return information about each of the German words {words} in "
+      "English. For each meaning of each word, provides the following "
+      "fields: input=the word being asked, copied exactly;root=root form of "
+      "the word for the current meaning;pos=part of speech in abbr (Noun, "
+      "Adj, Adv,...);art=the article (der/die/das) if it's a noun, otherwise "
+      "leave empty;def=meaning;ex=a German example of the word being used.\n"
+      "The output presents one meaning in a single line. Example:\n"
+      "input=fahren;root=fahren;pos=Verb;art=;def=to drive/to ride/to travel;"
+      "ex=Ich fahre morgen nach Berlin (I'm driving/going to Berlin tomorrow)."
+      "input=fahren;root=Fahren;pos=Noun;art=das;def=driving;"
+      "ex=Das Fahren mit dem Fahrrad macht Spaß (Riding a bicycle is fun)."),
+                                                input_variables=["words"])
+    # Concurrent /define requests of all users are sent as one prompt.
+    self.batcher = MicroBatcher(
+      "definition", self._define_words, window=batch_window,
+      max_batch_size=max_batch_size) if batch_window > 0 else None
 
   async def extract_definitions(self, word: str) -> List[Keyword]:
-    extracted_keywords = []
-    defined_word_str = await self.define_chain.apredict(word=word)
-    print(defined_word_str)
-    pattern = r"input=(.+);\s?root=(.*);\s?pos=(.+);\s?art=(.*);\s?def=(.+);\s?ex=(.+)"
-    for match in re.finditer(pattern, defined_word_str):
-      word, root, pos, art, definition, example = match.groups()
-      if not root:
-        root = word
-      if pos.lower() == "noun" and art:
-        root = f'{art} {root}'
-      keyword = Keyword(root=root, word=word, pos=pos, snippet=example,
-                        definition=definition)
-      extracted_keywords.append(keyword)
-    print(extracted_keywords)
-    return extracted_keywords
+    if self.lemma_dictionary is not None:
+      keywords = self.lemma_dictionary.lookup(word)
+      if keywords:
+        return keywords
+    if self.batcher is not None:
+      return await self.batcher.submit(word) or []
+    return (await self._define_words([word])).get(word, [])
+
+  async def _define_words(self, words: List[str]) -> Dict[str, List[Keyword]]:
+    if len(words) == 1:
+      template, inputs = self.define_template, dict(word=words[0])
+    else:
+      template = self.define_words_template
+      inputs = dict(words=", ".join(f"`{word}`" for word in words))
+    _, extracted_keywords = await self.router.run(
+      template, "definition", "define", parse=parse_definitions,
+      expected_records=len(words), **inputs)
+    record_parse("definition", "define", len(extracted_keywords))
+    if self.definition_log is not None:
+      self.definition_log.record(extracted_keywords)
+    if len(words) == 1:
+      return {words[0]: extracted_keywords}
+    # Split the meanings back to the requested words by their input field.
+    requested: Dict[str, List[str]] = {}
+    for word in words:
+      requested.setdefault(word.strip().lower(), []).append(word)
+    definitions = {}
+    for keyword in extracted_keywords:
+      input_word = keyword.word.strip()
+      # The exact word, or else all words differing only in case.
+      matches = ([input_word] if input_word in words else
+                 requested.get(input_word.lower(), []))
+      for word in matches:
+        definitions.setdefault(word, []).append(keyword)
+    return definitions
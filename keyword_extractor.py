@@ -1,25 +1,73 @@
+import asyncio
 import re
 import nltk
 from typing import List
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import PromptTemplate
 from data_models import Keyword
+from metrics import record_parse
+from cpu_offload import offloader
+from model_router import ModelRouter
+from token_budget import PromptBudget
 
 nltk.download('punkt')
 
+# Keywords listed per text, unless the caller asks for fewer.
+MAX_KEYWORDS = 25
+
+
+# Module-level so that they can run in the CpuOffloader's process pool.
+def parse_keywords(output: str) -> List[Keyword]:
+  extracted_keywords = []
+  pattern = r"input=(.+);\s?root=(.+);\s?pos=(.+);\s?art=(.*);\s?def=(.+)"
+  for match in re.finditer(pattern, output):
+    word, root, pos, art, definition = match.groups()
+    snippet = ""  # Set to empty string since it is not provided in the input
+    if pos.lower() == "noun" and art:
+      root = f'{art} {root}'
+    keyword = Keyword(root=root,
+                      word=word,
+                      pos=pos,
+                      snippet=snippet,
+                      definition=definition)
+    extracted_keywords.append(keyword)
+  return extracted_keywords
+
+
+def find_sentences(keywords: List[str], text: str) -> List[str]:
+  sentences = nltk.sent_tokenize(text)
+  found_sentences = []
+
+  for keyword in keywords:
+    lower_keyword = keyword.lower()
+    pattern = re.compile(rf"\b{re.escape(lower_keyword)}\b", re.IGNORECASE)
+
+    for sentence in sentences:
+      if pattern.search(sentence):
+        found_sentences.append(sentence)
+        break
+    else:
+      found_sentences.append("")
+
+  return found_sentences
+
 
 class KeywordExtractor:
 
-  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7):
-    self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
+  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7,
+               lemma_dictionary=None, definition_log=None, router=None):
+    # Known words are looked up in the LemmaDictionary, and new definitions
+    # recorded in the DefinitionLog it is built from.
+    self.lemma_dictionary = lemma_dictionary
+    self.definition_log = definition_log
+    self.router = router or ModelRouter.single(model_name, temperature)
 
     self.list_keywords_template = PromptTemplate(
       template=(
-        "Carefully list max 25 important vocabularies (noun, verb, adj, adv,...) "
-        "sorted from most difficult to least. "
+        "Carefully list max {max_keywords} important vocabularies (noun, "
+        "verb, adj, adv,...) sorted from most difficult to least. "
         "The vocabs must appear exactly in the text. \n\n"
         "{text}\n\n{format_instructions}"),
-      input_variables=["text"],
+      input_variables=["text", "max_keywords"],
       partial_variables={
         "format_instructions":
         "The output is a single line containing comma-separated list of vocabs"
@@ -32,66 +80,81 @@ class KeywordExtractor:
         "root=root form of the keyword;"
         "art=the article (der/die/das) if the keyword is noun, otherwise empty;"
         "pos=noun, verb, adj, adv, prep, conj,...;def=its meaning\n\n"
-        "Keywords: {keywords}\n\n{format_instructions}"),
-      input_variables=["keywords"],
+        "Keywords: {keywords}\n\n{format_instructions}{examples}"),
+      input_variables=["keywords", "examples"],
       partial_variables={
         "format_instructions":
-        ("The output should present one Keyword per line. Example:\n"
-         "input=Informationsschalter;root=Informationsschalter;"
-         "pos=Noun;art=der;def=information desk\n"
-         "input=sonniger;root=sonnig;pos=Adj;art=;def=sunny")
+        "The output should present one Keyword per line."
       })
+    self.define_budget = PromptBudget(
+      "keyword", "define",
+      examples=(" Example:\n"
+                "input=Informationsschalter;root=Informationsschalter;"
+                "pos=Noun;art=der;def=information desk\n"
+                "input=sonniger;root=sonnig;pos=Adj;art=;def=sunny"),
+      tokens_per_item=25)
 
-    self.list_keywords_chain = LLMChain(prompt=self.list_keywords_template,
-                                        llm=self.model,
-                                        verbose=True)
-
-    self.define_chain = LLMChain(prompt=self.define_template,
-                                 llm=self.model,
-                                 verbose=True)
-
-  def _find_sentences(self, keywords: List[str], text: str) -> List[str]:
-    sentences = nltk.sent_tokenize(text)
-    found_sentences = []
+  async def _define_batch(self, words: List[str]) -> List[Keyword]:
+    with_examples = self.define_budget.use_examples()
+    inputs = dict(keywords=", ".join(words),
+                  examples=self.define_budget.prompt_examples(with_examples))
+    self.define_budget.record_prompt(self.define_template.format(**inputs),
+                                     with_examples)
+    output, keywords = await self.router.run(self.define_template, "keyword",
+                                             "define", parse=parse_keywords,
+                                             expected_records=len(words),
+                                             **inputs)
+    self.define_budget.record_result(with_examples, len(words), output,
+                                     len(keywords))
+    return keywords
 
-    for keyword in keywords:
-      lower_keyword = keyword.lower()
-      pattern = re.compile(rf"\b{re.escape(lower_keyword)}\b", re.IGNORECASE)
+  async def define_keywords(self, words: List[str]) -> List[Keyword]:
+    known = {}
+    if self.lemma_dictionary is not None:
+      for word in words:
+        meanings = self.lemma_dictionary.lookup(word)
+        if meanings:
+          known[word] = meanings[0]
+    missing = [word for word in words if word not in known]
+    results = await asyncio.gather(*[
+      self._define_batch(batch) for batch in self.define_budget.batches(missing)
+    ])
+    defined = [keyword for batch in results for keyword in batch]
+    record_parse("keyword", "define", len(defined))
+    if self.definition_log is not None:
+      self.definition_log.record(defined)
+    if not known:
+      return defined
+    # Keep the order of the words, they are sorted by difficulty.
+    by_word = {keyword.word.lower(): keyword for keyword in defined}
+    keywords = []
+    for word in words:
+      keyword = known.get(word) or by_word.pop(word.lower(), None)
+      if keyword is not None:
+        keywords.append(keyword)
+    return keywords + list(by_word.values())
 
-      for sentence in sentences:
-        if pattern.search(sentence):
-          found_sentences.append(sentence)
-          break
-      else:
-        found_sentences.append("")
+  async def list_keywords(self, text: str,
+                          max_keywords: int = MAX_KEYWORDS) -> List[str]:
+    keywords_str, _ = await self.router.run(self.list_keywords_template,
+                                            "keyword", "list", text=text,
+                                            max_keywords=max_keywords)
+    words = [word.strip() for word in re.split(r"[,\n]", keywords_str)]
+    return [word for word in words if word][:max_keywords]
 
-    return found_sentences
+  async def find_snippets(self, keywords: List[Keyword], text: str) -> None:
+    sentences = await offloader.run(len(text), find_sentences,
+                                    [kw.word for kw in keywords], text)
+    for keyword, sentence in zip(keywords, sentences):
+      keyword.snippet = sentence
 
-  async def extract_keywords(self, text: str) -> List[Keyword]:
+  async def extract_keywords(self, text: str,
+                             max_keywords: int = MAX_KEYWORDS
+                             ) -> List[Keyword]:
     # Step 1: List all keywords
-    keywords_str = await self.list_keywords_chain.apredict(text=text)
-    print(keywords_str)
-    # Step 2: Define these keywords
-    extracted_keywords = []
-    defined_keywords_str = await self.define_chain.apredict(
-      keywords=keywords_str)
-    print(defined_keywords_str)
-    # Step 3: Parse keywords
-    pattern = r"input=(.+);\s?root=(.+);\s?pos=(.+);\s?art=(.*);\s?def=(.+)"
-    for match in re.finditer(pattern, defined_keywords_str):
-      word, root, pos, art, definition = match.groups()
-      snippet = ""  # Set to empty string since it is not provided in the input
-      if pos.lower() == "noun" and art:
-        root = f'{art} {root}'
-      keyword = Keyword(root=root,
-                        word=word,
-                        pos=pos,
-                        snippet=snippet,
-                        definition=definition)
-      extracted_keywords.append(keyword)
-    # Step 4: Find snippet.
-    for i, sentence in enumerate(
-        self._find_sentences([kw.word for kw in extracted_keywords], text)):
-      extracted_keywords[i].snippet = sentence
-    print(extracted_keywords)
+    words = await self.list_keywords(text, max_keywords)
+    # Step 2: Define these keywords, in batches small enough to not get cut.
+    extracted_keywords = await self.define_keywords(words)
+    # Step 3: Find snippet.
+    await self.find_snippets(extracted_keywords, text)
     return extracted_keywords
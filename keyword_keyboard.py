@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from data_models import LearningSession
+
+KEYWORDS_PER_ROW = 3
+KEYWORDS_PER_PAGE = 3 * KEYWORDS_PER_ROW
+CACHE_SIZE = 1024
+
+# Callback payloads carry ids instead of words, so they always fit in
+# Telegram's 64 bytes limit:
+#   "kw <session_id> <keyword_idx>" and "page <session_id> <page>".
+CALLBACK_PATTERN = r'^(kw|page|keyword|prev_page|next_page)\b'
+
+
+def keyword_callback(session_id: int, keyword_idx: int) -> str:
+  return f"kw {session_id} {keyword_idx}"
+
+
+def page_callback(session_id: int, page: int) -> str:
+  return f"page {session_id} {page}"
+
+
+def parse_callback(data: str) -> Tuple[str, Optional[int], Optional[str]]:
+  """Returns (kind, session_id, value).
+
+  Keyboards sent before the compact payloads carry "keyword <word>",
+  "prev_page" or "next_page" and have no session id.
+  """
+  parts = data.split()
+  if parts[0] in ("kw", "page") and len(parts) == 3:
+    return parts[0], int(parts[1]), parts[2]
+  return parts[0], None, ' '.join(parts[1:])
+
+
+def max_page(session: LearningSession) -> int:
+  return max(0, (len(session.keywords) - 1) // KEYWORDS_PER_PAGE)
+
+
+class KeywordKeyboards:
+  """LRU cache of keyword keyboard pages, keywords of a session never change
+  once extracted, so each page is built once."""
+
+  def __init__(self, cache_size: int = CACHE_SIZE):
+    self.cache_size = cache_size
+    self._cache: OrderedDict = OrderedDict()
+
+  def markup(self, user_id: int, session: LearningSession,
+             page: Optional[int] = None) -> InlineKeyboardMarkup:
+    page = session.current_keyword_page if page is None else page
+    key = (user_id, session.session_id, page, len(session.keywords))
+    if key in self._cache:
+      self._cache.move_to_end(key)
+      return self._cache[key]
+
+    markup = self._build(session, page)
+    self._cache[key] = markup
+    if len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False)
+    return markup
+
+  def _build(self, session: LearningSession,
+             page: int) -> InlineKeyboardMarkup:
+    start_index = page * KEYWORDS_PER_PAGE
+    end_index = min(start_index + KEYWORDS_PER_PAGE, len(session.keywords))
+    indices = list(range(start_index, end_index))
+
+    keyboard = [[
+      InlineKeyboardButton(text=session.keywords[idx].word,
+                           callback_data=keyword_callback(
+                             session.session_id, idx))
+      for idx in indices[i:i + KEYWORDS_PER_ROW]
+    ] for i in range(0, len(indices), KEYWORDS_PER_ROW)]
+
+    # Add << and >> buttons at the end to allow user to increase or decrease the current page.
+    navigation_buttons = [
+      InlineKeyboardButton("<<",
+                           callback_data=page_callback(
+                             session.session_id, max(0, page - 1))),
+      InlineKeyboardButton(">>",
+                           callback_data=page_callback(
+                             session.session_id,
+                             min(max_page(session), page + 1)))
+    ]
+    keyboard.append(navigation_buttons)
+
+    return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,66 @@
+import unittest
+from datetime import datetime
+
+from data_models import Keyword, LearningSession, UserProfile
+from keyword_keyboard import (KeywordKeyboards, KEYWORDS_PER_PAGE, max_page,
+                              parse_callback)
+
+
+def make_session(session_id: int, num_keywords: int) -> LearningSession:
+  session = LearningSession(session_id=session_id, chat_id="1", text="text",
+                            start_time=datetime.now())
+  session.keywords = [
+    Keyword(root=f"root{i}",
+            word=f"Donaudampfschifffahrtsgesellschaftskapitän{i}",
+            pos="Noun", snippet="", definition="captain")
+    for i in range(num_keywords)
+  ]
+  return session
+
+
+class TestKeywordKeyboards(unittest.TestCase):
+
+  def test_compact_callback_data(self):
+    session = make_session(12345, 20)
+    markup = KeywordKeyboards().markup(1, session, page=1)
+    buttons = [b for row in markup.inline_keyboard for b in row]
+    for button in buttons:
+      self.assertLessEqual(len(button.callback_data.encode()), 64)
+    self.assertEqual(parse_callback(buttons[0].callback_data),
+                     ("kw", 12345, str(KEYWORDS_PER_PAGE)))
+    self.assertEqual(parse_callback(buttons[-2].callback_data),
+                     ("page", 12345, "0"))
+    self.assertEqual(parse_callback(buttons[-1].callback_data),
+                     ("page", 12345, "2"))
+
+  def test_last_page(self):
+    session = make_session(0, 20)
+    self.assertEqual(max_page(session), 2)
+    markup = KeywordKeyboards().markup(1, session, page=2)
+    keyword_buttons = [b for row in markup.inline_keyboard[:-1] for b in row]
+    self.assertEqual(len(keyword_buttons), 2)
+
+  def test_cache(self):
+    keyboards = KeywordKeyboards(cache_size=2)
+    session = make_session(0, 20)
+    markup = keyboards.markup(1, session, page=0)
+    self.assertIs(keyboards.markup(1, session, page=0), markup)
+    keyboards.markup(1, session, page=1)
+    keyboards.markup(1, session, page=2)
+    self.assertIsNot(keyboards.markup(1, session, page=0), markup)
+
+  def test_legacy_callback(self):
+    self.assertEqual(parse_callback("keyword der Zug"),
+                     ("keyword", None, "der Zug"))
+    self.assertEqual(parse_callback("next_page"), ("next_page", None, ""))
+
+  def test_get_session(self):
+    user_profile = UserProfile(user_id=1)
+    for session_id in range(5, 9):
+      user_profile.sessions.append(make_session(session_id, 0))
+    self.assertEqual(user_profile.get_session(7).session_id, 7)
+    self.assertIsNone(user_profile.get_session(2))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data_models import Keyword, UserProfileDB
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LEMMA_DICTIONARY_PATH = "lemma.dict"
+DEFINITION_LOG_PATH = "definitions.jsonl"
+MAGIC = b"LEMMA001"
+# Magic, then the number of keys.
+HEADER = struct.Struct("<8sQ")
+OFFSET = struct.Struct("<Q")
+KEY_LENGTH = struct.Struct("<H")
+VALUE_LENGTH = struct.Struct("<I")
+ARTICLES = ("der ", "die ", "das ")
+
+lookups = registry.counter("bot_lemma_lookups_total",
+                           "Local dictionary lookups by result", ["result"])
+
+
+def normalize(word: str) -> str:
+  return unicodedata.normalize("NFC", word).strip().lower()
+
+
+def surface_keys(keyword: Keyword) -> List[str]:
+  """The forms a keyword is found by: the inflected word, and the root with
+  and without its article."""
+  keys = {normalize(keyword.word), normalize(keyword.root)}
+  for key in list(keys):
+    if key.startswith(ARTICLES):
+      keys.add(key.split(" ", 1)[1])
+  keys.discard("")
+  return sorted(keys)
+
+
+class DefinitionLog:
+  """Appends every definition the LLM returns to a JSON lines file, the
+  input of `build_dictionary`. Lines are short, so appends of several
+  worker processes do not interleave."""
+
+  def __init__(self, path: str = DEFINITION_LOG_PATH):
+    self.path = path
+
+  def record(self, keywords: Iterable[Keyword]):
+    lines = "".join(
+      json.dumps(keyword.dict(), ensure_ascii=False) + "\n"
+      for keyword in keywords)
+    if lines:
+      with open(self.path, "a", encoding="utf-8") as f:
+        f.write(lines)
+
+  def read(self) -> Iterable[Keyword]:
+    if not os.path.exists(self.path):
+      return
+    with open(self.path, encoding="utf-8") as f:
+      for line in f:
+        try:
+          yield Keyword(**json.loads(line))
+        except ValueError:
+          continue
+
+
+def build_dictionary(keywords: Iterable[Keyword], path: str) -> int:
+  """Writes a sorted-key file mapping surface forms to their meanings.
+  Returns the number of keys."""
+  entries: Dict[bytes, Dict[Tuple[str, str, str], str]] = {}
+  for keyword in keywords:
+    if not keyword.definition:
+      continue
+    for key in surface_keys(keyword):
+      meanings = entries.setdefault(key.encode(), {})
+      # Later outputs overwrite the example of the same meaning.
+      meanings[(keyword.root, keyword.pos, keyword.definition)] = (
+        keyword.snippet)
+  keys = sorted(entries)
+  tmp_path = f"{path}.tmp"
+  with open(tmp_path, "wb") as f:
+    f.write(HEADER.pack(MAGIC, len(keys)))
+    offset = HEADER.size + OFFSET.size * len(keys)
+    records = []
+    for key in keys:
+      value = json.dumps([[root, pos, definition, example]
+                          for (root, pos, definition), example in
+                          entries[key].items()],
+                         ensure_ascii=False).encode()
+      record = (KEY_LENGTH.pack(len(key)) + key +
+                VALUE_LENGTH.pack(len(value)) + value)
+      f.write(OFFSET.pack(offset))
+      offset += len(record)
+      records.append(record)
+    for record in records:
+      f.write(record)
+  os.replace(tmp_path, path)
+  return len(keys)
+
+
+class LemmaDictionary:
+  """Read-only lookup of inflected forms in a file built by
+  `build_dictionary`. The file is memory mapped, so worker processes share
+  its pages, and a lookup is a binary search over the sorted keys."""
+
+  def __init__(self, path: str = LEMMA_DICTIONARY_PATH):
+    self.path = path
+    self._mmap: Optional[mmap.mmap] = None
+    self._count = 0
+    if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+      with open(path, "rb") as f:
+        self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      magic, self._count = HEADER.unpack_from(self._mmap, 0)
+      if magic != MAGIC:
+        logger.warning(f"Ignoring {path}, it is not a lemma dictionary")
+        self.close()
+    elif path:
+      logger.info(f"No lemma dictionary at {path}")
+
+  def __len__(self) -> int:
+    return self._count
+
+  def close(self):
+    if self._mmap is not None:
+      self._mmap.close()
+    self._mmap, self._count = None, 0
+
+  def _key(self, index: int) -> Tuple[bytes, int]:
+    offset, = OFFSET.unpack_from(self._mmap, HEADER.size + OFFSET.size * index)
+    length, = KEY_LENGTH.unpack_from(self._mmap, offset)
+    start = offset + KEY_LENGTH.size
+    return self._mmap[start:start + length], start + length
+
+  def _value(self, offset: int) -> bytes:
+    length, = VALUE_LENGTH.unpack_from(self._mmap, offset)
+    start = offset + VALUE_LENGTH.size
+    return self._mmap[start:start + length]
+
+  def lookup(self, word: str) -> List[Keyword]:
+    """All meanings of `word`, with `word` as the keyword's word."""
+    key = normalize(word).encode()
+    low, high = 0, self._count
+    while low < high:
+      middle = (low + high) // 2
+      middle_key, value_offset = self._key(middle)
+      if middle_key < key:
+        low = middle + 1
+      elif middle_key > key:
+        high = middle
+      else:
+        lookups.inc(result="hit")
+        return [
+          Keyword(root=root, word=word.strip(), pos=pos, snippet=example,
+                  definition=definition) for root, pos, definition, example in
+          json.loads(self._value(value_offset))
+        ]
+    lookups.inc(result="miss")
+    return []
+
+
+async def _collect_keywords(args) -> List[Keyword]:
+  keywords = list(DefinitionLog(args.log).read())
+  if args.profiles:
+    db = UserProfileDB(args.profiles, manifest_name="lemma_dictionary")
+    for user_profile in await db.get_all_user_profiles():
+      for vocab in user_profile.vocabs.dictionary.values():
+        keywords.extend(
+          Keyword(root=vocab.root, word=encounter.word, pos=encounter.pos,
+                  snippet=encounter.snippet, definition=encounter.definition)
+          for encounter in vocab.encounters)
+  return keywords
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Builds or queries the local lemma dictionary")
+  commands = parser.add_subparsers(dest="command", required=True)
+  build_parser = commands.add_parser(
+    "build", help="build from the definition log and vocab encounters")
+  build_parser.add_argument("--log", default=DEFINITION_LOG_PATH)
+  build_parser.add_argument("--profiles", default="user_profiles",
+                            help="profile directory, empty to skip")
+  build_parser.add_argument("--output", default=LEMMA_DICTIONARY_PATH)
+  lookup_parser = commands.add_parser("lookup", help="look up words")
+  lookup_parser.add_argument("words", nargs="+")
+  lookup_parser.add_argument("--dictionary", default=LEMMA_DICTIONARY_PATH)
+  args = parser.parse_args()
+  if args.command == "build":
+    keywords = asyncio.run(_collect_keywords(args))
+    count = build_dictionary(keywords, args.output)
+    print(f"Wrote {count} keys from {len(keywords)} definitions to "
+          f"{args.output}")
+    return
+  dictionary = LemmaDictionary(args.dictionary)
+  for word in args.words:
+    start = time.perf_counter()
+    keywords = dictionary.lookup(word)
+    elapsed = time.perf_counter() - start
+    print(f"{word} ({elapsed * 1e6:.0f}us):")
+    for keyword in keywords:
+      print(f"  {keyword.summary()}")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from data_models import Keyword
+from lemma_dictionary import DefinitionLog, LemmaDictionary, build_dictionary
+
+
+def keyword(word, root, pos, definition, snippet=""):
+  return Keyword(root=root, word=word, pos=pos, snippet=snippet,
+                 definition=definition)
+
+
+class TestLemmaDictionary(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp_dir.name, "lemma.dict")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_lookup_inflected_forms(self):
+    log = DefinitionLog(os.path.join(self.tmp_dir.name, "definitions.jsonl"))
+    log.record([
+      keyword("Zügen", "der Zug", "Noun", "train"),
+      keyword("sonniger", "sonnig", "Adj", "sunny"),
+      keyword("fährt", "fahren", "Verb", "to drive", "Er fährt nach Hause."),
+      keyword("fahren", "fahren", "Verb", "to ride"),
+    ])
+    count = build_dictionary(log.read(), self.path)
+    self.assertEqual(count, 7)
+
+    dictionary = LemmaDictionary(self.path)
+    self.assertEqual(len(dictionary), 7)
+    zug = dictionary.lookup("zügen")
+    self.assertEqual([(k.root, k.word, k.definition) for k in zug],
+                     [("der Zug", "zügen", "train")])
+    self.assertEqual(dictionary.lookup("Zug")[0].root, "der Zug")
+    self.assertEqual(dictionary.lookup(" Sonniger ")[0].root, "sonnig")
+    self.assertEqual(dictionary.lookup("fährt")[0].snippet,
+                     "Er fährt nach Hause.")
+    self.assertEqual({k.definition for k in dictionary.lookup("fahren")},
+                     {"to drive", "to ride"})
+    self.assertEqual(dictionary.lookup("Haus"), [])
+    self.assertEqual(dictionary.lookup("aaa"), [])
+    self.assertEqual(dictionary.lookup("zzz"), [])
+    dictionary.close()
+
+  def test_missing_file_is_empty(self):
+    dictionary = LemmaDictionary(self.path)
+    self.assertEqual(len(dictionary), 0)
+    self.assertEqual(dictionary.lookup("Zug"), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
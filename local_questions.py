@@ -0,0 +1,149 @@
+import random
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from data_models import Question, Vocab, Vocabs
+from metrics import registry
+
+# Candidates scored per question, so a question costs the same for large
+# vocab sets.
+POOL_SIZE = 30
+# Vocabs indexed per call, the pools of all questions are drawn from them.
+INDEX_SIZE = 300
+# Definitions at least this similar may be synonyms, and would make a
+# distractor another correct answer.
+MAX_SIMILARITY = 0.5
+NUM_DISTRACTORS = 3
+MAX_OPTION_LENGTH = 100
+
+local_questions = registry.counter("bot_local_questions_total",
+                                   "Vocab quiz questions generated without "
+                                   "the LLM", ["direction"])
+
+
+def _trigrams(text: str) -> FrozenSet[str]:
+  text = " " + re.sub(r"\W+", " ", text.lower()).strip() + " "
+  return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+  if not a or not b:
+    return 0.0
+  return len(a & b) / len(a | b)
+
+
+@dataclass
+class _Meaning:
+  root: str
+  pos: str
+  definition: str
+  trigrams: FrozenSet[str]
+
+
+def _meaning(vocab: Vocab) -> Optional[_Meaning]:
+  encounter = next((e for e in reversed(vocab.encounters) if e.definition),
+                   None)
+  if encounter is None:
+    return None
+  definition = encounter.definition.strip()
+  return _Meaning(vocab.root, encounter.pos.strip().lower(), definition,
+                  _trigrams(definition))
+
+
+class LocalQuestionGenerator:
+  """Builds plain meaning questions from the user's own vocabs: "what does X
+  mean?" and the reverse "which word means Y?". The distractors are other
+  vocabs with the same part of speech, preferring definitions that are
+  close to the correct one but not close enough to be synonyms.
+
+  Costs no tokens, the LLM is left to the synonym and word form questions.
+  """
+
+  def __init__(self,
+               pool_size: int = POOL_SIZE,
+               max_similarity: float = MAX_SIMILARITY,
+               index_size: int = INDEX_SIZE,
+               rand: random.Random = random):
+    self.pool_size = pool_size
+    self.index_size = index_size
+    self.max_similarity = max_similarity
+    self.rand = rand
+
+  def _distractors(self, meaning: _Meaning,
+                   candidates: List[_Meaning]) -> Optional[List[_Meaning]]:
+    pool = [c for c in candidates if c.root != meaning.root]
+    if len(pool) > self.pool_size:
+      pool = self.rand.sample(pool, self.pool_size)
+    scored = []
+    for candidate in pool:
+      score = similarity(meaning.trigrams, candidate.trigrams)
+      if (score < self.max_similarity and
+          candidate.definition.lower() != meaning.definition.lower()):
+        scored.append((score, candidate))
+    distractors = []
+    while scored and len(distractors) < NUM_DISTRACTORS:
+      # Similar definitions are more plausible, the offset keeps unrelated
+      # ones possible.
+      weights = [score + 0.1 for score, _ in scored]
+      i = self.rand.choices(range(len(scored)), weights=weights)[0]
+      _, candidate = scored.pop(i)
+      if all(similarity(candidate.trigrams, other.trigrams) <
+             self.max_similarity for other in distractors):
+        distractors.append(candidate)
+    if len(distractors) < NUM_DISTRACTORS:
+      return None
+    return distractors
+
+  def _question(self, text: str, correct: str, wrong: List[str],
+                explanation: str) -> Optional[Question]:
+    options = wrong + [correct]
+    self.rand.shuffle(options)
+    question = Question(question=text,
+                        options=options,
+                        correct_idx=options.index(correct),
+                        explanation=explanation)
+    return question if question.validate_telegram_poll() else None
+
+  def generate(self, vocabs: Vocabs,
+               targets: List[Vocab]) -> List[Tuple[str, Question]]:
+    """Up to one question per direction for each target vocab, skipping
+    questions the vocab already has."""
+    candidates = list(vocabs.dictionary.values())
+    if len(candidates) > self.index_size:
+      candidates = self.rand.sample(candidates, self.index_size)
+    by_pos: Dict[str, List[_Meaning]] = {}
+    for vocab in candidates:
+      meaning = _meaning(vocab)
+      if meaning is not None and len(meaning.definition) <= MAX_OPTION_LENGTH:
+        by_pos.setdefault(meaning.pos, []).append(meaning)
+    questions = []
+    for vocab in targets:
+      meaning = _meaning(vocab)
+      if meaning is None or len(meaning.definition) > MAX_OPTION_LENGTH:
+        continue
+      existing = {question.question for question in vocab.quiz}
+      explanation = f"{vocab.root} ({meaning.pos}): {meaning.definition}"
+      for direction in ("meaning", "reverse"):
+        if direction == "meaning":
+          text = f"What does \"{vocab.root}\" mean?"
+        else:
+          text = f"Which word means \"{meaning.definition}\"?"
+        if text in existing:
+          continue
+        distractors = self._distractors(meaning, by_pos.get(meaning.pos, []))
+        if distractors is None:
+          break
+        if direction == "meaning":
+          question = self._question(
+            text, meaning.definition,
+            [distractor.definition for distractor in distractors],
+            explanation)
+        else:
+          question = self._question(
+            text, vocab.root, [distractor.root for distractor in distractors],
+            explanation)
+        if question is not None:
+          local_questions.inc(direction=direction)
+          questions.append((vocab.root, question))
+    return questions
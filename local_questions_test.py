@@ -0,0 +1,84 @@
+import random
+import unittest
+
+from data_models import Keyword, Vocabs
+from local_questions import LocalQuestionGenerator
+
+NOUNS = {
+  "der Zug": "train",
+  "der Bus": "bus",
+  "das Auto": "car",
+  "das Fahrrad": "bicycle",
+  "die Bahn": "the train",
+  "die Haltestelle": "bus stop",
+}
+
+
+def make_vocabs(definitions, pos="Noun") -> Vocabs:
+  vocabs = Vocabs()
+  for root, definition in definitions.items():
+    vocabs.click_keyword(
+      Keyword(root=root, word=root, pos=pos, snippet="",
+              definition=definition), 0)
+  return vocabs
+
+
+class TestLocalQuestionGenerator(unittest.TestCase):
+
+  def setUp(self):
+    self.generator = LocalQuestionGenerator(rand=random.Random(0))
+
+  def test_meaning_and_reverse_questions(self):
+    vocabs = make_vocabs(NOUNS)
+    zug = vocabs.get("der Zug")
+    questions = self.generator.generate(vocabs, [zug])
+    self.assertEqual([root for root, _ in questions], ["der Zug", "der Zug"])
+    meaning, reverse = [question for _, question in questions]
+
+    self.assertEqual(meaning.question, "What does \"der Zug\" mean?")
+    self.assertEqual(meaning.options[meaning.correct_idx], "train")
+    self.assertEqual(len(set(meaning.options)), 4)
+    # Too similar to "train", it could be a correct answer too.
+    self.assertNotIn("the train", meaning.options)
+
+    self.assertEqual(reverse.question, "Which word means \"train\"?")
+    self.assertEqual(reverse.options[reverse.correct_idx], "der Zug")
+    self.assertTrue(set(reverse.options) <= set(NOUNS))
+
+    # Existing questions are not generated again.
+    zug.quiz.extend([meaning, reverse])
+    self.assertEqual(self.generator.generate(vocabs, [zug]), [])
+
+  def test_distractors_have_the_same_pos(self):
+    vocabs = make_vocabs({"der Zug": "train", "der Bus": "bus"})
+    for root, definition in (("schnell", "fast"), ("laut", "loud"),
+                             ("klein", "small")):
+      vocabs.click_keyword(
+        Keyword(root=root, word=root, pos="Adj", snippet="",
+                definition=definition), 0)
+    # Only one other noun, not enough for a question.
+    self.assertEqual(
+      self.generator.generate(vocabs, [vocabs.get("der Zug")]), [])
+    self.assertEqual(
+      len(self.generator.generate(vocabs, [vocabs.get("laut")])), 0)
+    vocabs.click_keyword(
+      Keyword(root="alt", word="alt", pos="Adj", snippet="",
+              definition="old"), 0)
+    questions = self.generator.generate(vocabs, [vocabs.get("laut")])
+    self.assertEqual(len(questions), 2)
+    self.assertEqual(set(questions[0][1].options),
+                     {"fast", "loud", "small", "old"})
+
+
+  def test_index_is_sampled(self):
+    vocabs = make_vocabs({f"das Wort{i}": f"word {i}" for i in range(50)})
+    generator = LocalQuestionGenerator(index_size=10, rand=random.Random(0))
+    target = vocabs.get("das Wort0")
+    questions = generator.generate(vocabs, [target])
+    self.assertEqual(len(questions), 2)
+    meaning = questions[0][1]
+    self.assertEqual(meaning.options[meaning.correct_idx], "word 0")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+from metrics import current_handler, registry
+
+logger = logging.getLogger(__name__)
+
+SLOW_CALLBACK_SECONDS = 0.1
+HEARTBEAT_INTERVAL = 0.5
+SAMPLE_INTERVAL = 0.005
+MAX_STACK_DEPTH = 30
+
+loop_lag = registry.histogram("bot_event_loop_lag_seconds",
+                              "Delay of the heartbeat behind its schedule",
+                              buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25,
+                                       0.5, 1, 2.5, 5))
+slow_callbacks = registry.counter("bot_slow_callbacks_total",
+                                  "Event loop callbacks slower than the "
+                                  "threshold", ["handler"])
+
+
+def _describe(handle: asyncio.Handle) -> Tuple[str, Optional[int]]:
+  context = handle._context.get(current_handler) if handle._context else None
+  # A handler that ran to completion within the callback has reset its
+  # context already.
+  context = context or metrics.entered_handler
+  if context is not None:
+    return context
+  callback = getattr(handle, "_callback", None)
+  task = getattr(callback, "__self__", None)
+  if isinstance(task, asyncio.Task):
+    return task.get_coro().__qualname__, None
+  return getattr(callback, "__qualname__", repr(callback)), None
+
+
+def _stack_key(frame) -> str:
+  names = []
+  while frame is not None and len(names) < MAX_STACK_DEPTH:
+    code = frame.f_code
+    names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:"
+                 f"{frame.f_lineno}")
+    frame = frame.f_back
+  return ";".join(reversed(names))
+
+
+class LoopProfiler:
+  """Opt-in event loop profiler.
+
+  A heartbeat task records how late it wakes up, and every callback slower
+  than `slow_threshold` is logged with the handler and user it ran for.
+  Timing a callback costs two perf_counter calls, so it can stay on in
+  production. `sample` additionally collects stacks of the loop thread for
+  a time window.
+  """
+
+  def __init__(self,
+               slow_threshold: float = SLOW_CALLBACK_SECONDS,
+               heartbeat_interval: float = HEARTBEAT_INTERVAL,
+               clock: Callable[[], float] = time.perf_counter):
+    self.slow_threshold = slow_threshold
+    self.heartbeat_interval = heartbeat_interval
+    self.clock = clock
+    self.max_lag = 0.0
+    self._original_run: Optional[Callable] = None
+    self._heartbeat: Optional[asyncio.Task] = None
+    self._loop_thread_id: Optional[int] = None
+
+  def start(self):
+    if self._original_run is not None:
+      return
+    self._loop_thread_id = threading.get_ident()
+    original_run = self._original_run = asyncio.events.Handle._run
+    profiler = self
+
+    def _run(handle):
+      metrics.entered_handler = None
+      start = profiler.clock()
+      original_run(handle)
+      elapsed = profiler.clock() - start
+      if elapsed >= profiler.slow_threshold:
+        profiler._report_slow(handle, elapsed)
+
+    asyncio.events.Handle._run = _run
+    self._heartbeat = asyncio.create_task(self._beat())
+
+  async def stop(self):
+    if self._original_run is None:
+      return
+    asyncio.events.Handle._run = self._original_run
+    self._original_run = None
+    self._heartbeat.cancel()
+    await asyncio.gather(self._heartbeat, return_exceptions=True)
+
+  def _report_slow(self, handle: asyncio.Handle, elapsed: float):
+    handler, user_id = _describe(handle)
+    slow_callbacks.inc(handler=handler)
+    logger.warning(f"Slow callback {handler} for user {user_id} blocked the "
+                   f"event loop for {elapsed:.3f}s")
+
+  async def _beat(self):
+    while True:
+      start = self.clock()
+      await asyncio.sleep(self.heartbeat_interval)
+      lag = max(0.0, self.clock() - start - self.heartbeat_interval)
+      self.max_lag = max(self.max_lag, lag)
+      loop_lag.observe(lag)
+
+  def _collect(self, thread_id: int, duration: float,
+               interval: float) -> Dict[str, int]:
+    counts = collections.Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+      frame = sys._current_frames().get(thread_id)
+      if frame is not None:
+        counts[_stack_key(frame)] += 1
+      time.sleep(interval)
+    return counts
+
+  async def sample(self,
+                   duration: float,
+                   interval: float = SAMPLE_INTERVAL) -> Dict[str, int]:
+    """Samples the loop thread's stack for `duration` seconds. Returns the
+    sample count per collapsed stack ("file:function:line;..." from the
+    outermost frame), the input format of flame graph tools."""
+    thread_id = self._loop_thread_id or threading.get_ident()
+    return await asyncio.to_thread(self._collect, thread_id, duration,
+                                   interval)
+
+
+def format_profile(counts: Dict[str, int], top: int = 10) -> str:
+  total = sum(counts.values())
+  if not total:
+    return "No samples."
+  lines = [f"{total} samples"]
+  for stack, count in collections.Counter(counts).most_common(top):
+    # The innermost frames are the interesting ones.
+    frames = stack.split(";")[-3:]
+    lines.append(f"{100 * count / total:.0f}% " + " < ".join(reversed(frames)))
+  return "\n".join(lines)
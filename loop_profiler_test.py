@@ -0,0 +1,64 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+from loop_profiler import LoopProfiler, format_profile, slow_callbacks
+from metrics import instrument_handler
+
+
+def busy_wait(seconds):
+  deadline = time.perf_counter() + seconds
+  while time.perf_counter() < deadline:
+    pass
+
+
+@instrument_handler
+async def blocking_handler(update, context):
+  busy_wait(0.05)
+
+
+class TestLoopProfiler(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.profiler = LoopProfiler(slow_threshold=0.03, heartbeat_interval=0.01)
+    self.profiler.start()
+
+  async def asyncTearDown(self):
+    await self.profiler.stop()
+
+  async def test_slow_callback_reports_handler_and_user(self):
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=42))
+    with self.assertLogs("loop_profiler", "WARNING") as logs:
+      await blocking_handler(update, None)
+      # The callback is reported once the current step returns.
+      await asyncio.sleep(0)
+    self.assertIn("blocking_handler for user 42", logs.output[0])
+    self.assertGreaterEqual(
+      slow_callbacks.values[("blocking_handler",)], 1)
+
+  async def test_heartbeat_measures_lag(self):
+    await asyncio.sleep(0.02)
+    with self.assertLogs("loop_profiler", "WARNING"):
+      busy_wait(0.1)
+      await asyncio.sleep(0.02)
+    self.assertGreaterEqual(self.profiler.max_lag, 0.05)
+
+  async def test_sample_collects_loop_stacks(self):
+    sampling = asyncio.create_task(self.profiler.sample(0.2, interval=0.001))
+    await asyncio.sleep(0.01)
+    with self.assertLogs("loop_profiler", "WARNING"):
+      busy_wait(0.1)
+      await asyncio.sleep(0)
+    counts = await sampling
+    busy = sum(count for stack, count in counts.items() if "busy_wait" in stack)
+    self.assertGreater(busy, 0)
+    self.assertIn("busy_wait", format_profile(counts))
+
+  async def test_stop_restores_handle_run(self):
+    await self.profiler.stop()
+    self.assertEqual(asyncio.events.Handle._run.__qualname__, "Handle._run")
+
+
+if __name__ == '__main__':
+  unittest.main()
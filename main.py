@@ -1,18 +1,21 @@
 import logging
 import asyncio
+import json
 import random
 import os
-from datetime import datetime, time
+import signal
+from datetime import date, datetime, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from typing import Optional, List
+from urllib.parse import urlparse
 
-from telegram import ReplyKeyboardRemove, Update, Poll, Message
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.constants import ChatAction
+from telegram import ReplyKeyboardRemove, Update, Poll, Message, Bot
+from telegram.constants import ChatAction, MessageLimit
 
 from telegram.ext import (Application, CommandHandler, ContextTypes,
                           ConversationHandler, MessageHandler,
                           CallbackQueryHandler, PollAnswerHandler, filters,
-                          JobQueue)
+                          JobQueue, TypeHandler)
 
 from keyword_extractor import KeywordExtractor
 from question_extractor import QuestionExtractor
@@ -20,11 +23,71 @@ from definition_extractor import DefinitionExtractor
 from translation_extractor import TranslationExtractor
 from ask_anything_extractor import AskAnythingExtractor
 from vocab_question_extractor import VocabQuestionExtractor
-from data_models import UserProfile, LearningSession, UserProfileDB
+from data_models import (UserProfile, LearningSession, UserProfileDB,
+                         sm2_params_from_env)
+import data_models
+from message_queue import MessageQueue
+from reminder_scheduler import ReminderScheduler
+from quiz_inventory import QuizInventory
+from local_questions import LocalQuestionGenerator
+from session_archive import SessionArchive
+from keyword_keyboard import KeywordKeyboards, CALLBACK_PATTERN
+from sharded_runner import ShardedRunner, poll_updates, shard_for
+from webhook_server import WebhookServer
+from conversation_store import ConversationStore
+from cpu_offload import offloader
+from chunked_learning import ChunkedLearner
+from vocab_import import VocabImporter, MAX_IMPORT_BYTES, export_bytes
+from lemma_dictionary import LemmaDictionary, DefinitionLog
+from model_router import DEFAULT_TIERS, ModelRouter, ModelTier
+from answer_cache import AnswerCache
+import answer_cache
+from loop_profiler import LoopProfiler, format_profile
+import keyword_keyboard
+import metrics
+from metrics import instrument_handler
 
 TELEGRAM_BOT_TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-KEYWORDS_PER_ROW = 3
-KEYWORDS_PER_PAGE = 3 * KEYWORDS_PER_ROW
+METRICS_PORT = int(os.environ.get('METRICS_PORT', metrics.METRICS_PORT))
+# With more than one worker, updates are routed to worker processes by user.
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 1))
+PROFILE_CACHE_SIZE = 10000
+# Quiz polls sent ahead of their answers, so the next question is already
+# there when the user answers one.
+POLLS_IN_FLIGHT = max(1, int(os.environ.get('POLLS_IN_FLIGHT', '2')))
+# Public HTTPS url Telegram posts updates to, e.g. https://example.org/telegram.
+# When set, the bot runs an embedded webhook server instead of long polling.
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# Logs callbacks blocking the event loop and exports the loop lag.
+LOOP_PROFILER = os.environ.get('LOOP_PROFILER') == '1'
+# Comma separated Telegram user ids allowed to use admin commands.
+ADMIN_USER_IDS = {
+  int(user_id)
+  for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id
+}
+PROFILE_SECONDS, MAX_PROFILE_SECONDS = 10, 60
+# JSON object overriding SM-2 constants, e.g. {"second_interval": 4}. Use
+# srs_engine.py to evaluate them against the answer logs first.
+data_models.SM2_PARAMS = sm2_params_from_env()
+# JSON list of model tiers, cheapest first, e.g. [{"name": "fast",
+# "model_name": "gpt-3.5-turbo", "max_input_tokens": 2500}, ...].
+MODEL_TIERS = ([ModelTier(**tier)
+                for tier in json.loads(os.environ['MODEL_TIERS'])]
+               if os.environ.get('MODEL_TIERS') else DEFAULT_TIERS)
+# JSON object of the first tier per call, e.g. {"question.quiz": "strong"}.
+MODEL_ROUTES = json.loads(os.environ.get('MODEL_ROUTES', '{}'))
+# /define requests arriving within this many seconds share one LLM call,
+# 0 disables batching.
+DEFINE_BATCH_WINDOW = float(os.environ.get('DEFINE_BATCH_WINDOW', 0.05))
+DEFINE_BATCH_SIZE = int(os.environ.get('DEFINE_BATCH_SIZE', 8))
+# Free-form questions this similar to an earlier one get its answer, above 1
+# disables the cache.
+ANSWER_CACHE_SIMILARITY = float(
+  os.environ.get('ANSWER_CACHE_SIMILARITY', answer_cache.MIN_SIMILARITY))
+ANSWER_CACHE_SIZE = int(
+  os.environ.get('ANSWER_CACHE_SIZE', answer_cache.MAX_ENTRIES))
 
 logging.basicConfig(
   format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -32,13 +95,45 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 LEARN_TEXT, ASK_QUESTION = range(2)
-keyword_extractor = KeywordExtractor()
-question_extractor = QuestionExtractor()
-definition_extractor = DefinitionExtractor()
-translation_extractor = TranslationExtractor()
-ask_anything_extractor = AskAnythingExtractor()
-vocab_question_extractor = VocabQuestionExtractor()
+# Built offline with `python lemma_dictionary.py build`, from the definitions
+# the extractors log.
+lemma_dictionary = LemmaDictionary(
+  os.environ.get('LEMMA_DICTIONARY', 'lemma.dict'))
+definition_log = DefinitionLog()
+model_router = ModelRouter(MODEL_TIERS, MODEL_ROUTES)
+keyword_extractor = KeywordExtractor(lemma_dictionary=lemma_dictionary,
+                                     definition_log=definition_log,
+                                     router=model_router)
+question_extractor = QuestionExtractor(router=model_router)
+definition_extractor = DefinitionExtractor(lemma_dictionary=lemma_dictionary,
+                                           definition_log=definition_log,
+                                           router=model_router,
+                                           batch_window=DEFINE_BATCH_WINDOW,
+                                           max_batch_size=DEFINE_BATCH_SIZE)
+translation_extractor = TranslationExtractor(router=model_router)
+ask_anything_extractor = AskAnythingExtractor(
+  router=model_router,
+  answer_cache=AnswerCache(ANSWER_CACHE_SIMILARITY, ANSWER_CACHE_SIZE)
+  if ANSWER_CACHE_SIMILARITY <= 1 else None)
+vocab_question_extractor = VocabQuestionExtractor(router=model_router)
+local_question_generator = LocalQuestionGenerator()
+chunked_learner = ChunkedLearner(keyword_extractor, question_extractor,
+                                 translation_extractor)
 db = UserProfileDB()
+# Created by main() or run_worker, it keeps a log file.
+outbox: Optional[MessageQueue] = None
+quiz_inventory = QuizInventory(db, vocab_question_extractor,
+                               local_generator=local_question_generator)
+session_archive = SessionArchive()
+keyword_keyboards = KeywordKeyboards()
+vocab_importer = VocabImporter(db, keyword_extractor)
+loop_profiler = LoopProfiler()
+# Set by run_worker, a worker only serves the users of its shard.
+shard_id, num_shards = 0, 1
+
+
+def owns_user(user_id: int) -> bool:
+  return shard_for(user_id, num_shards) == shard_id
 
 
 async def create_placeholder_message(
@@ -64,6 +159,7 @@ def retrieve_text_to_learn(text: Optional[str],
     return update.message.text
 
 
+@instrument_handler
 async def learn_handler(update: Update,
                         context: ContextTypes.DEFAULT_TYPE,
                         text: Optional[str] = None) -> int:
@@ -78,183 +174,269 @@ async def learn_handler(update: Update,
   user_id = update.effective_user.id
   chat_id = update.effective_chat.id
 
-  # Create or update UserProfile in user_data
-  user_profile = await db.get_user_profile(user_id)
   # TODO: Check if text is too short (less than 5 sentences), then just translate and explain each sentence.
 
-  # Truncate text to max 1500 tokens.
-  text = text[:1500]
-  # Create a new LearningSession
-  session_id = len(user_profile.sessions)
-  session = LearningSession(session_id=session_id,
-                            chat_id=chat_id,
-                            text=text,
-                            start_time=datetime.now())
-  user_profile.sessions.append(session)
+  # Long texts are learned in chunks, up to a maximum number of chunks.
+  text = chunked_learner.prepare_text(text)
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    # Create a new LearningSession
+    session_id = user_profile.new_session_id()
+    session = LearningSession(session_id=session_id,
+                              chat_id=chat_id,
+                              text=text,
+                              start_time=datetime.now())
+    session.extracting = True
+    user_profile.start_session(session)
+    schedule_reminder(user_profile)
+    # The session keeps the text, so a restart resumes the extraction.
+    await db.set_user_profile(user_profile)
   await update.message.reply_text(
     "I'm extracting keywords and questions, please wait ~30 seconds...")
-  # Run all requests in parallel.
-  keywords_task = asyncio.create_task(keyword_extractor.extract_keywords(text))
-  questions_task = asyncio.create_task(
-    question_extractor.extract_questions(text))
-
-  # Generate keywords for the session.
-  session.keywords = await keywords_task
-  await update.message.reply_text(
-    "Click a keyword to learn more:",
-    reply_markup=create_keywords_keyboard(user_profile))
-  await db.set_user_profile(user_profile)
-
-  # Generate quiz and start asking questions
-  session.quiz = await questions_task
-  # Make sure saving the use_profile before calling another handler.
-  await db.set_user_profile(user_profile)
-  await ask_question_handler(update, context)
-
+  if not await extract_session(context.bot, user_id, session_id):
+    return ConversationHandler.END
   return ASK_QUESTION
 
 
-def create_keywords_keyboard(
-    user_profile: UserProfile) -> InlineKeyboardMarkup:
-  logging.info("Entering create_keywords")
-  session = user_profile.sessions[-1]
-  keywords = [keyword.word for keyword in session.keywords]
-
-  current_page = session.current_keyword_page
-  start_index = current_page * KEYWORDS_PER_PAGE
-  end_index = start_index + KEYWORDS_PER_PAGE
-  page_keywords = keywords[start_index:end_index]
-
-  keyboard = [[
-    InlineKeyboardButton(text=word, callback_data=f'keyword {word}')
-    for word in page_keywords[i:i + KEYWORDS_PER_ROW]
-  ] for i in range(0, len(page_keywords), KEYWORDS_PER_ROW)]
-
-  # Add << and >> buttons at the end to allow user to increase or decrease the current page.
-  navigation_buttons = [
-    InlineKeyboardButton("<<", callback_data="prev_page"),
-    InlineKeyboardButton(">>", callback_data="next_page")
-  ]
-  keyboard.append(navigation_buttons)
-
-  return InlineKeyboardMarkup(keyboard)
+async def update_session(user_id: int, session_id: int,
+                         **fields) -> Optional[LearningSession]:
+  """Sets fields of a session after LLM calls made without the user's lock,
+  on a profile reloaded under the lock."""
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    session = user_profile.get_session(session_id)
+    if session is not None:
+      for name, value in fields.items():
+        setattr(session, name, value)
+      await db.set_user_profile(user_profile)
+    return session
 
 
+async def extract_session(bot: Bot, user_id: int, session_id: int) -> bool:
+  """Extracts the keywords and questions of a /learn session and starts
+  asking questions. Only the missing ones are extracted, after a restart the
+  keywords may be saved already. Returns False if the extraction failed, the
+  user is asked to send the text again."""
+  user_profile = await db.get_user_profile(user_id)
+  session = user_profile.get_session(session_id)
+  # Run all requests in parallel.
+  keywords_task = None
+  if not session.keywords:
+    keywords_task = asyncio.create_task(
+      chunked_learner.extract_keywords(session.text))
+  questions_task = asyncio.create_task(
+    chunked_learner.extract_questions(session.text))
+
+  try:
+    # Generate keywords for the session.
+    if keywords_task is not None:
+      keywords = await keywords_task
+      session = await update_session(user_id, session_id, keywords=keywords)
+      if session is None:
+        return False
+      await bot.send_message(
+        session.chat_id,
+        "Click a keyword to learn more:",
+        reply_markup=keyword_keyboards.markup(user_id, session))
+
+    # Generate quiz and start asking questions
+    quiz = await questions_task
+  except Exception:
+    logger.exception(f"Extracting session {session_id} of user {user_id} "
+                     "failed")
+    tasks = [task for task in (keywords_task, questions_task) if task]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Otherwise a restart would retry it.
+    session = await update_session(user_id, session_id, extracting=False)
+    if session is not None:
+      await bot.send_message(
+        session.chat_id,
+        "Sorry, I couldn't extract keywords and questions from the text. "
+        "Please try again with /learn.")
+    return False
+  # Make sure saving the use_profile before calling another handler.
+  if await update_session(user_id, session_id, quiz=quiz,
+                          extracting=False) is None:
+    return False
+  await send_questions(bot, user_id)
+  return True
+
+
+async def resume_extractions(application: Application):
+  """Finishes the extractions of /learn sessions interrupted by a restart,
+  found in the manifest without loading other profiles."""
+  for user_id, entry in list(db.manifest.entries.items()):
+    if not entry.extracting or not owns_user(user_id):
+      continue
+    user_profile = await db.get_user_profile(user_id)
+    for session in user_profile.sessions:
+      if not session.extracting:
+        continue
+      logger.info(f"Resuming extraction of session {session.session_id} "
+                  f"of user {user_id}")
+      key = (int(session.chat_id), user_id)
+      application.persistence.set_state("learn", key, ASK_QUESTION)
+      try:
+        if not await extract_session(application.bot, user_id,
+                                     session.session_id):
+          application.persistence.set_state("learn", key,
+                                            ConversationHandler.END)
+      except Exception:
+        logger.exception(f"Resuming session {session.session_id} failed")
+
+
+@instrument_handler
 async def ask_question_handler(update: Update,
                                context: ContextTypes.DEFAULT_TYPE) -> int:
   logging.info("Entering ask_question_handler")
-  user_profile = await db.get_user_profile(update.effective_user.id)
-  session = user_profile.sessions[-1]
-  if session.next_question_idx >= len(session.quiz):
-    await context.bot.send_message(session.chat_id,
-                                   f'{session.summary_quiz()}')
-    if (session.text != "VocabQuiz"):
-      await context.bot.send_message(
-        session.chat_id,
-        "Send /morequestions, /translate, /stoplearn, or /learnnew to proceed"
-      )
-    else:
-      await context.bot.send_message(
+  return await send_questions(context.bot, update.effective_user.id)
+
+
+async def send_questions(bot: Bot, user_id: int) -> int:
+  # Answers to pipelined polls arrive concurrently, the lock keeps them from
+  # sending the same question twice.
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    session = user_profile.sessions[-1]
+    pending = user_profile.pending_polls(session.session_id)
+    if session.next_question_idx >= len(session.quiz):
+      if pending:
+        # The summary follows the last answer.
+        return ASK_QUESTION
+      if session.text == "VocabQuiz":
+        # Nothing follows a vocab quiz, unlike /morequestions of a text.
+        await db.record_locked(user_profile, "end", session.session_id)
+      await bot.send_message(session.chat_id, f'{session.summary_quiz()}')
+      if (session.text != "VocabQuiz"):
+        await bot.send_message(
+          session.chat_id,
+          "Send /morequestions, /translate, /stoplearn, or /learnnew to proceed"
+        )
+      else:
+        await bot.send_message(
+          session.chat_id,
+          "Send /vocabs to practice more")
+      return ASK_QUESTION
+    while (session.next_question_idx < len(session.quiz) and
+           pending < POLLS_IN_FLIGHT):
+      question_idx = session.next_question_idx
+      question = session.quiz[question_idx]
+      logger.info(f'ask_question: {question}')
+      message = await bot.send_poll(
         session.chat_id,
-        "Send /vocabs to practice more")
-  else:
-    question = session.quiz[session.next_question_idx]
-    logger.info(f'ask_question: {question}')
-    await context.bot.send_poll(session.chat_id,
-                                question.question,
-                                question.options,
-                                is_anonymous=False,
-                                allows_multiple_answers=False,
-                                type=Poll.QUIZ,
-                                correct_option_id=question.correct_idx,
-                                explanation=question.explanation)
-    # Update asking_question_idx in the LearningSession
-    session.next_question_idx += 1
-    await db.set_user_profile(user_profile)
+        question.question,
+        question.options,
+        is_anonymous=False,
+        allows_multiple_answers=False,
+        type=Poll.QUIZ,
+        correct_option_id=question.correct_idx,
+        explanation=question.explanation)
+      # Answers are matched to questions by poll id.
+      await db.record_locked(user_profile, "poll", session.session_id,
+                             question_idx, message.poll.id)
+      pending += 1
 
   return ASK_QUESTION
 
 
+@instrument_handler
 async def ask_question_on_answer_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
   poll_answer = update.poll_answer
-  user_profile = await db.get_user_profile(update.effective_user.id)
-  session = user_profile.sessions[-1]
-  current_question = session.quiz[session.next_question_idx - 1]
-
-  current_question.answer_time = datetime.now()
-  current_question.answer_idx = poll_answer.option_ids[0]
-
-  # Update vocab progress if it's a VocabQuiz
-  if session.text == "VocabQuiz":
-    vocab_root = session.vocab_roots[session.next_question_idx - 1]
-    if vocab_root in user_profile.vocabs.dictionary:
-      vocab = user_profile.vocabs.dictionary[vocab_root]
-      if current_question.is_correct():
-        vocab.correct_answer()
-      else:
-        vocab.wrong_answer()
-
-  await db.set_user_profile(user_profile)
-
+  user_id = update.effective_user.id
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    session = await db.record_locked(user_profile, "answer",
+                                     poll_answer.poll_id,
+                                     poll_answer.option_ids[0])
+  if session is None:
+    logger.info(f"Ignoring answer to unknown poll {poll_answer.poll_id}")
+    return ASK_QUESTION
+
+  if session is not user_profile.sessions[-1]:
+    # A late answer to an earlier session.
+    return ASK_QUESTION
   return await ask_question_handler(update, context)
 
 
+@instrument_handler
 async def morequestions_handler(update: Update,
                                 context: ContextTypes.DEFAULT_TYPE) -> int:
   logging.info("Entering morequestions_handler")
-  user_profile = await db.get_user_profile(update.effective_user.id)
+  user_id = update.effective_user.id
+  user_profile = await db.get_user_profile(user_id)
   session = user_profile.sessions[-1]
-  message = await create_placeholder_message(update.effective_user.id, context)
+  message = await create_placeholder_message(user_id, context)
   await message.edit_text("Generating new quiz...")
   # Generate a new set of questions and append them to the quiz
-  new_questions = await question_extractor.extract_questions(session.text)
-  session.quiz.extend(new_questions)
-  await db.set_user_profile(user_profile)
+  new_questions = await chunked_learner.extract_questions(session.text)
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    session = user_profile.get_session(session.session_id)
+    if session is not None:
+      session.quiz.extend(new_questions)
+      await db.set_user_profile(user_profile)
 
   return await ask_question_handler(update, context)
 
 
+@instrument_handler
 async def keywords_on_click_handler(update: Update,
                                     context: ContextTypes.DEFAULT_TYPE):
   query = update.callback_query
-  user_profile = await db.get_user_profile(update.effective_user.id)
-  session = user_profile.sessions[-1]
-  data = query.data.split()
-
-  if data[0] == "prev_page":
-    if session.current_keyword_page <= 0: return
-    session.current_keyword_page = max(0, session.current_keyword_page - 1)
-    await db.set_user_profile(user_profile)
-    return await query.edit_message_reply_markup(
-      create_keywords_keyboard(user_profile))
-  elif data[0] == "next_page":
-    max_page = (len(session.keywords) - 1) // KEYWORDS_PER_PAGE
-    if session.current_keyword_page >= max_page: return
-    session.current_keyword_page = min(max_page,
-                                       session.current_keyword_page + 1)
-    await db.set_user_profile(user_profile)
-    return await query.edit_message_reply_markup(
-      create_keywords_keyboard(user_profile))
+  user_id = update.effective_user.id
+  user_profile = await db.get_user_profile(user_id)
+  kind, session_id, value = keyword_keyboard.parse_callback(query.data)
+  if session_id is None:
+    # Keyboard sent before the compact callback payloads.
+    session = user_profile.sessions[-1]
   else:
-    selected_keyword = ' '.join(data[1:])
-    keyword = next((k for k in session.keywords if k.word == selected_keyword),
-                   None)
-
-    if keyword:
-      user_profile.vocabs.click_keyword(keyword, session.session_id)
-      await db.set_user_profile(user_profile)
-      if keyword.summary() == query.message.text:
-        # Users click on the same keyword, skip.
-        return None
-      await query.edit_message_text(
-        keyword.summary(), reply_markup=create_keywords_keyboard(user_profile))
+    session = user_profile.get_session(session_id)
+  if session is None:
+    await query.answer("This session has expired.")
+    return None
+
+  if kind in ("page", "prev_page", "next_page"):
+    if kind == "page":
+      page = int(value)
     else:
-      await query.answer("Keyword not found.")
+      step = -1 if kind == "prev_page" else 1
+      page = session.current_keyword_page + step
+    if page == session.current_keyword_page or not (
+        0 <= page <= keyword_keyboard.max_page(session)):
+      return None
+    session.current_keyword_page = page
+    await db.record(user_id, "page", session.session_id, page)
+    return await query.edit_message_reply_markup(
+      keyword_keyboards.markup(user_id, session))
+
+  keyword_idx = None
+  if kind == "kw":
+    if 0 <= int(value) < len(session.keywords):
+      keyword_idx = int(value)
+  else:
+    keyword_idx = next((i for i, k in enumerate(session.keywords)
+                        if k.word == value), None)
+
+  if keyword_idx is not None:
+    keyword = session.keywords[keyword_idx]
+    await db.record(user_id, "click", session.session_id, keyword_idx)
+    quiz_inventory.notify(user_profile.user_id)
+    if keyword.summary() == query.message.text:
+      # Users click on the same keyword, skip.
+      return None
+    await query.edit_message_text(
+      keyword.summary(),
+      reply_markup=keyword_keyboards.markup(user_id, session))
+  else:
+    await query.answer("Keyword not found.")
 
   return None
 
 
+@instrument_handler
 async def learn_text_handler(update: Update,
                              context: ContextTypes.DEFAULT_TYPE) -> int:
   logging.info("Entering learn_text_handler")
@@ -274,6 +456,7 @@ def remove_introducing_paragraph(string: str) -> str:
   return '\n\n'.join(paragraphs)
 
 
+@instrument_handler
 async def random_text_handler(update: Update,
                               context: ContextTypes.DEFAULT_TYPE) -> int:
   logging.info("Entering random_text_handler")
@@ -299,29 +482,39 @@ async def random_text_handler(update: Update,
   return await learn_handler(update, context, text)
 
 
+@instrument_handler
 async def stop_learn_handler(update: Update,
                              context: ContextTypes.DEFAULT_TYPE) -> int:
   logging.info("Entering stop_learn_handler")
-  user_profile = await db.get_user_profile(update.effective_user.id)
-  session = user_profile.sessions[-1]
-  session.end_time = datetime.now()
-  await db.set_user_profile(user_profile)
-
-  await update.message.reply_text(session.summary())
+  user_id = update.effective_user.id
+  user_profile = await db.get_user_profile(user_id)
+  session = None
+  if user_profile.sessions:
+    # None if the session was archived since.
+    session = await db.record(user_id, "end",
+                              user_profile.sessions[-1].session_id)
+  if session is None:
+    await update.message.reply_text("There is no active learning session.")
+  else:
+    await update.message.reply_text(session.summary())
   return ConversationHandler.END
 
 
+@instrument_handler
 async def ask_anything_handler(update: Update,
                                context: ContextTypes.DEFAULT_TYPE) -> int:
   logging.info("Entering ask_anything_handler")
   # Placeholder for the actual implementation
+  # Learners ask the same questions. Other prompts, e.g. of /random, must
+  # get a new answer each time.
   response_future = ask_anything_extractor.extract_response(
-    update.message.text)
+    update.message.text, use_cache=True)
   message = await create_placeholder_message(update.effective_user.id, context)
   await message.edit_text(await response_future)
   return None
 
 
+@instrument_handler
 async def define_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
   logging.info("Entering define_handler")
   # Check if the user provided the word
@@ -333,12 +526,11 @@ async def define_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
   keywords_future = definition_extractor.extract_definitions(phrase)
   message = await create_placeholder_message(update.message.chat_id, context)
   keywords = await keywords_future
-  user_profile = await db.get_user_profile(update.effective_user.id)
-  for keyword in keywords:
-    user_profile.vocabs.define_vocab(keyword, session_id=-1)
   # Reply to the user with the definition
   if keywords:
-    await db.set_user_profile(user_profile)
+    await db.record(update.effective_user.id, "define",
+                    [keyword.dict() for keyword in keywords])
+    quiz_inventory.notify(update.effective_user.id)
     await message.edit_text("\n\n".join(kw.summary() for kw in keywords))
   else:
     generic_def = await ask_anything_extractor.extract_response(
@@ -346,6 +538,7 @@ async def define_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await message.edit_text(generic_def)
 
 
+@instrument_handler
 async def translate_handler(update: Update,
                             context: ContextTypes.DEFAULT_TYPE):
   logging.info("Entering translate_handler")
@@ -363,52 +556,23 @@ async def translate_handler(update: Update,
       # Reuses existing translation if there is.
       translation = session.translation
     else:
-      translation = await translation_extractor.extract_translation(
-        session.text)
-      session.translation = translation
-      await db.set_user_profile(user_profile)
+      translation = await chunked_learner.extract_translation(session.text)
+      await update_session(user_profile.user_id, session.session_id,
+                           translation=translation)
   else:
     await message.edit_text("No text to translate. Send /translate <text>")
     return
-  # Reply to the user with the translation
-  await message.edit_text(translation)
-
-
-async def refresh_vocab_quiz():
-  all_user_profiles = await db.get_all_user_profiles()
-
-  for user_profile in all_user_profiles:
-    due_vocabs = user_profile.vocabs.due_vocabs(n=30)
-    if not due_vocabs:
-      continue
-
-    quiz_vocabs = []
-    for vocab in due_vocabs:
-      n = len(vocab.quiz)
-      if n == 0 or random.random() < 1 / n:
-        quiz_vocabs.append(vocab)
-      # Do not refresh more than 10 vocabs at a time
-      if len(quiz_vocabs) >= 10:
-        break
-
-    if len(quiz_vocabs) == 0:
-      continue
-
-    new_questions = await vocab_question_extractor.extract_questions(
-      vocabs=quiz_vocabs)
+  # Reply to the user with the translation, translations of long texts take
+  # several messages.
+  limit = MessageLimit.MAX_TEXT_LENGTH
+  await message.edit_text(translation[:limit])
+  for start in range(limit, len(translation), limit):
+    await update.message.reply_text(translation[start:start + limit])
 
-    for root, question in new_questions:
-      matched_vocab = next(vocab for vocab in quiz_vocabs
-                           if vocab.root == root)
-      if not matched_vocab:
-        continue
-      matched_vocab.quiz.append(question)
-
-    await db.set_user_profile(user_profile)
 
-
-async def remind_vocabs(user_profiles: List[UserProfile],
-                        context: ContextTypes.DEFAULT_TYPE):
+async def remind_vocabs(user_profiles: List[UserProfile]):
+  # Messages go through the outbox, which respects Telegram's rate limits.
+  reminded_profiles = []
   for user_profile in user_profiles:
     if not user_profile.sessions:
       continue
@@ -416,9 +580,8 @@ async def remind_vocabs(user_profiles: List[UserProfile],
 
     due_vocabs = user_profile.vocabs.due_vocabs(n=10)
     if not due_vocabs:
-      await context.bot.send_message(
-        chat_id=latest_session.chat_id,
-        text=f'No more vocabs due today, great job!')
+      outbox.enqueue(latest_session.chat_id,
+                     'No more vocabs due today, great job!')
       continue
 
     message = "Here are your due vocabs for today:\n\n"
@@ -428,47 +591,195 @@ async def remind_vocabs(user_profiles: List[UserProfile],
         message += f"  - {encounter.summary()}\n"
       message += "\n"
 
-    await context.bot.send_message(chat_id=latest_session.chat_id,
-                                   text=message)
-    await refresh_vocab_quiz()
-    await context.bot.send_message(
-      chat_id=latest_session.chat_id,
-      text="Send /vocabquiz to show how well you remember these words.")
+    outbox.enqueue(latest_session.chat_id, message)
+    reminded_profiles.append(user_profile)
+
+  # Vocabs that just became due may still miss questions.
+  for user_profile in reminded_profiles:
+    await quiz_inventory.top_up(user_profile.user_id)
+  for user_profile in reminded_profiles:
+    outbox.enqueue(
+      user_profile.sessions[-1].chat_id,
+      "Send /vocabquiz to show how well you remember these words.")
+
+
+async def remind_users(user_ids: List[int]):
+  # The manifest tells which users have due vocabs, only those are loaded.
+  today = date.today()
+  user_profiles = []
+  for user_id in user_ids:
+    entry = db.manifest.entries.get(user_id)
+    if entry is None or entry.chat_id is None:
+      continue
+    if entry.has_due(today):
+      user_profiles.append(await db.get_user_profile(user_id))
+    else:
+      outbox.enqueue(entry.chat_id, 'No more vocabs due today, great job!')
+  await remind_vocabs(user_profiles)
+
 
+reminder_scheduler = ReminderScheduler(remind_users)
 
+
+def schedule_reminder(user_profile: UserProfile):
+  reminder_scheduler.schedule(user_profile.user_id, user_profile.reminder_time,
+                              user_profile.timezone)
+
+
+@instrument_handler
 async def remind_vocabs_handler(context: ContextTypes.DEFAULT_TYPE):
-  all_user_profiles = await db.get_all_user_profiles()
-  await remind_vocabs(all_user_profiles, context)
+  # Runs every minute, only reminding the users whose slot is due.
+  await reminder_scheduler.run_due()
 
 
+@instrument_handler
+async def compact_sessions_handler(context: ContextTypes.DEFAULT_TYPE):
+  # The manifest lists the users, only the owned profiles are loaded.
+  for user_id, entry in list(db.manifest.entries.items()):
+    if entry.last_activity is None or not owns_user(user_id):
+      continue
+    async with db.lock(user_id):
+      user_profile = await db.get_user_profile(user_id)
+      if await session_archive.compact_async(user_profile):
+        await db.set_user_profile(user_profile)
+
+
+@instrument_handler
+async def remind_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  logging.info("Entering remind_handler")
+  user_id = update.effective_user.id
+  if len(context.args) == 0:
+    await update.message.reply_text(
+      "Send /remind HH:MM [Timezone], e.g. /remind 08:30 Europe/Berlin, "
+      "or /remind off")
+    return
+  if context.args[0] == "off":
+    async with db.lock(user_id):
+      user_profile = await db.get_user_profile(user_id)
+      user_profile.reminder_time = None
+      await db.set_user_profile(user_profile)
+    schedule_reminder(user_profile)
+    await update.message.reply_text("Daily reminder disabled.")
+    return
+
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    try:
+      reminder_time = datetime.strptime(context.args[0], "%H:%M").time()
+      tz_name = (context.args[1] if len(context.args) > 1 else
+                 user_profile.timezone)
+      ZoneInfo(tz_name)
+    except (ValueError, ZoneInfoNotFoundError):
+      reminder_time = None
+    else:
+      user_profile.reminder_time = reminder_time
+      user_profile.timezone = tz_name
+      await db.set_user_profile(user_profile)
+  if reminder_time is None:
+    await update.message.reply_text(
+      "Invalid time or timezone. Example: /remind 08:30 Europe/Berlin")
+    return
+  if user_profile.sessions:
+    schedule_reminder(user_profile)
+  await update.message.reply_text(
+    f"I'll remind you daily at {reminder_time.strftime('%H:%M')} ({tz_name}).")
+
+
+@instrument_handler
 async def vocabs_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
   user_profile = await db.get_user_profile(update.effective_user.id)
-  await remind_vocabs([user_profile], context)
+  await remind_vocabs([user_profile])
 
 
+@instrument_handler
 async def vocabquiz_handler(update: Update,
                             context: ContextTypes.DEFAULT_TYPE):
   logging.info("Entering vocabquiz_handler")
 
-  user_profile = await db.get_user_profile(update.effective_user.id)
-  due_vocabs = user_profile.vocabs.due_vocabs(n=20)
-  for v in due_vocabs:
-    print(v)
-  quiz = [random.choice(vocab.quiz) for vocab in due_vocabs if vocab.quiz][:10]
-  vocab_roots = [vocab.root for vocab in due_vocabs if vocab.quiz][:10]
-  session_id = len(user_profile.sessions)
-  session = LearningSession(session_id=session_id,
-                            text="VocabQuiz",
-                            chat_id=update.effective_chat.id,
-                            vocab_roots=vocab_roots,
-                            quiz=quiz,
-                            start_time=datetime.now())
-  user_profile.sessions.append(session)
-  await db.set_user_profile(user_profile)
+  user_id = update.effective_user.id
+  async with db.lock(user_id):
+    user_profile = await db.get_user_profile(user_id)
+    due_vocabs = user_profile.vocabs.due_vocabs(n=20)
+    empty_vocabs = [vocab for vocab in due_vocabs if not vocab.quiz]
+    if empty_vocabs:
+      # Should not happen as the inventory is topped up on every vocab
+      # change, local questions take no LLM call and fill the gap.
+      for root, question in local_question_generator.generate(
+          user_profile.vocabs, empty_vocabs):
+        user_profile.vocabs.get(root).quiz.append(question)
+      quiz_inventory.notify(user_profile.user_id)
+    quiz = [random.choice(vocab.quiz) for vocab in due_vocabs
+            if vocab.quiz][:10]
+    vocab_roots = [vocab.root for vocab in due_vocabs if vocab.quiz][:10]
+    session_id = user_profile.new_session_id()
+    session = LearningSession(session_id=session_id,
+                              text="VocabQuiz",
+                              chat_id=update.effective_chat.id,
+                              vocab_roots=vocab_roots,
+                              quiz=quiz,
+                              start_time=datetime.now())
+    user_profile.start_session(session)
+    schedule_reminder(user_profile)
+    await db.set_user_profile(user_profile)
 
   return await ask_question_handler(update, context)
 
 
+@instrument_handler
+async def import_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  logging.info("Entering import_handler")
+  document = update.message.document
+  if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+    await update.message.reply_text("The file is too large, max 1 MB.")
+    return
+  message = await create_placeholder_message(update.message.chat_id, context)
+  file = await document.get_file()
+  data = await file.download_as_bytearray()
+  try:
+    text = bytes(data).decode("utf-8-sig")
+  except UnicodeDecodeError:
+    await message.edit_text("Please send a UTF-8 encoded CSV or TSV file.")
+    return
+  result = await vocab_importer.import_text(update.effective_user.id, text)
+  if result.added:
+    quiz_inventory.notify(update.effective_user.id)
+  await message.edit_text(result.summary())
+
+
+@instrument_handler
+async def export_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  logging.info("Entering export_handler")
+  user_profile = await db.get_user_profile(update.effective_user.id)
+  await update.message.reply_document(export_bytes(user_profile.vocabs),
+                                      filename="vocabs.csv")
+
+
+@instrument_handler
+async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  logging.info("Entering stats_handler")
+  user_profile = await db.get_user_profile(update.effective_user.id)
+  await update.message.reply_text(user_profile.summary())
+
+
+@instrument_handler
+async def profile_handler(update: Update,
+                          context: ContextTypes.DEFAULT_TYPE):
+  if update.effective_user.id not in ADMIN_USER_IDS:
+    return
+  try:
+    seconds = float(context.args[0]) if context.args else PROFILE_SECONDS
+  except ValueError:
+    await update.message.reply_text("Usage: /profile [seconds]")
+    return
+  seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+  await update.message.reply_text(f"Sampling the event loop for {seconds:g}s")
+  counts = await loop_profiler.sample(seconds)
+  await update.message.reply_text(
+    f"Max loop lag: {loop_profiler.max_lag * 1000:.0f}ms\n" +
+    format_profile(counts))
+
+
+@instrument_handler
 async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
   help_text = (
     "Welcome to GermanTutor Bot!\n\n"
@@ -477,6 +788,10 @@ async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     "- Practice with quiz questions\n"
     "- Translate the text\n"
     "Send /vocabs: list vocabs to learn today, extracted from your activity\n"
+    "Send /stats: see your learning progress\n"
+    "Send a CSV or TSV file with one word per line to import vocabs, "
+    "/export to download them\n"
+    "Send /remind 08:30 Europe/Berlin: set your daily reminder time\n"
     "Send /define Danke: short definition of the word 'Danke'\n"
     "Send /translate Es war einmal: to translate the phrase 'Es war einmal'\n"
     "Send any question, like 'Why \"Ich weiß, dass ich Deutsch lernen kann\" and not \"dass ich kann lernen Deutsch\"?'\n"
@@ -486,10 +801,36 @@ async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                   reply_markup=ReplyKeyboardRemove())
 
 
-def main():
+async def post_init(application: Application):
+  if LOOP_PROFILER:
+    loop_profiler.start()
+  await metrics.start_http_server(METRICS_PORT)
+  await outbox.start(application.bot)
+  # Catches up the reminders of the slots passed while the bot was down.
+  reminder_scheduler.last_run = db.manifest.reminder_minute
+  reminder_scheduler.save_last_run = db.manifest.save_reminder_minute
+  for user_id, entry in db.manifest.entries.items():
+    # Reminders go to the chat of the latest session.
+    if entry.chat_id is not None and owns_user(user_id):
+      reminder_scheduler.schedule(user_id, entry.reminder_time, entry.timezone)
+  application.create_task(resume_extractions(application))
+
+
+async def post_shutdown(application: Application):
+  await outbox.stop()
+  offloader.shutdown()
+  await loop_profiler.stop()
+
+
+def build_application(with_updater: bool = True) -> Application:
   # Create the Application and pass it your bot's token.
-  application = Application.builder().token(
-    TELEGRAM_BOT_TOKEN).concurrent_updates(True).build()
+  conversation_store = ConversationStore(db)
+  builder = Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(
+    True).persistence(conversation_store).post_init(post_init).post_shutdown(
+      post_shutdown)
+  if not with_updater:
+    builder = builder.updater(None)
+  application = builder.build()
   default_handlers = [
     CommandHandler("stoplearn", stop_learn_handler),
     CommandHandler('define', define_handler),
@@ -499,6 +840,14 @@ def main():
     CommandHandler('help', help_handler),
     CommandHandler('vocabs', vocabs_handler),
     CommandHandler('vocabquiz', vocabquiz_handler),
+    CommandHandler('remind', remind_handler),
+    CommandHandler('stats', stats_handler),
+    CommandHandler('profile', profile_handler),
+    CommandHandler('export', export_handler),
+    MessageHandler(
+      filters.Document.FileExtension("csv") |
+      filters.Document.FileExtension("tsv") |
+      filters.Document.FileExtension("txt"), import_handler),
     MessageHandler(filters.TEXT & ~filters.COMMAND, ask_anything_handler)
   ]
   learn_conv_handler = ConversationHandler(
@@ -523,14 +872,20 @@ def main():
     fallbacks=default_handlers,
     map_to_parent={
       ConversationHandler.END: -1,
-    })
-
+    },
+    name="learn",
+    persistent=True)
+  conversation_store.register(learn_conv_handler)
+
+  # Restores the user's conversation states before their first update since
+  # startup is handled.
+  application.add_handler(TypeHandler(Update, conversation_store.restore),
+                          group=-1)
   application.add_handler(learn_conv_handler)
 
   # Register the callback query handler
   application.add_handler(
-    CallbackQueryHandler(keywords_on_click_handler,
-                         pattern='^[keyword|prev_page|next_page]'))
+    CallbackQueryHandler(keywords_on_click_handler, pattern=CALLBACK_PATTERN))
   application.add_handler(PollAnswerHandler(ask_question_on_answer_handler))
 
   # Register stateless commands
@@ -538,9 +893,104 @@ def main():
     application.add_handler(handler)
   application.add_handler(CommandHandler('start', help_handler))
 
-  # Schedule the handler to run every day at 10:00am
+  # Users are reminded at their own local time, see ReminderScheduler.
   job_queue = application.job_queue
-  job_queue.run_daily(remind_vocabs_handler, time(hour=10, minute=0, second=0))
+  job_queue.run_repeating(remind_vocabs_handler, interval=60, first=0)
+  # Move old sessions to cold storage every night.
+  job_queue.run_daily(compact_sessions_handler, time(hour=3))
+  return application
+
+
+def run_worker(worker_shard_id: int, worker_num_shards: int, queue):
+  global db, outbox, quiz_inventory, vocab_importer, shard_id, num_shards
+  global METRICS_PORT
+  shard_id, num_shards = worker_shard_id, worker_num_shards
+  # This worker is the only writer of its users' profiles, so it can cache.
+  db = UserProfileDB(cache_size=PROFILE_CACHE_SIZE,
+                     manifest_name=f"manifest-{shard_id}")
+  outbox = MessageQueue(path=f"outbox-{shard_id}.log")
+  quiz_inventory = QuizInventory(db, vocab_question_extractor,
+                                 local_generator=local_question_generator)
+  vocab_importer = VocabImporter(db, keyword_extractor)
+  METRICS_PORT += shard_id
+  application = build_application(with_updater=False)
+
+  async def consume_updates():
+    loop = asyncio.get_running_loop()
+    async with application:
+      # post_init and post_shutdown are only called by run_polling.
+      await post_init(application)
+      await application.start()
+      while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+          break
+        update = Update.de_json(data, application.bot)
+        await application.update_queue.put(update)
+      await application.stop()
+      await post_shutdown(application)
+
+  asyncio.run(consume_updates())
+
+
+def run_sharded(num_workers: int):
+  runner = ShardedRunner(num_workers, run_worker)
+  runner.start()
+  bot = Bot(TELEGRAM_BOT_TOKEN)
+
+  async def intake():
+    async with bot:
+      await poll_updates(bot, runner)
+
+  try:
+    asyncio.run(intake())
+  except KeyboardInterrupt:
+    pass
+  finally:
+    runner.stop()
+
+
+def run_webhook():
+  application = build_application(with_updater=False)
+
+  async def process_update(data):
+    await application.process_update(Update.de_json(data, application.bot))
+
+  async def serve():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+      loop.add_signal_handler(sig, stop_event.set)
+
+    server = WebhookServer(process_update,
+                           port=WEBHOOK_PORT,
+                           path=urlparse(WEBHOOK_URL).path or "/",
+                           secret_token=WEBHOOK_SECRET)
+    async with application:
+      await post_init(application)
+      await application.start()
+      await server.start()
+      await application.bot.set_webhook(WEBHOOK_URL,
+                                        secret_token=WEBHOOK_SECRET)
+      await stop_event.wait()
+      # Finish the accepted updates before shutting down.
+      await server.stop()
+      await application.stop()
+      await post_shutdown(application)
+
+  asyncio.run(serve())
+
+
+def main():
+  global outbox
+  if BOT_WORKERS > 1:
+    run_sharded(BOT_WORKERS)
+    return
+  outbox = MessageQueue()
+  if WEBHOOK_URL:
+    run_webhook()
+    return
+  application = build_application()
   # Run the bot until the user presses Ctrl-C
   application.run_polling()
 
@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import logging
+import os
+import pickle
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows ~30 messages per second overall and ~1 per second per chat.
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+MAX_CONCURRENT_SENDS = 30
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 1.0
+MERGE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+
+  def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.clock = clock
+    self.updated = clock()
+
+  def _refill(self):
+    now = self.clock()
+    self.tokens = min(self.capacity,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def wait_time(self) -> float:
+    self._refill()
+    if self.tokens >= 1:
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+  def consume(self):
+    self._refill()
+    self.tokens -= 1
+
+  def pause(self, seconds: float):
+    # No token becomes available for `seconds`.
+    self._refill()
+    self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+@dataclass
+class OutboundMessage:
+  chat_id: int
+  text: str
+  # Journal ids of every enqueued message merged into this one.
+  ids: List[int] = field(default_factory=list)
+  attempts: int = 0
+
+
+class MessageQueue:
+  """Rate limited outbound queue for plain text messages.
+
+  Every enqueue and delivery is appended to a journal, so messages that were
+  not delivered before a restart are sent when the queue is created again.
+  """
+
+  def __init__(self,
+               path: str = "outbox.log",
+               global_rate: float = GLOBAL_RATE,
+               chat_rate: float = CHAT_RATE,
+               max_concurrent_sends: int = MAX_CONCURRENT_SENDS,
+               max_attempts: int = MAX_ATTEMPTS,
+               retry_backoff: float = RETRY_BACKOFF,
+               clock=time.monotonic):
+    self.path = path
+    self.chat_rate = chat_rate
+    self.max_attempts = max_attempts
+    self.retry_backoff = retry_backoff
+    self.clock = clock
+    self.bot = None
+    # Capacity 1 spreads sends evenly instead of bursting.
+    self.global_bucket = TokenBucket(global_rate, 1, clock)
+    self.chat_buckets: Dict[int, TokenBucket] = {}
+    self.pending: Dict[int, Deque[OutboundMessage]] = {}
+    # (not_before, seq, chat_id) for every chat with pending messages that
+    # is not currently sending.
+    self._ready: List[Tuple[float, int, int]] = []
+    self._sending: Set[int] = set()
+    self._seq = 0
+    self._next_id = 0
+    self._send_slots = asyncio.Semaphore(max_concurrent_sends)
+    self._wakeup = asyncio.Event()
+    self._idle = asyncio.Event()
+    self._idle.set()
+    self._worker: Optional[asyncio.Task] = None
+    self._tasks: Set[asyncio.Task] = set()
+    self.sent_count = 0
+    self.dropped_count = 0
+    self._journal = None
+    self._load_journal()
+
+  def _load_journal(self):
+    unsent: Dict[int, Tuple[int, str]] = {}
+    if os.path.exists(self.path):
+      with open(self.path, 'rb') as f:
+        while True:
+          try:
+            record = pickle.load(f)
+          except (EOFError, pickle.UnpicklingError):
+            # A crash may leave a truncated record at the end.
+            break
+          if record[0] == "enq":
+            _, msg_id, chat_id, text = record
+            unsent[msg_id] = (chat_id, text)
+            self._next_id = max(self._next_id, msg_id + 1)
+          else:
+            unsent.pop(record[1], None)
+
+    # Rewrite the journal with the unsent messages only.
+    tmp_path = f"{self.path}.tmp"
+    with open(tmp_path, 'wb') as f:
+      for msg_id, (chat_id, text) in sorted(unsent.items()):
+        pickle.dump(("enq", msg_id, chat_id, text), f)
+    os.replace(tmp_path, self.path)
+    self._journal = open(self.path, 'ab')
+
+    for msg_id, (chat_id, text) in sorted(unsent.items()):
+      self._push(chat_id, text, msg_id)
+    if unsent:
+      logger.info(f"Resuming {len(unsent)} unsent messages from {self.path}")
+
+  def _write(self, record: tuple):
+    pickle.dump(record, self._journal)
+    self._journal.flush()
+
+  def _chat_bucket(self, chat_id: int) -> TokenBucket:
+    if chat_id not in self.chat_buckets:
+      self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1, self.clock)
+    return self.chat_buckets[chat_id]
+
+  def _schedule(self, chat_id: int):
+    not_before = self.clock() + self._chat_bucket(chat_id).wait_time()
+    self._seq += 1
+    heapq.heappush(self._ready, (not_before, self._seq, chat_id))
+    self._wakeup.set()
+
+  def _push(self, chat_id: int, text: str, msg_id: int):
+    self._idle.clear()
+    chat_queue = self.pending.setdefault(chat_id, deque())
+    if chat_queue:
+      tail = chat_queue[-1]
+      merged_len = len(tail.text) + len(MERGE_SEPARATOR) + len(text)
+      if merged_len <= MessageLimit.MAX_TEXT_LENGTH:
+        tail.text += MERGE_SEPARATOR + text
+        tail.ids.append(msg_id)
+        return
+      chat_queue.append(OutboundMessage(chat_id, text, [msg_id]))
+      return
+    chat_queue.append(OutboundMessage(chat_id, text, [msg_id]))
+    if chat_id not in self._sending:
+      self._schedule(chat_id)
+
+  def enqueue(self, chat_id: int, text: str):
+    msg_id = self._next_id
+    self._next_id += 1
+    self._write(("enq", msg_id, chat_id, text))
+    self._push(chat_id, text, msg_id)
+
+  def __len__(self) -> int:
+    return sum(len(q) for q in self.pending.values())
+
+  async def start(self, bot):
+    self.bot = bot
+    if self._worker is None:
+      self._worker = asyncio.create_task(self._run())
+
+  async def join(self):
+    await self._idle.wait()
+
+  async def stop(self):
+    if self._worker is not None:
+      self._worker.cancel()
+      try:
+        await self._worker
+      except asyncio.CancelledError:
+        pass
+      self._worker = None
+    if self._tasks:
+      await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._journal.close()
+
+  async def _sleep(self, timeout: float):
+    self._wakeup.clear()
+    try:
+      await asyncio.wait_for(self._wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+      pass
+
+  async def _run(self):
+    while True:
+      if not self._ready:
+        if not self._sending:
+          self._idle.set()
+        await self._sleep(None)
+        continue
+
+      not_before, _, chat_id = self._ready[0]
+      delay = max(not_before - self.clock(), self.global_bucket.wait_time())
+      if delay > 0:
+        await self._sleep(delay)
+        continue
+
+      heapq.heappop(self._ready)
+      message = self.pending[chat_id].popleft()
+      self.global_bucket.consume()
+      self._chat_bucket(chat_id).consume()
+      self._sending.add(chat_id)
+      await self._send_slots.acquire()
+      task = asyncio.create_task(self._send(message))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+
+  async def _send(self, message: OutboundMessage):
+    chat_id = message.chat_id
+    delivered = False
+    try:
+      await self.bot.send_message(chat_id=chat_id, text=message.text)
+      delivered = True
+      self.sent_count += 1
+    except RetryAfter as e:
+      logger.warning(f"Flood control, pausing sends for {e.retry_after}s")
+      self.global_bucket.pause(e.retry_after)
+      self._chat_bucket(chat_id).pause(e.retry_after)
+      self.pending[chat_id].appendleft(message)
+    except BadRequest as e:
+      logger.error(f"Dropping message to {chat_id}: {e}")
+      delivered = True
+      self.dropped_count += 1
+    except NetworkError as e:
+      message.attempts += 1
+      if message.attempts >= self.max_attempts:
+        logger.error(f"Giving up message to {chat_id}: {e}")
+        delivered = True
+        self.dropped_count += 1
+      else:
+        # Exponential backoff on this chat only.
+        self._chat_bucket(chat_id).pause(self.retry_backoff *
+                                         2**(message.attempts - 1))
+        self.pending[chat_id].appendleft(message)
+    except TelegramError as e:
+      # Forbidden (user blocked the bot), chat not found, ...
+      logger.error(f"Dropping message to {chat_id}: {e}")
+      delivered = True
+      self.dropped_count += 1
+    finally:
+      self._send_slots.release()
+      self._sending.discard(chat_id)
+      if delivered:
+        for msg_id in message.ids:
+          self._write(("ack", msg_id))
+      if self.pending.get(chat_id):
+        self._schedule(chat_id)
+      else:
+        self.pending.pop(chat_id, None)
+        self._wakeup.set()
+      if not self._ready and not self._sending and not self._journal.closed:
+        self._truncate_journal()
+
+  def _truncate_journal(self):
+    # Everything has been delivered, start a fresh journal.
+    self._journal.seek(0)
+    self._journal.truncate()
+    self._idle.set()
@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict
+
+from telegram.error import RetryAfter
+
+from message_queue import MessageQueue
+
+
+class FakeBot:
+  """Mimics Telegram's flood control: RetryAfter when a chat or the whole bot
+  sends faster than allowed."""
+
+  def __init__(self, latency: float = 0.05, global_rate: float = 30,
+               chat_rate: float = 1):
+    self.latency = latency
+    self.global_interval = 1 / global_rate
+    self.chat_interval = 1 / chat_rate
+    self.last_global = 0.0
+    self.last_chat: Dict[int, float] = {}
+    self.sent: Dict[int, list] = {}
+    self.flood_errors = 0
+
+  async def send_message(self, chat_id: int, text: str):
+    now = time.monotonic()
+    too_fast = (now - self.last_global < self.global_interval * 0.5 or
+                now - self.last_chat.get(chat_id, -1e9) <
+                self.chat_interval * 0.5)
+    if too_fast:
+      self.flood_errors += 1
+      await asyncio.sleep(self.latency)
+      raise RetryAfter(1)
+    self.last_global = now
+    self.last_chat[chat_id] = now
+    await asyncio.sleep(self.latency)
+    self.sent.setdefault(chat_id, []).append(text)
+
+
+async def broadcast_sequential(bot: FakeBot, num_users: int) -> float:
+  # What remind_vocabs used to do: three awaited sends per user.
+  start = time.monotonic()
+  for chat_id in range(num_users):
+    for text in ("due vocabs", "quiz refreshed", "/vocabquiz"):
+      try:
+        await bot.send_message(chat_id=chat_id, text=text)
+      except RetryAfter:
+        pass
+  return time.monotonic() - start
+
+
+async def broadcast_queued(bot: FakeBot, num_users: int, path: str) -> float:
+  outbox = MessageQueue(path=path)
+  start = time.monotonic()
+  await outbox.start(bot)
+  for chat_id in range(num_users):
+    for text in ("due vocabs", "quiz refreshed", "/vocabquiz"):
+      outbox.enqueue(chat_id, text)
+  await outbox.join()
+  elapsed = time.monotonic() - start
+  await outbox.stop()
+  return elapsed
+
+
+async def main(num_users: int, latency: float):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    bot = FakeBot(latency=latency)
+    elapsed = await broadcast_sequential(bot, num_users)
+    delivered = sum(len(v) for v in bot.sent.values())
+    print(f"sequential: {elapsed:.2f}s, {delivered}/{3 * num_users} "
+          f"messages delivered, {bot.flood_errors} flood errors")
+
+    bot = FakeBot(latency=latency)
+    elapsed = await broadcast_queued(bot, num_users,
+                                     os.path.join(tmp_dir, "outbox.log"))
+    delivered = sum(len(v) for v in bot.sent.values())
+    print(f"queued:     {elapsed:.2f}s, {delivered} merged messages to "
+          f"{len(bot.sent)}/{num_users} users, {bot.flood_errors} flood errors")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Broadcast completion time against a fake Bot")
+  parser.add_argument("--users", type=int, default=100)
+  parser.add_argument("--latency", type=float, default=0.05)
+  args = parser.parse_args()
+  asyncio.run(main(args.users, args.latency))
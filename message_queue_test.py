@@ -0,0 +1,112 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from telegram.error import Forbidden, RetryAfter, TimedOut
+
+from message_queue import MessageQueue, TokenBucket
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self) -> float:
+    return self.now
+
+
+class RecordingBot:
+
+  def __init__(self, failures=None):
+    self.sent = []
+    # Exceptions raised by the first calls, in order.
+    self.failures = list(failures or [])
+
+  async def send_message(self, chat_id: int, text: str):
+    if self.failures:
+      raise self.failures.pop(0)
+    self.sent.append((chat_id, text))
+
+
+class TestTokenBucket(unittest.TestCase):
+
+  def test_refill(self):
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    bucket.consume()
+    bucket.consume()
+    self.assertAlmostEqual(bucket.wait_time(), 0.5)
+    clock.now = 0.5
+    self.assertEqual(bucket.wait_time(), 0.0)
+
+  def test_pause(self):
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, capacity=1, clock=clock)
+    bucket.pause(3)
+    self.assertAlmostEqual(bucket.wait_time(), 3)
+
+
+class TestMessageQueue(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp_dir.name, "outbox.log")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  async def test_merge_consecutive_messages(self):
+    bot = RecordingBot()
+    outbox = MessageQueue(path=self.path, chat_rate=100)
+    outbox.enqueue(1, "a")
+    outbox.enqueue(1, "b")
+    outbox.enqueue(2, "c")
+    await outbox.start(bot)
+    await outbox.join()
+    await outbox.stop()
+    self.assertCountEqual(bot.sent, [(1, "a\n\nb"), (2, "c")])
+
+  async def test_retry_after_and_network_errors(self):
+    bot = RecordingBot(failures=[RetryAfter(0.01), TimedOut()])
+    outbox = MessageQueue(path=self.path, chat_rate=1000, retry_backoff=0.01)
+    await outbox.start(bot)
+    outbox.enqueue(1, "hello")
+    await asyncio.wait_for(outbox.join(), timeout=5)
+    await outbox.stop()
+    self.assertEqual(bot.sent, [(1, "hello")])
+
+  async def test_drop_forbidden(self):
+    bot = RecordingBot(failures=[Forbidden("blocked")])
+    outbox = MessageQueue(path=self.path)
+    await outbox.start(bot)
+    outbox.enqueue(1, "hello")
+    await asyncio.wait_for(outbox.join(), timeout=5)
+    await outbox.stop()
+    self.assertEqual(bot.sent, [])
+    self.assertEqual(outbox.dropped_count, 1)
+
+  async def test_resume_after_restart(self):
+    outbox = MessageQueue(path=self.path)
+    outbox.enqueue(1, "first")
+    outbox.enqueue(2, "second")
+    # Simulate a crash before anything was sent.
+    await outbox.stop()
+
+    bot = RecordingBot()
+    outbox = MessageQueue(path=self.path)
+    self.assertEqual(len(outbox), 2)
+    await outbox.start(bot)
+    await outbox.join()
+    await outbox.stop()
+    self.assertCountEqual(bot.sent, [(1, "first"), (2, "second")])
+
+    # Nothing left to resend.
+    outbox = MessageQueue(path=self.path)
+    self.assertEqual(len(outbox), 0)
+    await outbox.stop()
+
+
+if __name__ == '__main__':
+  unittest.main()
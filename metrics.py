@@ -0,0 +1,243 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = 9100
+# Fraction of LLM outputs written to the debug log.
+LOG_SAMPLE_RATE = 0.05
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+  if not names:
+    return ""
+  pairs = []
+  for name, value in zip(names, values):
+    value = str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+      '\n', r'\n')
+    pairs.append(f'{name}="{value}"')
+  return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+
+  def __init__(self, name: str, documentation: str,
+               labelnames: Sequence[str] = ()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.values: Dict[Tuple[str, ...], float] = {}
+    self._lock = threading.Lock()
+
+  def inc(self, amount: float = 1, **labels):
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    with self._lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def get(self, **labels) -> float:
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    return self.values.get(key, 0)
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.documentation}",
+             f"# TYPE {self.name} counter"]
+    for key, value in sorted(self.values.items()):
+      lines.append(
+        f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+    return lines
+
+
+class Histogram:
+
+  def __init__(self, name: str, documentation: str,
+               labelnames: Sequence[str] = (),
+               buckets: Sequence[float] = LATENCY_BUCKETS):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.buckets = tuple(buckets)
+    # labels -> (bucket counts, sum, count)
+    self.values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value: float, **labels):
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    with self._lock:
+      counts, total, count = self.values.get(
+        key, ([0] * len(self.buckets), 0.0, 0))
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          counts[i] += 1
+      self.values[key] = (counts, total + value, count + 1)
+
+  def count(self, **labels) -> int:
+    key = tuple(str(labels[name]) for name in self.labelnames)
+    return self.values[key][2] if key in self.values else 0
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.documentation}",
+             f"# TYPE {self.name} histogram"]
+    for key, (counts, total, count) in sorted(self.values.items()):
+      for bound, bucket_count in zip(self.buckets, counts):
+        labels = _format_labels(self.labelnames + ("le",), key + (bound,))
+        lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+      labels = _format_labels(self.labelnames + ("le",), key + ("+Inf",))
+      lines.append(f"{self.name}_bucket{labels} {count}")
+      labels = _format_labels(self.labelnames, key)
+      lines.append(f"{self.name}_sum{labels} {total}")
+      lines.append(f"{self.name}_count{labels} {count}")
+    return lines
+
+
+class Registry:
+
+  def __init__(self):
+    self.metrics = []
+
+  def counter(self, *args, **kwargs) -> Counter:
+    metric = Counter(*args, **kwargs)
+    self.metrics.append(metric)
+    return metric
+
+  def histogram(self, *args, **kwargs) -> Histogram:
+    metric = Histogram(*args, **kwargs)
+    self.metrics.append(metric)
+    return metric
+
+  def render(self) -> str:
+    lines = []
+    for metric in self.metrics:
+      lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_latency = registry.histogram("bot_handler_latency_seconds",
+                                     "Wall-clock latency of bot handlers",
+                                     ["handler"])
+handler_errors = registry.counter("bot_handler_errors_total",
+                                  "Exceptions raised by bot handlers",
+                                  ["handler"])
+llm_latency = registry.histogram("bot_llm_latency_seconds",
+                                 "LLM round-trip time",
+                                 ["extractor", "call"])
+llm_tokens = registry.counter("bot_llm_tokens_total", "LLM tokens used",
+                              ["extractor", "call", "kind"])
+parse_results = registry.counter(
+  "bot_parse_results_total",
+  "LLM outputs parsed into at least one record (ok) or none (empty)",
+  ["extractor", "call", "result"])
+parsed_records = registry.counter("bot_parsed_records_total",
+                                  "Records parsed from LLM outputs",
+                                  ["extractor", "call"])
+# (handler name, user id) of the update being handled. Tasks created by the
+# handler inherit it, see loop_profiler.
+current_handler: contextvars.ContextVar[Optional[Tuple[str, Optional[int]]]] = (
+  contextvars.ContextVar("current_handler", default=None))
+# The last handler entered, also after it returned and reset current_handler,
+# see loop_profiler.
+entered_handler: Optional[Tuple[str, Optional[int]]] = None
+
+db_bytes = registry.counter("bot_db_bytes_total",
+                            "Bytes read from and written to the profile store",
+                            ["op"])
+
+
+def instrument_handler(func):
+
+  @functools.wraps(func)
+  async def wrapper(*args, **kwargs):
+    if current_handler.get() is not None:
+      # Called by another handler, which is timed and blamed already.
+      return await func(*args, **kwargs)
+    global entered_handler
+    user = getattr(args[0], "effective_user", None) if args else None
+    entered_handler = (func.__name__, user.id if user else None)
+    token = current_handler.set(entered_handler)
+    start = time.perf_counter()
+    try:
+      return await func(*args, **kwargs)
+    except Exception:
+      handler_errors.inc(handler=func.__name__)
+      raise
+    finally:
+      handler_latency.observe(time.perf_counter() - start,
+                              handler=func.__name__)
+      current_handler.reset(token)
+
+  return wrapper
+
+
+def log_sampled(event: str, sample_rate: float = LOG_SAMPLE_RATE,
+                **fields: Any):
+  if random.random() >= sample_rate:
+    return
+  logger.info(json.dumps({"event": event, **fields}, ensure_ascii=False,
+                         default=str))
+
+
+async def run_chain(chain, extractor: str, call: str, **inputs: Any) -> str:
+  """Same as `chain.apredict(**inputs)`, recording latency and tokens."""
+  output, _ = await run_chain_with_usage(chain, extractor, call, **inputs)
+  return output
+
+
+async def run_chain_with_usage(chain, extractor: str, call: str,
+                               **inputs: Any) -> Tuple[str, Dict[str, int]]:
+  """`run_chain` that also returns the token usage reported by the API."""
+  start = time.perf_counter()
+  result = await chain.agenerate([inputs])
+  elapsed = time.perf_counter() - start
+  llm_latency.observe(elapsed, extractor=extractor, call=call)
+  token_usage = (result.llm_output or {}).get("token_usage", {})
+  for kind in ("prompt_tokens", "completion_tokens"):
+    if kind in token_usage:
+      llm_tokens.inc(token_usage[kind], extractor=extractor, call=call,
+                     kind=kind.replace("_tokens", ""))
+  output = result.generations[0][0].text
+  log_sampled("llm_output", extractor=extractor, call=call,
+              latency=round(elapsed, 3), output=output)
+  return output, token_usage
+
+
+def record_parse(extractor: str, call: str, num_records: int):
+  parse_results.inc(extractor=extractor, call=call,
+                    result="ok" if num_records else "empty")
+  parsed_records.inc(num_records, extractor=extractor, call=call)
+
+
+async def _handle_request(reader: asyncio.StreamReader,
+                          writer: asyncio.StreamWriter):
+  try:
+    request_line = await reader.readline()
+    # Skip the headers.
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+      pass
+    parts = request_line.decode("latin-1").split()
+    if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+      status, body = "200 OK", registry.render().encode()
+    else:
+      status, body = "404 Not Found", b"Not Found\n"
+    writer.write((f"HTTP/1.1 {status}\r\n"
+                  "Content-Type: text/plain; version=0.0.4\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  "Connection: close\r\n\r\n").encode() + body)
+    await writer.drain()
+  finally:
+    writer.close()
+
+
+async def start_http_server(port: int = METRICS_PORT,
+                            host: str = "127.0.0.1") -> asyncio.AbstractServer:
+  server = await asyncio.start_server(_handle_request, host, port)
+  logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+  return server
@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import metrics
+from metrics import Registry, instrument_handler
+
+
+class FakeChain:
+
+  async def agenerate(self, input_list):
+    return SimpleNamespace(
+      generations=[[SimpleNamespace(text=f"echo {input_list[0]['text']}")]],
+      llm_output={"token_usage": {"prompt_tokens": 12,
+                                  "completion_tokens": 3}})
+
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+
+  def test_render_prometheus_text(self):
+    registry = Registry()
+    counter = registry.counter("test_total", "A counter", ["kind"])
+    histogram = registry.histogram("test_seconds", "A histogram", [],
+                                   buckets=(0.1, 1))
+    counter.inc(kind="a")
+    counter.inc(2, kind='b"')
+    histogram.observe(0.5)
+    text = registry.render()
+    self.assertIn('test_total{kind="a"} 1', text)
+    self.assertIn('test_total{kind="b\\""} 2', text)
+    self.assertIn('test_seconds_bucket{le="0.1"} 0', text)
+    self.assertIn('test_seconds_bucket{le="1"} 1', text)
+    self.assertIn('test_seconds_bucket{le="+Inf"} 1', text)
+    self.assertIn('test_seconds_count 1', text)
+
+  async def test_instrument_handler(self):
+
+    @instrument_handler
+    async def failing_test_handler():
+      raise ValueError()
+
+    with self.assertRaises(ValueError):
+      await failing_test_handler()
+    self.assertEqual(
+      metrics.handler_latency.count(handler="failing_test_handler"), 1)
+    self.assertEqual(
+      metrics.handler_errors.get(handler="failing_test_handler"), 1)
+
+  async def test_nested_handlers_are_recorded_once(self):
+
+    @instrument_handler
+    async def inner_test_handler():
+      return metrics.current_handler.get()
+
+    @instrument_handler
+    async def outer_test_handler():
+      return await inner_test_handler()
+
+    self.assertEqual(await outer_test_handler(), ("outer_test_handler", None))
+    self.assertIsNone(metrics.current_handler.get())
+    self.assertEqual(
+      metrics.handler_latency.count(handler="outer_test_handler"), 1)
+    self.assertEqual(
+      metrics.handler_latency.count(handler="inner_test_handler"), 0)
+
+  async def test_run_chain(self):
+    output = await metrics.run_chain(FakeChain(), "fake", "echo", text="hi")
+    self.assertEqual(output, "echo hi")
+    self.assertEqual(
+      metrics.llm_tokens.get(extractor="fake", call="echo", kind="prompt"), 12)
+    self.assertEqual(metrics.llm_latency.count(extractor="fake", call="echo"),
+                     1)
+
+  async def test_http_server(self):
+    server = await metrics.start_http_server(port=0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+    self.assertIn(b"# TYPE bot_handler_latency_seconds histogram", response)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from typing import (Awaitable, Callable, Dict, Generic, Hashable, List,
+                    Optional, TypeVar)
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# How long the first request of a batch waits for others. Longer windows
+# make fewer, larger calls at the cost of latency.
+BATCH_WINDOW_SECONDS = 0.05
+MAX_BATCH_SIZE = 8
+
+batch_sizes = registry.histogram("bot_micro_batch_size",
+                                 "Requests per micro-batch", ["batcher"],
+                                 buckets=(1, 2, 4, 8, 16, 32))
+
+
+class MicroBatcher(Generic[K, V]):
+  """Collects concurrent requests into batches.
+
+  The first request starts a `window` second timer. The batch is processed
+  when the timer fires or it reaches `max_batch_size` requests, whichever
+  comes first. `process` maps the batch's keys to their results, keys it
+  leaves out get `default`. Concurrent requests for the same key share one
+  slot.
+  """
+
+  def __init__(self,
+               name: str,
+               process: Callable[[List[K]], Awaitable[Dict[K, V]]],
+               window: float = BATCH_WINDOW_SECONDS,
+               max_batch_size: int = MAX_BATCH_SIZE,
+               default: Optional[V] = None):
+    self.name = name
+    self.process = process
+    self.window = window
+    self.max_batch_size = max_batch_size
+    self.default = default
+    self._pending: Dict[K, asyncio.Future] = {}
+    self._timer: Optional[asyncio.TimerHandle] = None
+    self._tasks = set()
+
+  async def submit(self, key: K) -> V:
+    future = self._pending.get(key)
+    if future is None:
+      future = asyncio.get_running_loop().create_future()
+      self._pending[key] = future
+      if len(self._pending) >= self.max_batch_size:
+        self._flush()
+      elif self._timer is None:
+        self._timer = asyncio.get_running_loop().call_later(
+          self.window, self._flush)
+    # Shielded, a cancelled caller must not fail the others waiting for it.
+    return await asyncio.shield(future)
+
+  def _flush(self):
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+    if not self._pending:
+      return
+    batch, self._pending = self._pending, {}
+    task = asyncio.create_task(self._run(batch))
+    # Keep a reference until done, the loop only keeps weak ones.
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def _run(self, batch: Dict[K, asyncio.Future]):
+    batch_sizes.observe(len(batch), batcher=self.name)
+    try:
+      results = await self.process(list(batch))
+    except Exception as e:
+      for future in batch.values():
+        future.set_exception(e)
+      return
+    for key, future in batch.items():
+      future.set_result(results.get(key, self.default))
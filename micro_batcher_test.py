@@ -0,0 +1,99 @@
+import asyncio
+import re
+import unittest
+
+from langchain.schema import Generation, LLMResult
+
+from definition_extractor import DefinitionExtractor
+from micro_batcher import MicroBatcher
+from model_router import ModelRouter, ModelTier
+
+
+class FakeDefinitionChain:
+
+  def __init__(self, echo="{}"):
+    self.prompts = []
+    # Formats the input field, models may echo the quotes of the prompt.
+    self.echo = echo
+
+  async def agenerate(self, inputs):
+    words = ([inputs[0]["word"]] if "word" in inputs[0] else
+             re.findall(r"`([^`]+)`", inputs[0]["words"]))
+    self.prompts.append(words)
+    text = "".join(f"input={self.echo.format(word)};root={word};pos=Verb;art=;"
+                   f"def=meaning of {word};ex=Ich {word}.\n" for word in words)
+    return LLMResult(generations=[[Generation(text=text)]])
+
+
+class TestMicroBatcher(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.batches = []
+
+    async def process(keys):
+      self.batches.append(keys)
+      await asyncio.sleep(0)
+      return {key: key.upper() for key in keys if key != "missing"}
+
+    self.batcher = MicroBatcher("test", process, window=0.01,
+                                max_batch_size=3, default="none")
+
+  async def test_collects_requests_within_window(self):
+    results = await asyncio.gather(self.batcher.submit("a"),
+                                   self.batcher.submit("b"),
+                                   self.batcher.submit("a"),
+                                   self.batcher.submit("missing"))
+    self.assertEqual(results, ["A", "B", "A", "none"])
+    self.assertEqual(self.batches, [["a", "b", "missing"]])
+
+  async def test_full_batch_is_sent_without_waiting(self):
+    self.batcher.window = 10
+    results = await asyncio.wait_for(
+      asyncio.gather(*[self.batcher.submit(key) for key in "abcd"[:3]]), 1)
+    self.assertEqual(results, ["A", "B", "C"])
+
+  async def test_errors_reach_all_callers(self):
+
+    async def fail(keys):
+      raise RuntimeError("LLM down")
+
+    batcher = MicroBatcher("test", fail, window=0.01)
+    results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"),
+                                   return_exceptions=True)
+    self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+
+class TestDefinitionBatching(unittest.IsolatedAsyncioTestCase):
+
+  async def test_concurrent_defines_share_a_call(self):
+    chain = FakeDefinitionChain()
+    router = ModelRouter([ModelTier("fake", "fake")],
+                         chain_factory=lambda prompt, tier: chain)
+    extractor = DefinitionExtractor(router=router, batch_window=0.01)
+    gehen, laufen, Laufen = await asyncio.gather(
+      extractor.extract_definitions("gehen"),
+      extractor.extract_definitions("laufen"),
+      extractor.extract_definitions("Laufen"))
+    self.assertEqual(chain.prompts, [["gehen", "laufen", "Laufen"]])
+    self.assertEqual([k.definition for k in gehen], ["meaning of gehen"])
+    self.assertEqual([k.word for k in laufen], ["laufen"])
+    self.assertEqual([k.word for k in Laufen], ["Laufen"])
+
+    # A single request uses the single word prompt.
+    await extractor.extract_definitions("sehen")
+    self.assertEqual(chain.prompts[-1], ["sehen"])
+
+  async def test_quoted_inputs_are_matched(self):
+    chain = FakeDefinitionChain(echo="`{}`")
+    router = ModelRouter([ModelTier("fake", "fake")],
+                         chain_factory=lambda prompt, tier: chain)
+    extractor = DefinitionExtractor(router=router, batch_window=0.01)
+    gehen, laufen = await asyncio.gather(
+      extractor.extract_definitions("gehen"),
+      extractor.extract_definitions("laufen"))
+    self.assertEqual([k.word for k in gehen], ["gehen"])
+    self.assertEqual([k.word for k in laufen], ["laufen"])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,149 @@
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from langchain import LLMChain, PromptTemplate
+from langchain.chat_models import ChatOpenAI
+
+from cpu_offload import offloader
+from metrics import registry, run_chain_with_usage
+from token_budget import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# A call escalates when it parses fewer records than this share of the
+# expected ones.
+MIN_RECORD_RATIO = 0.5
+
+
+@dataclass(frozen=True)
+class ModelTier:
+  name: str
+  model_name: str
+  temperature: float = 0.7
+  # USD per 1K tokens.
+  prompt_cost: float = 0.0
+  completion_cost: float = 0.0
+  # Larger prompts start on the next tier, None for no limit.
+  max_input_tokens: Optional[int] = None
+
+
+DEFAULT_TIERS = [
+  ModelTier("fast", "gpt-3.5-turbo", prompt_cost=0.0015,
+            completion_cost=0.002, max_input_tokens=2500),
+  ModelTier("strong", "gpt-4", prompt_cost=0.03, completion_cost=0.06),
+]
+
+tier_calls = registry.counter(
+  "bot_llm_tier_calls_total",
+  "LLM calls per model tier, by outcome: ok, escalated to the next tier, "
+  "or failed on the last tier", ["extractor", "call", "tier", "result"])
+tier_latency = registry.histogram("bot_llm_tier_latency_seconds",
+                                  "LLM round-trip time per model tier",
+                                  ["tier"])
+tier_cost = registry.counter("bot_llm_cost_usd_total",
+                             "Estimated LLM cost per model tier", ["tier"])
+
+
+def _parse_none(output: str) -> list:
+  return []
+
+
+class ModelRouter:
+  """Sends each extractor call to the cheapest suitable model tier.
+
+  A call starts on the tier its route names ("extractor.call" -> tier name,
+  the first tier by default), moved up while the prompt exceeds the tier's
+  `max_input_tokens`. If the parser returns too few records, the call is
+  repeated on the next tier, up to the last one.
+  """
+
+  def __init__(self,
+               tiers: Sequence[ModelTier] = tuple(DEFAULT_TIERS),
+               routes: Optional[Dict[str, str]] = None,
+               chain_factory: Optional[Callable[[PromptTemplate, ModelTier],
+                                                Any]] = None,
+               clock: Callable[[], float] = time.perf_counter):
+    self.tiers = list(tiers)
+    self.routes = routes or {}
+    unknown = set(self.routes.values()) - {tier.name for tier in self.tiers}
+    if unknown:
+      raise ValueError(f"Routes to unknown tiers: {sorted(unknown)}")
+    self.chain_factory = chain_factory or self._make_chain
+    self.clock = clock
+    self._models: Dict[str, ChatOpenAI] = {}
+    self._chains: Dict[Tuple[int, str], Any] = {}
+
+  @classmethod
+  def single(cls, model_name: str, temperature: float) -> "ModelRouter":
+    """A router with a single tier, i.e. without routing."""
+    return cls([ModelTier("default", model_name, temperature)])
+
+  def _make_chain(self, prompt: PromptTemplate, tier: ModelTier) -> LLMChain:
+    # One client per tier, shared by the chains of all prompts.
+    if tier.name not in self._models:
+      self._models[tier.name] = ChatOpenAI(model_name=tier.model_name,
+                                           temperature=tier.temperature)
+    return LLMChain(prompt=prompt, llm=self._models[tier.name])
+
+  def _chain(self, prompt: PromptTemplate, tier: ModelTier):
+    key = (id(prompt), tier.name)
+    if key not in self._chains:
+      self._chains[key] = self.chain_factory(prompt, tier)
+    return self._chains[key]
+
+  def start_tier(self, extractor: str, call: str, prompt: PromptTemplate,
+                 inputs: Dict[str, Any]) -> int:
+    route = self.routes.get(f"{extractor}.{call}")
+    index = next((i for i, tier in enumerate(self.tiers)
+                  if tier.name == route), 0)
+    if any(tier.max_input_tokens for tier in self.tiers[index:-1]):
+      input_tokens = count_tokens(prompt.format(**inputs))
+      while (index < len(self.tiers) - 1 and
+             self.tiers[index].max_input_tokens is not None and
+             input_tokens > self.tiers[index].max_input_tokens):
+        index += 1
+    return index
+
+  def _record(self, tier: ModelTier, elapsed: float, usage: Dict[str, int]):
+    tier_latency.observe(elapsed, tier=tier.name)
+    cost = (usage.get("prompt_tokens", 0) * tier.prompt_cost +
+            usage.get("completion_tokens", 0) * tier.completion_cost) / 1000
+    if cost:
+      tier_cost.inc(cost, tier=tier.name)
+
+  async def run(self,
+                prompt: PromptTemplate,
+                extractor: str,
+                call: str,
+                parse: Callable[..., list] = _parse_none,
+                parse_args: Sequence[Any] = (),
+                expected_records: int = 0,
+                **inputs: Any) -> Tuple[str, list]:
+    """Runs `prompt` and parses the output with `parse(output,
+    *parse_args)` in the CpuOffloader. Returns the output and the records of
+    the last tier tried. `expected_records` of 0 never escalates."""
+    min_records = math.ceil(expected_records * MIN_RECORD_RATIO)
+    index = self.start_tier(extractor, call, prompt, inputs)
+    while True:
+      tier = self.tiers[index]
+      start = self.clock()
+      output, usage = await run_chain_with_usage(self._chain(prompt, tier),
+                                                 extractor, call, **inputs)
+      self._record(tier, self.clock() - start, usage)
+      records = await offloader.run(len(output), parse, output, *parse_args)
+      if len(records) >= min_records:
+        tier_calls.inc(extractor=extractor, call=call, tier=tier.name,
+                       result="ok")
+        return output, records
+      if index == len(self.tiers) - 1:
+        tier_calls.inc(extractor=extractor, call=call, tier=tier.name,
+                       result="failed")
+        return output, records
+      tier_calls.inc(extractor=extractor, call=call, tier=tier.name,
+                     result="escalated")
+      logger.info(f"{extractor}.{call}: {len(records)} of {expected_records} "
+                  f"records from {tier.name}, escalating")
+      index += 1
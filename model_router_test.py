@@ -0,0 +1,81 @@
+import unittest
+
+from langchain import PromptTemplate
+from langchain.schema import Generation, LLMResult
+
+from model_router import ModelRouter, ModelTier, tier_calls, tier_cost
+
+
+def parse_lines(output: str) -> list:
+  return [line for line in output.splitlines() if line.startswith("ok")]
+
+
+class FakeChain:
+
+  def __init__(self, tier: ModelTier, outputs: dict, calls: list):
+    self.tier = tier
+    self.outputs = outputs
+    self.calls = calls
+
+  async def agenerate(self, inputs):
+    self.calls.append(self.tier.name)
+    return LLMResult(
+      generations=[[Generation(text=self.outputs[self.tier.name])]],
+      llm_output={"token_usage": {"prompt_tokens": 1000,
+                                  "completion_tokens": 500}})
+
+
+class TestModelRouter(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.tiers = [
+      ModelTier("fast", "small", prompt_cost=0.001, completion_cost=0.002,
+                max_input_tokens=50),
+      ModelTier("strong", "large", prompt_cost=0.01, completion_cost=0.02),
+    ]
+    self.outputs = {"fast": "ok 1\nbad\nbad", "strong": "ok 1\nok 2\nok 3"}
+    self.calls = []
+    self.prompt = PromptTemplate(template="Define {word}",
+                                 input_variables=["word"])
+
+  def router(self, routes=None) -> ModelRouter:
+    return ModelRouter(
+      self.tiers, routes,
+      chain_factory=lambda prompt, tier: FakeChain(tier, self.outputs,
+                                                   self.calls))
+
+  async def test_stays_on_cheap_tier_when_output_parses(self):
+    output, records = await self.router().run(self.prompt, "test", "ok",
+                                              parse=parse_lines,
+                                              expected_records=2, word="x")
+    self.assertEqual(self.calls, ["fast"])
+    self.assertEqual((output, records), ("ok 1\nbad\nbad", ["ok 1"]))
+    self.assertEqual(
+      tier_calls.get(extractor="test", call="ok", tier="fast", result="ok"),
+      1)
+
+  async def test_escalates_when_too_few_records(self):
+    cost = tier_cost.get(tier="strong")
+    _, records = await self.router().run(self.prompt, "test", "escalate",
+                                         parse=parse_lines,
+                                         expected_records=3, word="x")
+    self.assertEqual(self.calls, ["fast", "strong"])
+    self.assertEqual(len(records), 3)
+    self.assertAlmostEqual(tier_cost.get(tier="strong") - cost, 0.02)
+    self.assertEqual(
+      tier_calls.get(extractor="test", call="escalate", tier="fast",
+                     result="escalated"), 1)
+
+  async def test_large_inputs_and_routes_start_higher(self):
+    router = self.router({"test.routed": "strong"})
+    await router.run(self.prompt, "test", "large", word="x " * 200)
+    await router.run(self.prompt, "test", "routed", word="x")
+    self.assertEqual(self.calls, ["strong", "strong"])
+
+  def test_unknown_route(self):
+    with self.assertRaises(ValueError):
+      ModelRouter(self.tiers, {"test.call": "medium"})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+from metrics import db_bytes, registry
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".journal"
+HISTORY_SUFFIX = ".history"
+# Appends arriving within this window share one fsync.
+FSYNC_WINDOW_SECONDS = 0.005
+# A profile is snapshotted once this many events follow its snapshot.
+SNAPSHOT_EVERY = 64
+
+fsync_batch_size = registry.histogram("bot_journal_fsync_batch_size",
+                                      "Journal records written per fsync",
+                                      buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+@dataclass(frozen=True)
+class ProfileEvent:
+  """A small mutation of a user profile, see `UserProfile.apply`."""
+  seq: int
+  time: datetime
+  kind: str
+  args: Tuple[Any, ...]
+
+
+def encode(event: ProfileEvent) -> bytes:
+  # A plain tuple with a timestamp pickles to a few dozen bytes.
+  return pickle.dumps(
+    (event.seq, event.time.timestamp(), event.kind, event.args),
+    protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_events(path: str) -> Iterator[ProfileEvent]:
+  if not os.path.exists(path):
+    return
+  with open(path, 'rb') as f:
+    while True:
+      try:
+        seq, timestamp, kind, args = pickle.load(f)
+      except (EOFError, pickle.UnpicklingError):
+        # A crash may leave a truncated record at the end.
+        break
+      yield ProfileEvent(seq, datetime.fromtimestamp(timestamp), kind, args)
+
+
+def _append_files(pending: Dict[str, List[bytes]]) -> None:
+  for path, records in pending.items():
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'ab') as f:
+      f.write(b"".join(records))
+      f.flush()
+      os.fsync(f.fileno())
+
+
+def _compact_files(journal_path: str, history_path: str, seq: int) -> int:
+  events = list(read_events(journal_path))
+  done = [event for event in events if event.seq <= seq]
+  if not done:
+    return 0
+  # Appended first, a crash in between repeats events in the history.
+  _append_files({history_path: [encode(event) for event in done]})
+  tail = [encode(event) for event in events if event.seq > seq]
+  if not tail:
+    os.remove(journal_path)
+    return len(done)
+  tmp_path = f"{journal_path}.tmp"
+  with open(tmp_path, 'wb') as f:
+    f.write(b"".join(tail))
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp_path, journal_path)
+  return len(done)
+
+
+class EventJournal:
+  """Append-only event files, one per user next to the profile snapshot.
+
+  `append` returns once the event is on disk. Events appended within
+  `window` seconds are written together, with one fsync per file. After a
+  snapshot, `compact` moves the events it includes to the user's history
+  file, which keeps every event for analytics replay.
+  """
+
+  def __init__(self, window: float = FSYNC_WINDOW_SECONDS):
+    self.window = window
+    self._pending: Dict[str, List[bytes]] = {}
+    self._waiters: List[asyncio.Future] = []
+    self._flush_task = None
+    # Keeps compaction from replacing a file while records are appended.
+    self._io_lock = asyncio.Lock()
+
+  async def append(self, path: str, event: ProfileEvent) -> None:
+    self._pending.setdefault(path, []).append(encode(event))
+    future = asyncio.get_running_loop().create_future()
+    self._waiters.append(future)
+    if self._flush_task is None:
+      self._flush_task = asyncio.create_task(self._flush_later())
+    await asyncio.shield(future)
+
+  async def _flush_later(self):
+    await asyncio.sleep(self.window)
+    self._flush_task = None
+    await self.flush()
+
+  async def flush(self) -> None:
+    async with self._io_lock:
+      pending, self._pending = self._pending, {}
+      waiters, self._waiters = self._waiters, []
+      if not pending:
+        return
+      try:
+        await asyncio.to_thread(_append_files, pending)
+      except Exception as e:
+        logger.exception("Writing the event journal failed")
+        for future in waiters:
+          future.set_exception(e)
+        return
+      db_bytes.inc(sum(len(record) for records in pending.values()
+                       for record in records), op="journal")
+      fsync_batch_size.observe(len(waiters))
+      for future in waiters:
+        future.set_result(None)
+
+  async def read(self, path: str) -> List[ProfileEvent]:
+    return await asyncio.to_thread(lambda: list(read_events(path)))
+
+  async def compact(self, journal_path: str, history_path: str,
+                    seq: int) -> int:
+    """Moves the events up to `seq` to the history. Returns their number."""
+    await self.flush()
+    async with self._io_lock:
+      return await asyncio.to_thread(_compact_files, journal_path,
+                                     history_path, seq)
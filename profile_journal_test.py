@@ -0,0 +1,148 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import profile_journal
+from data_models import Keyword, LearningSession, Question, UserProfileDB
+from profile_journal import EventJournal, ProfileEvent, read_events
+
+
+def keyword(root):
+  return Keyword(root=root, word=root, pos="Noun", snippet="",
+                 definition=root)
+
+
+class TestEventJournal(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp_dir.name, "1.journal")
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  async def test_concurrent_appends_share_a_flush(self):
+    journal = EventJournal(window=0.01)
+    events = [ProfileEvent(i, datetime(2023, 5, 1), "page", (0, i))
+              for i in range(1, 6)]
+    await asyncio.gather(*(journal.append(self.path, e) for e in events))
+    self.assertEqual(list(read_events(self.path)), events)
+
+  async def test_compact_moves_events_to_history(self):
+    journal = EventJournal(window=0)
+    for i in range(1, 5):
+      await journal.append(self.path,
+                           ProfileEvent(i, datetime.now(), "page", (0, i)))
+    history_path = os.path.join(self.tmp_dir.name, "1.history")
+    self.assertEqual(await journal.compact(self.path, history_path, 3), 3)
+    self.assertEqual([e.seq for e in read_events(self.path)], [4])
+    self.assertEqual([e.seq for e in read_events(history_path)], [1, 2, 3])
+
+  async def test_truncated_record_is_ignored(self):
+    journal = EventJournal(window=0)
+    await journal.append(self.path,
+                         ProfileEvent(1, datetime.now(), "page", (0, 1)))
+    with open(self.path, "ab") as f:
+      f.write(profile_journal.encode(
+        ProfileEvent(2, datetime.now(), "page", (0, 2)))[:-3])
+    self.assertEqual([e.seq for e in read_events(self.path)], [1])
+
+
+class TestJournaledProfiles(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.db = UserProfileDB(self.tmp_dir.name)
+    self.db.journal.window = 0
+    user_profile = await self.db.get_user_profile(1)
+    user_profile.start_session(
+      LearningSession(session_id=0, chat_id="1", text="text",
+                      start_time=datetime.now(),
+                      keywords=[keyword("der Apfel"), keyword("die Birne")],
+                      quiz=[
+                        Question(question=f"q{i}", options=["a", "b"],
+                                 correct_idx=0, explanation="")
+                        for i in range(2)
+                      ]))
+    await self.db.set_user_profile(user_profile)
+
+  async def asyncTearDown(self):
+    self.db.manifest.close()
+    self.tmp_dir.cleanup()
+
+  async def test_profile_is_rebuilt_from_snapshot_and_journal(self):
+    profile_path = self.db.get_user_profile_file_path("1")
+    snapshot_size = os.path.getsize(profile_path)
+    await self.db.record(1, "click", 0, 1)
+    await self.db.record(1, "poll", 0, 0, "poll0")
+    session = await self.db.record(1, "answer", "poll0", 0)
+    self.assertTrue(session.quiz[0].is_correct())
+    # The snapshot is not rewritten.
+    self.assertEqual(os.path.getsize(profile_path), snapshot_size)
+
+    user_profile = await self.db.get_user_profile(1)
+    self.assertEqual(user_profile.journal_seq, 3)
+    self.assertEqual(list(user_profile.vocabs.dictionary), ["birne"])
+    session = user_profile.sessions[-1]
+    self.assertEqual((session.next_question_idx, session.quiz[0].answer_idx),
+                     (1, 0))
+    self.assertEqual(user_profile.polls, {})
+    self.assertEqual([e.kind for e in self.db.events(1)],
+                     ["click", "poll", "answer"])
+
+  async def test_snapshot_compacts_the_journal(self):
+    await self.db.record(1, "click", 0, 0)
+    user_profile = await self.db.get_user_profile(1)
+    await self.db.set_user_profile(user_profile)
+    journal_path, history_path = self.db._journal_paths(1)
+    self.assertFalse(os.path.exists(journal_path))
+    self.assertEqual([e.seq for e in read_events(history_path)], [1])
+    await self.db.record(1, "page", 0, 1)
+    user_profile = await self.db.get_user_profile(1)
+    self.assertEqual(user_profile.sessions[-1].current_keyword_page, 1)
+    self.assertEqual(len(user_profile.vocabs.get("apfel").encounters), 1)
+    self.assertEqual([e.kind for e in self.db.events(1)], ["click", "page"])
+
+  async def test_background_snapshot(self):
+    for page in range(profile_journal.SNAPSHOT_EVERY):
+      await self.db.record(1, "page", 0, page % 2)
+    await asyncio.gather(*self.db._snapshot_tasks.values())
+    journal_path, _ = self.db._journal_paths(1)
+    self.assertFalse(os.path.exists(journal_path))
+    user_profile = await self.db.get_user_profile(1)
+    self.assertEqual(user_profile.snapshot_seq,
+                     profile_journal.SNAPSHOT_EVERY)
+
+  async def test_stale_copy_keeps_newer_events(self):
+    stale = await self.db.get_user_profile(1)
+    await self.db.record(1, "click", 0, 0)
+    stale.reminder_time = None
+    await self.db.set_user_profile(stale)
+    await self.db.record(1, "page", 0, 1)
+    self.assertEqual([(e.seq, e.kind) for e in self.db.events(1)],
+                     [(1, "click"), (2, "page")])
+    user_profile = await self.db.get_user_profile(1)
+    self.assertEqual(list(user_profile.vocabs.dictionary), ["apfel"])
+
+    # Also when a snapshot moved the newer events to the history.
+    stale = await self.db.get_user_profile(1)
+    await self.db.record(1, "click", 0, 1)
+    await self.db.set_user_profile(await self.db.get_user_profile(1))
+    await self.db.set_user_profile(stale)
+    user_profile = await self.db.get_user_profile(1)
+    self.assertEqual(user_profile.journal_seq, 3)
+    self.assertEqual(sorted(user_profile.vocabs.dictionary),
+                     ["apfel", "birne"])
+
+  async def test_define_replays_with_the_event_time(self):
+    await self.db.record(1, "define", [keyword("der Apfel").dict()])
+    event, = self.db.events(1)
+    vocab = (await self.db.get_user_profile(1)).vocabs.get("apfel")
+    self.assertEqual(vocab.encounters[0].time, event.time)
+    self.assertEqual(vocab.last_review, event.time.date())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,132 @@
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".manifest"
+# The journal is rewritten once it holds this many records per entry.
+COMPACT_RATIO = 4
+COMPACT_MIN_RECORDS = 1000
+# Key of the records holding the last processed reminder minute of the
+# process, instead of a user id.
+REMINDER_KEY = "reminders"
+
+
+@dataclass
+class ManifestEntry:
+  """What the reminder job needs to know about a user, without loading the
+  profile."""
+  next_review: Optional[date]
+  # Vocabs due on the day of `updated`.
+  due_count: int
+  chat_id: Optional[str]
+  last_activity: Optional[datetime]
+  reminder_time: Optional[time]
+  timezone: str
+  updated: datetime
+  # A /learn session waits for its keywords or questions.
+  extracting: bool = False
+
+  def has_due(self, today: date) -> bool:
+    return self.next_review is not None and self.next_review <= today
+
+
+class Manifest:
+  """Entries of all users, kept in memory and journaled to
+  `<directory>/<name>.manifest`.
+
+  Every process writing profiles (e.g. each sharded worker) uses its own
+  name. Loading reads the journals of all names and keeps the newest entry
+  of each user, so users moved between shards are not lost.
+  """
+
+  def __init__(self, directory: str, name: str = "manifest"):
+    self.directory = directory
+    self.path = os.path.join(directory, name + SUFFIX)
+    self.entries: Dict[int, ManifestEntry] = {}
+    self._own_ids: Set[int] = set()
+    self.reminder_minute: Optional[int] = None
+    self._records = 0
+    self._journal = None
+    self.exists = any(
+      file_name.endswith(SUFFIX) for file_name in os.listdir(directory))
+    self._load()
+
+  @staticmethod
+  def _read_journal(path: str) -> Iterator[Tuple[int, ManifestEntry]]:
+    with open(path, 'rb') as f:
+      while True:
+        try:
+          yield pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+          # A crash may leave a truncated record at the end.
+          break
+
+  def _load(self):
+    for file_name in sorted(os.listdir(self.directory)):
+      if not file_name.endswith(SUFFIX):
+        continue
+      path = os.path.join(self.directory, file_name)
+      for user_id, entry in self._read_journal(path):
+        if user_id == REMINDER_KEY:
+          if path == self.path:
+            self.reminder_minute = entry
+          continue
+        if entry is None:
+          # Removed user.
+          self.entries.pop(user_id, None)
+          self._own_ids.discard(user_id)
+          continue
+        current = self.entries.get(user_id)
+        if current is None or entry.updated >= current.updated:
+          self.entries[user_id] = entry
+          if path == self.path:
+            self._own_ids.add(user_id)
+          else:
+            self._own_ids.discard(user_id)
+    self._compact()
+
+  def _compact(self):
+    if self._journal is not None:
+      self._journal.close()
+    tmp_path = f"{self.path}.tmp"
+    with open(tmp_path, 'wb') as f:
+      for user_id in sorted(self._own_ids):
+        pickle.dump((user_id, self.entries[user_id]), f)
+      if self.reminder_minute is not None:
+        pickle.dump((REMINDER_KEY, self.reminder_minute), f)
+    os.replace(tmp_path, self.path)
+    self._records = len(self._own_ids) + (self.reminder_minute is not None)
+    self._journal = open(self.path, 'ab')
+
+  def _append(self, user_id: int, entry: Optional[ManifestEntry]):
+    # One small append, cheaper than handing it to a thread.
+    pickle.dump((user_id, entry), self._journal)
+    self._journal.flush()
+    self._records += 1
+    if self._records > max(COMPACT_MIN_RECORDS,
+                           COMPACT_RATIO * len(self._own_ids)):
+      self._compact()
+
+  def update(self, user_id: int, entry: ManifestEntry):
+    self.entries[user_id] = entry
+    self._own_ids.add(user_id)
+    self._append(user_id, entry)
+
+  def remove(self, user_id: int):
+    self.entries.pop(user_id, None)
+    self._own_ids.discard(user_id)
+    self._append(user_id, None)
+
+  def save_reminder_minute(self, minute: int):
+    self.reminder_minute = minute
+    self._append(REMINDER_KEY, minute)
+
+  def close(self):
+    if self._journal is not None:
+      self._journal.close()
+      self._journal = None
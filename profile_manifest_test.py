@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+from datetime import date, datetime, time
+
+import profile_manifest
+from profile_manifest import Manifest, ManifestEntry
+
+
+def entry(chat_id, updated):
+  return ManifestEntry(next_review=date(2023, 5, 1), due_count=1,
+                       chat_id=chat_id, last_activity=None,
+                       reminder_time=time(10), timezone="Europe/Berlin",
+                       updated=updated)
+
+
+class TestManifest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.directory = self.tmp_dir.name
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_reload_and_remove(self):
+    manifest = Manifest(self.directory)
+    self.assertFalse(manifest.exists)
+    manifest.update(1, entry("a", datetime(2023, 5, 1)))
+    manifest.update(2, entry("b", datetime(2023, 5, 1)))
+    manifest.update(1, entry("c", datetime(2023, 5, 2)))
+    manifest.remove(2)
+    manifest.close()
+
+    reloaded = Manifest(self.directory)
+    self.assertTrue(reloaded.exists)
+    self.assertEqual(list(reloaded.entries), [1])
+    self.assertEqual(reloaded.entries[1].chat_id, "c")
+
+  def test_newest_entry_wins_across_processes(self):
+    first = Manifest(self.directory, "manifest-0")
+    second = Manifest(self.directory, "manifest-1")
+    first.update(1, entry("old", datetime(2023, 5, 1)))
+    second.update(1, entry("new", datetime(2023, 5, 2)))
+    first.close()
+    second.close()
+    self.assertEqual(Manifest(self.directory, "manifest-0").entries[1].chat_id,
+                     "new")
+
+  def test_reminder_minute_survives_restart(self):
+    manifest = Manifest(self.directory, "manifest-0")
+    manifest.save_reminder_minute(100)
+    manifest.save_reminder_minute(101)
+    manifest.close()
+    self.assertIsNone(Manifest(self.directory, "manifest-1").reminder_minute)
+    reloaded = Manifest(self.directory, "manifest-0")
+    self.assertEqual(reloaded.reminder_minute, 101)
+    self.assertEqual(reloaded.entries, {})
+    reloaded.close()
+
+  def test_compacts_journal(self):
+    manifest = Manifest(self.directory)
+    original_min = profile_manifest.COMPACT_MIN_RECORDS
+    profile_manifest.COMPACT_MIN_RECORDS = 10
+    try:
+      for i in range(100):
+        manifest.update(1, entry(str(i), datetime(2023, 5, 1)))
+    finally:
+      profile_manifest.COMPACT_MIN_RECORDS = original_min
+    self.assertLessEqual(manifest._records, 10)
+    manifest.close()
+    self.assertEqual(Manifest(self.directory).entries[1].chat_id, "99")
+
+
+if __name__ == '__main__':
+  unittest.main()
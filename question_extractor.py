@@ -1,16 +1,38 @@
 import re
 from typing import List
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import PromptTemplate
 from data_models import Question
+from metrics import record_parse
+from model_router import ModelRouter
+
+# Questions asked for per text, unless the caller asks for fewer.
+NUM_QUESTIONS = 10
+
+
+def parse_questions(output: str) -> List[Question]:
+  question_re = re.compile(
+    r"text=(.+);a=(.+);b=(.+);c=(.+);d=(.+);ans=(.+);expl=(.+)")
+  questions = []
+  for match in question_re.finditer(output):
+    question_text, a, b, c, d, answer, explanation = match.groups()
+    question = Question(question=question_text,
+                        options=[a, b, c, d],
+                        correct_idx="abcd".index(answer),
+                        explanation=explanation.strip())
+    if not question.validate_telegram_poll():
+      continue
+    questions.append(question)
+  return questions
 
 
 class QuestionExtractor:
 
-  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7):
-    self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
+  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7,
+               router=None):
+    self.router = router or ModelRouter.single(model_name, temperature)
     self.prompt_template = PromptTemplate(
-      template=("Carefully generate 10 muti-choice German questions to test "
+      template=("Carefully generate {num_questions} muti-choice German "
+                "questions to test "
                 "my understanding of a German text from top to bottom. "
                 "Use only information in the text to generate question. "
                 "One question has a single correct answer. "
@@ -20,7 +42,7 @@ class QuestionExtractor:
                 "ans=correct answer, either a, b, c, or d;"
                 "expl=explains why ans is correct.\n\n"
                 "{text}\n\n{format_instructions}"),
-      input_variables=["text"],
+      input_variables=["text", "num_questions"],
       partial_variables={
         "format_instructions":
         ("The output contains one question per line. Example:\n"
@@ -30,24 +52,14 @@ class QuestionExtractor:
          "ans=b;expl=The text says \"Also kaufe ich mir ein Getränk und Chips\" "
          "which means \"So I buy a drink and chips\".")
       })
-    self.llm_chain = LLMChain(prompt=self.prompt_template,
-                              llm=self.model,
-                              verbose=True)
 
-  async def extract_questions(self, text: str) -> List[Question]:
-    output = await self.llm_chain.apredict(text=text)
-    print(output)
-    question_re = re.compile(
-      r"text=(.+);a=(.+);b=(.+);c=(.+);d=(.+);ans=(.+);expl=(.+)")
-    questions = []
-    for match in question_re.finditer(output):
-      question_text, a, b, c, d, answer, explanation = match.groups()
-      question = Question(question=question_text,
-                          options=[a, b, c, d],
-                          correct_idx="abcd".index(answer),
-                          explanation=explanation.strip())
-      if not question.validate_telegram_poll():
-        continue
-      questions.append(question)
-    print(questions)
+  async def extract_questions(self, text: str,
+                              num_questions: int = NUM_QUESTIONS
+                              ) -> List[Question]:
+    _, questions = await self.router.run(self.prompt_template, "question",
+                                         "quiz", parse=parse_questions,
+                                         expected_records=num_questions,
+                                         text=text,
+                                         num_questions=num_questions)
+    record_parse("question", "quiz", len(questions))
     return questions
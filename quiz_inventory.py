@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import Dict, List
+
+from data_models import UserProfileDB, Vocab, Vocabs
+
+logger = logging.getLogger(__name__)
+
+TARGET_QUESTIONS_PER_VOCAB = 3
+# Vocab changes of a user within this window trigger a single top-up.
+COALESCE_WINDOW_SECONDS = 5.0
+# Vocabs due within this many days get questions, so vocabs added today are
+# ready when they become due tomorrow.
+HORIZON_DAYS = 1
+BATCH_SIZE = 10
+# Questions per vocab from the LocalQuestionGenerator, the rest of the
+# target comes from the LLM.
+LOCAL_QUESTIONS_PER_VOCAB = 2
+
+
+class QuizInventory:
+  """Keeps enough pre-generated questions for each due vocab, so /vocabquiz
+  never waits for the LLM. Meaning questions are built locally when a
+  `local_generator` is given, and the LLM only fills the remaining slots."""
+
+  def __init__(self,
+               db: UserProfileDB,
+               question_extractor,
+               target_per_vocab: int = TARGET_QUESTIONS_PER_VOCAB,
+               window: float = COALESCE_WINDOW_SECONDS,
+               horizon_days: int = HORIZON_DAYS,
+               batch_size: int = BATCH_SIZE,
+               local_generator=None,
+               local_per_vocab: int = LOCAL_QUESTIONS_PER_VOCAB):
+    self.db = db
+    self.question_extractor = question_extractor
+    self.target_per_vocab = target_per_vocab
+    self.window = window
+    self.horizon_days = horizon_days
+    self.batch_size = batch_size
+    self.local_generator = local_generator
+    self.local_per_vocab = min(local_per_vocab, target_per_vocab)
+    self._pending: Dict[int, asyncio.Task] = {}
+
+  def notify(self, user_id: int):
+    if user_id in self._pending:
+      return
+    self._pending[user_id] = asyncio.create_task(self._top_up_later(user_id))
+
+  async def _top_up_later(self, user_id: int):
+    await asyncio.sleep(self.window)
+    del self._pending[user_id]
+    try:
+      await self.top_up(user_id)
+    except Exception:
+      logger.exception(f"Failed to top up vocab quiz of user {user_id}")
+
+  def vocabs_to_top_up(self, vocabs: Vocabs) -> List[Vocab]:
+    horizon = date.today() + timedelta(days=self.horizon_days)
+    missing = [
+      vocab for vocab in vocabs.dictionary.values()
+      if vocab.next_review is not None and vocab.next_review <= horizon and
+      len(vocab.quiz) < self.target_per_vocab
+    ]
+    missing.sort(key=lambda vocab: (len(vocab.quiz), vocab.next_review))
+    return missing
+
+  def _add_questions(self, user_profile, new_questions, limit: int):
+    for root, question in new_questions:
+      vocab = user_profile.vocabs.get(root)
+      if vocab and len(vocab.quiz) < limit:
+        vocab.quiz.append(question)
+
+  async def top_up(self, user_id: int):
+    if self.local_generator is not None:
+      async with self.db.lock(user_id):
+        user_profile = await self.db.get_user_profile(user_id)
+        vocabs = [
+          vocab for vocab in self.vocabs_to_top_up(user_profile.vocabs)
+          if len(vocab.quiz) < self.local_per_vocab
+        ]
+        new_questions = self.local_generator.generate(user_profile.vocabs,
+                                                      vocabs)
+        if new_questions:
+          # Leave room for the richer LLM questions.
+          self._add_questions(user_profile, new_questions,
+                              self.local_per_vocab)
+          await self.db.set_user_profile(user_profile)
+    # One question per vocab per LLM call, so up to target rounds. The lock
+    # is not held while the LLM runs, so the user's updates are not blocked.
+    for _ in range(self.target_per_vocab):
+      user_profile = await self.db.get_user_profile(user_id)
+      vocabs = self.vocabs_to_top_up(user_profile.vocabs)[:self.batch_size]
+      if not vocabs:
+        return
+      new_questions = await self.question_extractor.extract_questions(
+        vocabs=vocabs)
+      if not new_questions:
+        return
+      async with self.db.lock(user_id):
+        # Reload, the user may have changed the profile while we waited.
+        user_profile = await self.db.get_user_profile(user_id)
+        self._add_questions(user_profile, new_questions,
+                            self.target_per_vocab)
+        await self.db.set_user_profile(user_profile)
@@ -0,0 +1,103 @@
+import asyncio
+import tempfile
+import unittest
+from typing import List
+
+from data_models import Keyword, Question, UserProfileDB, Vocab
+from local_questions import LocalQuestionGenerator
+from quiz_inventory import QuizInventory
+
+
+class FakeVocabQuestionExtractor:
+
+  def __init__(self):
+    self.calls = 0
+
+  async def extract_questions(self, vocabs: List[Vocab]):
+    self.calls += 1
+    return [(vocab.root,
+             Question(question=f"What is {vocab.root}?",
+                      options=["a", "b", "c", "d"],
+                      correct_idx=0,
+                      explanation="")) for vocab in vocabs]
+
+
+def make_keyword(root: str, definition: str = "") -> Keyword:
+  return Keyword(root=root, word=root, pos="Noun", snippet="",
+                 definition=definition or f"meaning of {root}")
+
+
+class TestQuizInventory(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.db = UserProfileDB(self.tmp_dir.name)
+    self.extractor = FakeVocabQuestionExtractor()
+    self.inventory = QuizInventory(self.db, self.extractor,
+                                   target_per_vocab=2, window=0.01)
+    self.user_id = 1
+    user_profile = await self.db.get_user_profile(self.user_id)
+    user_profile.vocabs.click_keyword(make_keyword("der Apfel"), 0)
+    user_profile.vocabs.define_vocab(make_keyword("die Birne"), -1)
+    await self.db.set_user_profile(user_profile)
+
+  async def asyncTearDown(self):
+    self.tmp_dir.cleanup()
+
+  async def test_top_up_reaches_target(self):
+    await self.inventory.top_up(self.user_id)
+    user_profile = await self.db.get_user_profile(self.user_id)
+    for vocab in user_profile.vocabs.dictionary.values():
+      self.assertEqual(len(vocab.quiz), 2)
+    self.assertEqual(self.extractor.calls, 2)
+
+    # Already full, no LLM call.
+    await self.inventory.top_up(self.user_id)
+    self.assertEqual(self.extractor.calls, 2)
+
+  async def test_notify_is_coalesced(self):
+    for _ in range(5):
+      self.inventory.notify(self.user_id)
+    await asyncio.sleep(0.1)
+    self.assertEqual(self.extractor.calls, 2)
+
+  async def test_local_questions_leave_room_for_llm(self):
+    inventory = QuizInventory(self.db, self.extractor, target_per_vocab=3,
+                              local_generator=LocalQuestionGenerator(),
+                              local_per_vocab=2)
+    user_id = 2
+    user_profile = await self.db.get_user_profile(user_id)
+    fruits = {"die Kirsche": "cherry", "die Pflaume": "plum",
+              "die Traube": "grape", "die Zitrone": "lemon"}
+    for root, definition in fruits.items():
+      user_profile.vocabs.click_keyword(make_keyword(root, definition), 0)
+    await self.db.set_user_profile(user_profile)
+
+    await inventory.top_up(user_id)
+    user_profile = await self.db.get_user_profile(user_id)
+    for vocab in user_profile.vocabs.dictionary.values():
+      self.assertEqual(
+        [question.question for question in vocab.quiz], [
+          f"What does \"{vocab.root}\" mean?",
+          f"Which word means \"{fruits[vocab.root]}\"?",
+          f"What is {vocab.root}?"
+        ])
+    # A single LLM round for the last slot.
+    self.assertEqual(self.extractor.calls, 1)
+
+
+  async def test_lock_is_free_while_the_llm_runs(self):
+    locked = []
+    extract_questions = self.extractor.extract_questions
+
+    async def check_lock(vocabs):
+      locked.append(self.db.lock(self.user_id).locked())
+      return await extract_questions(vocabs)
+
+    self.extractor.extract_questions = check_lock
+    await self.inventory.top_up(self.user_id)
+    self.assertEqual(locked, [False, False])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+# Max users reminded in the same minute, extra users spill to later minutes.
+SLOT_CAPACITY = 50
+# Slots missed while the bot was down are caught up for at most this long.
+MAX_CATCH_UP_MINUTES = 6 * 60
+
+
+def utc_minute_of_day(reminder_time: time, tz_name: str, day: date) -> int:
+  local_dt = datetime.combine(day, reminder_time, tzinfo=ZoneInfo(tz_name))
+  utc_dt = local_dt.astimezone(timezone.utc)
+  return utc_dt.hour * 60 + utc_dt.minute
+
+
+class ReminderScheduler:
+  """Buckets users into per-minute UTC slots based on their local reminder
+  time, so each minute only reminds the users of that slot."""
+
+  def __init__(self,
+               remind: Callable[[List[int]], Awaitable[None]],
+               slot_capacity: int = SLOT_CAPACITY,
+               last_run: Optional[int] = None,
+               save_last_run: Optional[Callable[[int], None]] = None):
+    self.remind = remind
+    self.slot_capacity = slot_capacity
+    self.slots: Dict[int, Set[int]] = {}
+    self.user_slots: Dict[int, int] = {}
+    self.preferences: Dict[int, Tuple[time, str]] = {}
+    # Local date of each user's last reminder, so a DST shift never reminds
+    # a user twice on the same day.
+    self.last_reminded: Dict[int, date] = {}
+    # Minutes since epoch of the last processed slot. Restored from
+    # `save_last_run` across restarts, so slots passed while the bot was down
+    # are caught up.
+    self.last_run = last_run
+    self.save_last_run = save_last_run
+
+  def schedule(self, user_id: int, reminder_time: Optional[time],
+               tz_name: str, day: Optional[date] = None):
+    if reminder_time is None:
+      self.unschedule(user_id)
+      return
+    if (self.preferences.get(user_id) == (reminder_time, tz_name) and
+        day is None and user_id in self.user_slots):
+      return
+    self.unschedule(user_id)
+    self.preferences[user_id] = (reminder_time, tz_name)
+
+    day = day or datetime.now(timezone.utc).date()
+    preferred = utc_minute_of_day(reminder_time, tz_name, day)
+    for offset in range(MINUTES_PER_DAY):
+      slot = (preferred + offset) % MINUTES_PER_DAY
+      users = self.slots.setdefault(slot, set())
+      if len(users) < self.slot_capacity:
+        users.add(user_id)
+        self.user_slots[user_id] = slot
+        return
+    logger.error(f"No free reminder slot for user {user_id}")
+
+  def unschedule(self, user_id: int):
+    slot = self.user_slots.pop(user_id, None)
+    self.preferences.pop(user_id, None)
+    if slot is not None:
+      self.slots[slot].discard(user_id)
+      if not self.slots[slot]:
+        del self.slots[slot]
+
+  async def run_due(self, now: Optional[datetime] = None):
+    now = now or datetime.now(timezone.utc)
+    current = int(now.timestamp() // 60)
+    if self.last_run is None:
+      self.last_run = current - 1
+    first = max(self.last_run + 1, current - MAX_CATCH_UP_MINUTES)
+    if first <= current and self.save_last_run is not None:
+      # Saved up front, a crash while reminding must not remind twice.
+      self.save_last_run(current)
+
+    for minute in range(first, current + 1):
+      minute_dt = datetime.fromtimestamp(minute * 60, timezone.utc)
+      user_ids = []
+      for user_id in self.slots.get(minute % MINUTES_PER_DAY, ()):
+        local_day = minute_dt.astimezone(
+          ZoneInfo(self.preferences[user_id][1])).date()
+        if self.last_reminded.get(user_id) != local_day:
+          self.last_reminded[user_id] = local_day
+          user_ids.append(user_id)
+      self.last_run = minute
+      if not user_ids:
+        continue
+      logger.info(f"Reminding {len(user_ids)} users of slot "
+                  f"{minute % MINUTES_PER_DAY}")
+      try:
+        await self.remind(user_ids)
+      except Exception:
+        logger.exception("Failed to remind users")
+      # Recompute tomorrow's slots, the UTC offset may change with DST.
+      tomorrow = (minute_dt + timedelta(days=1)).date()
+      for user_id in user_ids:
+        if user_id in self.preferences:
+          reminder_time, tz_name = self.preferences[user_id]
+          self.schedule(user_id, reminder_time, tz_name, day=tomorrow)
@@ -0,0 +1,72 @@
+import unittest
+from datetime import date, datetime, time, timezone
+
+from reminder_scheduler import ReminderScheduler, utc_minute_of_day
+
+
+class TestReminderScheduler(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.reminded = []
+
+    async def remind(user_ids):
+      self.reminded.append(sorted(user_ids))
+
+    self.scheduler = ReminderScheduler(remind, slot_capacity=2)
+
+  def test_utc_minute_of_day(self):
+    # Berlin is UTC+1 in winter and UTC+2 in summer.
+    self.assertEqual(
+      utc_minute_of_day(time(10), "Europe/Berlin", date(2023, 1, 15)), 9 * 60)
+    self.assertEqual(
+      utc_minute_of_day(time(10), "Europe/Berlin", date(2023, 7, 15)), 8 * 60)
+    self.assertEqual(
+      utc_minute_of_day(time(0, 30), "Europe/Berlin", date(2023, 1, 15)),
+      23 * 60 + 30)
+
+  def test_full_slot_spills_to_next_minute(self):
+    day = date(2023, 1, 15)
+    for user_id in range(5):
+      self.scheduler.schedule(user_id, time(10), "UTC", day=day)
+    self.assertEqual(len(self.scheduler.slots[600]), 2)
+    self.assertEqual(len(self.scheduler.slots[601]), 2)
+    self.assertEqual(len(self.scheduler.slots[602]), 1)
+
+  async def test_run_due(self):
+    day = date(2023, 1, 15)
+    self.scheduler.schedule(1, time(10), "Europe/Berlin", day=day)
+    self.scheduler.schedule(2, time(9, 1), "UTC", day=day)
+    self.scheduler.schedule(3, time(12), "UTC", day=day)
+
+    await self.scheduler.run_due(
+      datetime(2023, 1, 15, 8, 59, tzinfo=timezone.utc))
+    self.assertEqual(self.reminded, [])
+    # Two minutes later: slots 09:00 and 09:01 are both processed.
+    await self.scheduler.run_due(
+      datetime(2023, 1, 15, 9, 1, tzinfo=timezone.utc))
+    self.assertEqual(self.reminded, [[1], [2]])
+    # Running the same minute again reminds nobody twice.
+    await self.scheduler.run_due(
+      datetime(2023, 1, 15, 9, 1, tzinfo=timezone.utc))
+    self.assertEqual(self.reminded, [[1], [2]])
+
+  async def test_catches_up_slots_missed_while_down(self):
+    saved = []
+    day = date(2023, 1, 15)
+    down_at = int(datetime(2023, 1, 15, 8, 59, tzinfo=timezone.utc).timestamp()
+                  // 60)
+    scheduler = ReminderScheduler(self.scheduler.remind, last_run=down_at,
+                                  save_last_run=saved.append)
+    scheduler.schedule(1, time(9), "UTC", day=day)
+    await scheduler.run_due(datetime(2023, 1, 15, 9, 30, tzinfo=timezone.utc))
+    self.assertEqual(self.reminded, [[1]])
+    self.assertEqual(saved, [down_at + 31])
+
+  def test_unschedule(self):
+    self.scheduler.schedule(1, time(10), "UTC")
+    self.scheduler.schedule(1, None, "UTC")
+    self.assertEqual(self.scheduler.slots, {})
+
+
+if __name__ == '__main__':
+  unittest.main()
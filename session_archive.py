@@ -0,0 +1,100 @@
+import asyncio
+import gzip
+import logging
+import os
+import pickle
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional
+
+from data_models import LearningSession, SessionStats, UserProfile
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSION_AGE = timedelta(days=30)
+
+
+class SessionArchive:
+  """Compressed per-user segments of old LearningSessions.
+
+  A segment file is named after the first and last session ids it holds, so
+  compacting again after a crash overwrites the same segment.
+  """
+
+  def __init__(self, directory: str = "session_archives",
+               max_age: timedelta = MAX_SESSION_AGE):
+    self.directory = directory
+    self.max_age = max_age
+    os.makedirs(directory, exist_ok=True)
+
+  def user_directory(self, user_id: int) -> str:
+    return os.path.join(self.directory, str(user_id))
+
+  def segment_path(self, user_id: int, first_id: int, last_id: int) -> str:
+    return os.path.join(self.user_directory(user_id),
+                        f"{first_id:08d}-{last_id:08d}.pkl.gz")
+
+  def _archivable(self, user_profile: UserProfile,
+                  now: datetime) -> List[LearningSession]:
+    # Only a prefix of the sessions is archived, the latest one is always
+    # kept as handlers work on sessions[-1].
+    archivable = []
+    for session in user_profile.sessions[:-1]:
+      last_activity = session.end_time or session.start_time
+      if now - last_activity < self.max_age:
+        break
+      archivable.append(session)
+    return archivable
+
+  def _write_segment(self, user_id: int,
+                     sessions: List[LearningSession]) -> None:
+    os.makedirs(self.user_directory(user_id), exist_ok=True)
+    file_path = self.segment_path(user_id, sessions[0].session_id,
+                                  sessions[-1].session_id)
+    tmp_path = f"{file_path}.tmp"
+    with gzip.open(tmp_path, 'wb') as f:
+      pickle.dump(sessions, f)
+    os.replace(tmp_path, file_path)
+
+  def _remove(self, user_profile: UserProfile,
+              sessions: List[LearningSession]) -> int:
+    for session in sessions:
+      user_profile.archived_stats.add_session(session)
+    del user_profile.sessions[:len(sessions)]
+    logger.info(f"Archived {len(sessions)} sessions of user "
+                f"{user_profile.user_id}")
+    return len(sessions)
+
+  def compact(self, user_profile: UserProfile,
+              now: Optional[datetime] = None) -> int:
+    """Moves old sessions out of the profile, the caller saves the profile."""
+    sessions = self._archivable(user_profile, now or datetime.now())
+    if not sessions:
+      return 0
+    self._write_segment(user_profile.user_id, sessions)
+    return self._remove(user_profile, sessions)
+
+  async def compact_async(self, user_profile: UserProfile,
+                          now: Optional[datetime] = None) -> int:
+    """`compact` with the compression and file I/O in a thread."""
+    sessions = self._archivable(user_profile, now or datetime.now())
+    if not sessions:
+      return 0
+    await asyncio.to_thread(self._write_segment, user_profile.user_id,
+                            sessions)
+    return self._remove(user_profile, sessions)
+
+  def load_sessions(self, user_id: int) -> Iterator[LearningSession]:
+    user_directory = self.user_directory(user_id)
+    if not os.path.exists(user_directory):
+      return
+    for file_name in sorted(os.listdir(user_directory)):
+      if file_name.endswith(".pkl.gz"):
+        with gzip.open(os.path.join(user_directory, file_name), 'rb') as f:
+          yield from pickle.load(f)
+
+  def segment_stats(self, user_id: int) -> SessionStats:
+    # Recomputes the aggregates from the segments, e.g. to audit a profile.
+    stats = SessionStats()
+    for session in self.load_sessions(user_id):
+      stats.add_session(session)
+    return stats
@@ -0,0 +1,79 @@
+import asyncio
+import pickle
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from data_models import LearningSession, Question, UserProfile
+from session_archive import SessionArchive
+
+
+def make_session(session_id: int, start_time: datetime) -> LearningSession:
+  question = Question(question="?", options=["a", "b"], correct_idx=0,
+                      explanation="", answer_idx=0)
+  return LearningSession(session_id=session_id,
+                         chat_id="1",
+                         text="text",
+                         start_time=start_time,
+                         end_time=start_time + timedelta(minutes=6),
+                         quiz=[question])
+
+
+class TestSessionArchive(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.archive = SessionArchive(self.tmp_dir.name,
+                                  max_age=timedelta(days=30))
+    self.now = datetime(2023, 6, 1)
+    self.user_profile = UserProfile(user_id=1)
+    for i, days_ago in enumerate([90, 60, 40, 10, 100]):
+      self.user_profile.sessions.append(
+        make_session(i, self.now - timedelta(days=days_ago)))
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_compact(self):
+    archived = self.archive.compact(self.user_profile, now=self.now)
+    # Session 3 is recent, the old session 4 stays as it comes after it.
+    self.assertEqual(archived, 3)
+    self.assertEqual([s.session_id for s in self.user_profile.sessions],
+                     [3, 4])
+    stats = self.user_profile.archived_stats
+    self.assertEqual(stats.sessions, 3)
+    self.assertEqual(stats.answers, 3)
+    self.assertEqual(stats.accuracy(), 1.0)
+    self.assertAlmostEqual(stats.minutes, 18)
+    self.assertEqual(
+      [s.session_id for s in self.archive.load_sessions(1)], [0, 1, 2])
+    self.assertEqual(self.archive.segment_stats(1), stats)
+    self.assertEqual(self.user_profile.new_session_id(), 5)
+
+  def test_last_session_is_kept(self):
+    self.user_profile.sessions = self.user_profile.sessions[:1]
+    self.assertEqual(self.archive.compact(self.user_profile, now=self.now), 0)
+
+  def test_session_ids_stay_stable(self):
+    self.user_profile.sessions = self.user_profile.sessions[:2]
+    self.user_profile.sessions[1].start_time = self.now - timedelta(days=99)
+    self.assertEqual(self.archive.compact(self.user_profile, now=self.now), 1)
+    self.assertEqual(self.user_profile.new_session_id(), 2)
+    self.assertEqual(self.user_profile.archived_stats.last_session_id, 0)
+
+  def test_compact_async(self):
+    archived = asyncio.run(
+      self.archive.compact_async(self.user_profile, now=self.now))
+    self.assertEqual(archived, 3)
+    self.assertEqual(
+      [s.session_id for s in self.archive.load_sessions(1)], [0, 1, 2])
+
+  def test_old_pickles_get_default_stats(self):
+    user_profile = UserProfile(user_id=1)
+    del user_profile.__dict__["archived_stats"]
+    restored = pickle.loads(pickle.dumps(user_profile))
+    self.assertEqual(restored.archived_stats.sessions, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import multiprocessing
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 1000
+# Update payload keys carrying the user as "from", or "user" for poll answers.
+USER_KEYS = ("from", "user")
+
+
+def shard_for(user_id: int, num_shards: int) -> int:
+  return zlib.crc32(str(user_id).encode()) % num_shards
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+  # An update has update_id plus one payload, e.g. "message" or "poll_answer".
+  for key, payload in update.items():
+    if key == "update_id" or not isinstance(payload, dict):
+      continue
+    for user_key in USER_KEYS:
+      if isinstance(payload.get(user_key), dict):
+        return payload[user_key].get("id")
+  return None
+
+
+class ShardedRunner:
+  """Routes update dicts to worker processes by user, so a user's updates
+  are always handled by the same worker.
+
+  `worker_target(shard_id, num_shards, queue, *worker_args)` runs in each
+  worker process and must return once it reads None from its queue.
+  """
+
+  def __init__(self,
+               num_workers: int,
+               worker_target: Callable,
+               worker_args: Sequence[Any] = (),
+               queue_size: int = QUEUE_SIZE):
+    self.num_workers = num_workers
+    self.worker_target = worker_target
+    self.worker_args = tuple(worker_args)
+    self.queues: List[multiprocessing.Queue] = [
+      multiprocessing.Queue(queue_size) for _ in range(num_workers)
+    ]
+    self.processes: List[multiprocessing.Process] = []
+
+  def start(self):
+    for shard_id, queue in enumerate(self.queues):
+      process = multiprocessing.Process(
+        target=self.worker_target,
+        args=(shard_id, self.num_workers, queue) + self.worker_args,
+        name=f"bot-worker-{shard_id}")
+      process.start()
+      self.processes.append(process)
+
+  def route(self, update: Dict[str, Any]):
+    user_id = update_user_id(update)
+    # Updates without a user (e.g. channel posts) all go to the first worker.
+    shard_id = 0 if user_id is None else shard_for(user_id, self.num_workers)
+    # Blocks when the worker falls behind.
+    self.queues[shard_id].put(update)
+
+  def stop(self):
+    for queue in self.queues:
+      queue.put(None)
+    for process in self.processes:
+      process.join()
+    self.processes = []
+
+
+async def poll_updates(bot, runner: ShardedRunner, timeout: int = 30):
+  """Long polls Telegram and routes every update to its worker."""
+  offset = None
+  loop = asyncio.get_running_loop()
+  while True:
+    updates = await bot.get_updates(offset=offset, timeout=timeout,
+                                    allowed_updates=[])
+    for update in updates:
+      await loop.run_in_executor(None, runner.route, update.to_dict())
+      offset = update.update_id + 1
@@ -0,0 +1,59 @@
+import argparse
+import hashlib
+import multiprocessing
+import time
+
+from sharded_runner import ShardedRunner, update_user_id
+
+
+def fake_update(update_id: int, user_id: int) -> dict:
+  # Shaped like Update.to_dict() of a text message.
+  return {
+    "update_id": update_id,
+    "message": {
+      "message_id": update_id,
+      "date": 0,
+      "chat": {"id": user_id, "type": "private"},
+      "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+      "text": "Hallo",
+    }
+  }
+
+
+def busy_worker(shard_id, num_shards, queue, results, work_rounds):
+  while True:
+    update = queue.get()
+    if update is None:
+      break
+    # CPU-bound work standing in for parsing and pickling.
+    digest = str(update).encode()
+    for _ in range(work_rounds):
+      digest = hashlib.sha256(digest).digest()
+    results.put(update_user_id(update))
+
+
+def run_updates(num_workers: int, num_updates: int, work_rounds: int) -> float:
+  results = multiprocessing.Queue()
+  runner = ShardedRunner(num_workers, busy_worker,
+                         worker_args=(results, work_rounds))
+  runner.start()
+  start = time.monotonic()
+  for i in range(num_updates):
+    runner.route(fake_update(i, user_id=i % 50))
+  for _ in range(num_updates):
+    results.get(timeout=60)
+  elapsed = time.monotonic() - start
+  runner.stop()
+  return elapsed
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Update throughput of the sharded runner per worker count")
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+  parser.add_argument("--updates", type=int, default=400)
+  parser.add_argument("--work-rounds", type=int, default=20000)
+  args = parser.parse_args()
+  for num_workers in args.workers:
+    elapsed = run_updates(num_workers, args.updates, args.work_rounds)
+    print(f"{num_workers} workers: {args.updates / elapsed:.0f} updates/s")
@@ -0,0 +1,63 @@
+import multiprocessing
+import unittest
+
+from sharded_runner import ShardedRunner, shard_for, update_user_id
+
+
+def fake_update(update_id: int, user_id: int) -> dict:
+  # Shaped like Update.to_dict() of a text message.
+  return {
+    "update_id": update_id,
+    "message": {
+      "message_id": update_id,
+      "date": 0,
+      "chat": {"id": user_id, "type": "private"},
+      "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+      "text": "Hallo",
+    }
+  }
+
+
+def recording_worker(shard_id, num_shards, queue, results):
+  while True:
+    update = queue.get()
+    if update is None:
+      break
+    results.put((shard_id, update_user_id(update)))
+
+
+class TestShardedRunner(unittest.TestCase):
+
+  def test_update_user_id(self):
+    self.assertEqual(update_user_id(fake_update(1, 42)), 42)
+    self.assertEqual(
+      update_user_id({"update_id": 1,
+                      "poll_answer": {"poll_id": "p", "option_ids": [0],
+                                      "user": {"id": 7}}}), 7)
+    self.assertEqual(
+      update_user_id({"update_id": 1,
+                      "callback_query": {"id": "c", "data": "kw 1 2",
+                                         "from": {"id": 9}}}), 9)
+    self.assertIsNone(update_user_id({"update_id": 1}))
+
+  def test_routing_is_deterministic(self):
+    shards = [shard_for(user_id, 4) for user_id in range(1000)]
+    self.assertEqual(shards, [shard_for(user_id, 4) for user_id in range(1000)])
+    self.assertEqual(set(shards), {0, 1, 2, 3})
+    self.assertEqual({shard_for(user_id, 1) for user_id in range(100)}, {0})
+
+  def test_user_affinity(self):
+    results = multiprocessing.Queue()
+    runner = ShardedRunner(3, recording_worker, worker_args=(results,))
+    runner.start()
+    for i in range(200):
+      runner.route(fake_update(i, user_id=i % 50))
+    processed = [results.get(timeout=60) for _ in range(200)]
+    runner.stop()
+    self.assertEqual(len(processed), 200)
+    for shard_id, user_id in processed:
+      self.assertEqual(shard_id, shard_for(user_id, 3))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import dataclasses
+import math
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import data_models
+from data_models import (LearningSession, SM2Params, UserProfile, UserProfileDB,
+                         Vocab, sm2_params_from_env)
+
+# Encounters added by /define, see main.define_handler. Other negative ids
+# (e.g. imports) are not reviews.
+DEFINE_SESSION = -1
+# next_review of vocabs that were never scheduled.
+NEVER = np.iinfo(np.int64).max
+INITIAL_EASE = Vocab.__dataclass_fields__["ease_factor"].default
+
+
+@dataclass
+class ReviewLog:
+  """Every review of every vocab, as columns sorted by vocab, then time."""
+  vocab: np.ndarray  # Index into vocab_user and vocab_root.
+  day: np.ndarray  # date.toordinal() of the review.
+  quality: np.ndarray
+  is_quiz: np.ndarray  # Vocab quiz answers, as opposed to clicks and /define.
+  vocab_user: np.ndarray
+  vocab_root: List[str]
+
+  def __len__(self) -> int:
+    return len(self.vocab)
+
+  @classmethod
+  def from_columns(cls,
+                   vocab,
+                   day,
+                   quality,
+                   is_quiz,
+                   vocab_user,
+                   vocab_root,
+                   time=None) -> "ReviewLog":
+    """Sorts the reviews. `time`, e.g. a timestamp, orders reviews of the
+    same vocab within a day."""
+    vocab = np.asarray(vocab, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+    order = np.lexsort((day if time is None else np.asarray(time), vocab))
+    return cls(vocab=vocab[order],
+               day=day[order],
+               quality=np.asarray(quality, dtype=np.int64)[order],
+               is_quiz=np.asarray(is_quiz, dtype=bool)[order],
+               vocab_user=np.asarray(vocab_user, dtype=np.int64),
+               vocab_root=list(vocab_root))
+
+  @classmethod
+  def from_profiles(
+      cls,
+      profiles: Iterable[UserProfile],
+      archived_sessions: Optional[Callable[[int],
+                                           Iterable[LearningSession]]] = None,
+      params: Optional[SM2Params] = None) -> "ReviewLog":
+    """Collects the reviews `Vocab.update` was called for: keyword clicks,
+    /define and vocab quiz answers, including archived sessions."""
+    params = params or data_models.SM2_PARAMS
+    vocab, day, time, quality, is_quiz = [], [], [], [], []
+    vocab_user, vocab_root = [], []
+    for user_profile in profiles:
+      index = {}
+      for key, user_vocab in user_profile.vocabs.dictionary.items():
+        index[key] = len(vocab_root)
+        vocab_user.append(user_profile.user_id)
+        vocab_root.append(user_vocab.root)
+        for encounter in user_vocab.encounters:
+          if (encounter.session_id < 0 and
+              encounter.session_id != DEFINE_SESSION):
+            continue
+          vocab.append(index[key])
+          day.append(encounter.time.toordinal())
+          time.append(encounter.time.timestamp())
+          quality.append(params.define_quality if encounter.session_id ==
+                         DEFINE_SESSION else params.click_quality)
+          is_quiz.append(False)
+      sessions = list(user_profile.sessions)
+      if archived_sessions is not None:
+        sessions.extend(archived_sessions(user_profile.user_id))
+      for session in sessions:
+        if session.text != "VocabQuiz":
+          continue
+        for root, question in zip(session.vocab_roots, session.quiz):
+          key = user_profile.vocabs.find_key(root)
+          if key not in index or question.answer_time is None:
+            continue
+          vocab.append(index[key])
+          day.append(question.answer_time.toordinal())
+          time.append(question.answer_time.timestamp())
+          quality.append(params.correct_quality if question.is_correct() else
+                         params.wrong_quality)
+          is_quiz.append(True)
+    return cls.from_columns(vocab, day, quality, is_quiz, vocab_user,
+                            vocab_root, time)
+
+
+@dataclass
+class SRSState:
+  """SM-2 state of many vocabs, one array element per vocab."""
+  ease: np.ndarray
+  interval: np.ndarray
+  repetitions: np.ndarray
+  last_review: np.ndarray
+  next_review: np.ndarray
+
+  @classmethod
+  def initial(cls, n: int) -> "SRSState":
+    return cls(ease=np.full(n, INITIAL_EASE),
+               interval=np.zeros(n, dtype=np.int64),
+               repetitions=np.zeros(n, dtype=np.int64),
+               last_review=np.full(n, -1, dtype=np.int64),
+               next_review=np.full(n, NEVER, dtype=np.int64))
+
+  @classmethod
+  def from_profiles(
+      cls,
+      profiles: Iterable[UserProfile]) -> Tuple["SRSState", np.ndarray]:
+    """Current state of all vocabs, and the user of each vocab."""
+    vocabs, users = [], []
+    for user_profile in profiles:
+      for vocab in user_profile.vocabs.dictionary.values():
+        vocabs.append(vocab)
+        users.append(user_profile.user_id)
+    state = cls.initial(len(vocabs))
+    for i, vocab in enumerate(vocabs):
+      state.ease[i] = vocab.ease_factor
+      state.interval[i] = vocab.interval
+      state.repetitions[i] = vocab.repetitions
+      if vocab.last_review is not None:
+        state.last_review[i] = vocab.last_review.toordinal()
+      if vocab.next_review is not None:
+        state.next_review[i] = vocab.next_review.toordinal()
+    return state, np.asarray(users, dtype=np.int64)
+
+  def update(self, index: np.ndarray, quality: np.ndarray, day: np.ndarray,
+             params: SM2Params):
+    """Vectorized `Vocab.update`. `index` must not contain duplicates."""
+    # Same operation order as Vocab.update, so results are bit identical.
+    lapse = (5 - quality).astype(np.float64)
+    ease = self.ease[index] + (params.ease_step - lapse *
+                               (params.ease_linear +
+                                lapse * params.ease_quadratic))
+    ease = np.maximum(ease, params.min_ease)
+    repetitions = np.where(quality < params.pass_quality, 0,
+                           self.repetitions[index] + 1)
+    interval = np.where(
+      repetitions == 1, params.first_interval,
+      np.where(repetitions == 2, params.second_interval,
+               (self.interval[index] * ease).astype(np.int64)))
+    self.ease[index] = ease
+    self.repetitions[index] = repetitions
+    self.interval[index] = interval
+    self.last_review[index] = day
+    self.next_review[index] = day + interval
+
+
+@dataclass
+class Replay:
+  state: SRSState
+  # Per review: the interval scheduled before it, and the days since the
+  # previous review of the vocab (-1 for the first review).
+  scheduled: np.ndarray
+  elapsed: np.ndarray
+
+
+def replay(log: ReviewLog, params: Optional[SM2Params] = None) -> Replay:
+  """Replays the log from fresh vocabs. The k-th reviews of all vocabs are
+  applied in one vectorized step, so the loop runs once per review rank."""
+  params = params or data_models.SM2_PARAMS
+  state = SRSState.initial(len(log.vocab_root))
+  scheduled = np.zeros(len(log), dtype=np.int64)
+  elapsed = np.full(len(log), -1, dtype=np.int64)
+  if not len(log):
+    return Replay(state, scheduled, elapsed)
+  starts = np.flatnonzero(np.r_[True, log.vocab[1:] != log.vocab[:-1]])
+  counts = np.diff(np.r_[starts, len(log)])
+  rank = np.arange(len(log)) - np.repeat(starts, counts)
+  order = np.argsort(rank, kind="stable")
+  rank_ends = np.cumsum(np.bincount(rank))
+  for rank_idx in np.split(order, rank_ends[:-1]):
+    vocab = log.vocab[rank_idx]
+    scheduled[rank_idx] = state.interval[vocab]
+    last_review = state.last_review[vocab]
+    elapsed[rank_idx] = np.where(last_review < 0, -1,
+                                 log.day[rank_idx] - last_review)
+    state.update(vocab, log.quality[rank_idx], log.day[rank_idx], params)
+  return Replay(state, scheduled, elapsed)
+
+
+def forecast(state: SRSState,
+             vocab_user: np.ndarray,
+             start_day: int,
+             days: int,
+             params: Optional[SM2Params] = None
+             ) -> Tuple[np.ndarray, np.ndarray]:
+  """Due reviews per user and day, assuming every review is answered
+  correctly on its due day. Overdue vocabs count on the first day. Returns
+  the users and a (users, days) matrix."""
+  params = params or data_models.SM2_PARAMS
+  users, user_idx = np.unique(vocab_user, return_inverse=True)
+  state = SRSState(**{
+    field.name: getattr(state, field.name).copy()
+    for field in dataclasses.fields(SRSState)
+  })
+  scheduled = state.next_review != NEVER
+  state.next_review[scheduled] = np.maximum(state.next_review[scheduled],
+                                            start_day)
+  load = np.zeros((len(users), days), dtype=np.int64)
+  for d in range(days):
+    due = np.flatnonzero(state.next_review == start_day + d)
+    load[:, d] = np.bincount(user_idx[due], minlength=len(users))
+    state.update(due, np.full(len(due), params.correct_quality),
+                 np.full(len(due), start_day + d), params)
+  return users, load
+
+
+@dataclass
+class Evaluation:
+  reviews: int
+  # Accuracy of quiz answers given at or after the interval the parameters
+  # scheduled, i.e. the recall the parameters would have got.
+  retention: float
+  due_reviews: int
+  due_per_user_day: float
+
+
+def evaluate(log: ReviewLog,
+             params: Optional[SM2Params] = None,
+             horizon_days: int = 30) -> Evaluation:
+  params = params or data_models.SM2_PARAMS
+  result = replay(log, params)
+  asked = log.is_quiz & (result.elapsed >= 0) & (
+    result.elapsed >= result.scheduled)
+  retention = (float(np.mean(log.quality[asked] >= params.pass_quality))
+               if asked.any() else math.nan)
+  start_day = int(log.day.max()) + 1 if len(log) else date.today().toordinal()
+  users, load = forecast(result.state, log.vocab_user, start_day,
+                         horizon_days, params)
+  return Evaluation(reviews=len(log),
+                    retention=retention,
+                    due_reviews=int(load.sum()),
+                    due_per_user_day=float(load.mean()) if load.size else 0.0)
+
+
+def _parse_params(assignments: List[str]) -> SM2Params:
+  types = {field.name: field.type for field in dataclasses.fields(SM2Params)}
+  values = {}
+  for assignment in assignments:
+    name, _, value = assignment.partition("=")
+    cast = float if types[name] in (float, "float") else int
+    values[name] = cast(value)
+  return dataclasses.replace(data_models.SM2_PARAMS, **values)
+
+
+async def _run_cli(args):
+  from session_archive import SessionArchive
+  # "current" is the schedule of the bot, with its SM2_PARAMS overrides.
+  data_models.SM2_PARAMS = sm2_params_from_env()
+  # A manifest of its own, the bot may be appending to its manifest.
+  db = UserProfileDB(args.directory, manifest_name="srs_engine")
+  profiles = await db.get_all_user_profiles()
+  archive = SessionArchive(args.archive)
+  log = ReviewLog.from_profiles(profiles, archive.load_sessions)
+  for name, params in (("current", data_models.SM2_PARAMS),
+                       ("candidate", _parse_params(args.set))):
+    evaluation = evaluate(log, params, args.days)
+    print(f"{name}: {evaluation.reviews} reviews, retention "
+          f"{evaluation.retention:.3f}, {evaluation.due_reviews} reviews due "
+          f"in {args.days} days, {evaluation.due_per_user_day:.2f} per user "
+          "and day")
+  state, vocab_user = SRSState.from_profiles(profiles)
+  users, load = forecast(state, vocab_user, date.today().toordinal(), args.days)
+  for user_id, user_load in zip(users, load):
+    print(f"user {user_id}: {' '.join(str(n) for n in user_load)}")
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Replays all answer logs with SM-2 parameters, and forecasts "
+    "the daily due reviews of every user")
+  parser.add_argument("--directory", default="user_profiles")
+  parser.add_argument("--archive", default="session_archives")
+  parser.add_argument("--days", type=int, default=14)
+  parser.add_argument("--set", action="append", default=[],
+                      metavar="NAME=VALUE",
+                      help="candidate parameter, e.g. second_interval=4")
+  asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == '__main__':
+  main()
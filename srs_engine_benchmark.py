@@ -0,0 +1,63 @@
+import argparse
+import dataclasses
+import time
+
+import numpy as np
+
+from data_models import SM2_PARAMS, Vocab
+from srs_engine import ReviewLog, evaluate
+
+
+def synthetic_log(num_reviews: int, reviews_per_vocab: int,
+                  seed: int = 0) -> ReviewLog:
+  rng = np.random.default_rng(seed)
+  num_vocabs = num_reviews // reviews_per_vocab
+  vocab = np.repeat(np.arange(num_vocabs), reviews_per_vocab)
+  gaps = rng.integers(0, 15, size=num_reviews)
+  day = 738000 + np.cumsum(gaps.reshape(num_vocabs, -1), axis=1).ravel()
+  quality = rng.choice([1, 2, 3, 5], p=[0.05, 0.2, 0.15, 0.6],
+                       size=num_reviews)
+  return ReviewLog.from_columns(vocab, day, quality,
+                                quality != 3, rng.integers(0, 10000,
+                                                           num_vocabs),
+                                [str(i) for i in range(num_vocabs)])
+
+
+def python_replay(log: ReviewLog, limit: int) -> float:
+  start = time.perf_counter()
+  vocabs = {}
+  for i in range(limit):
+    vocab = vocabs.setdefault(int(log.vocab[i]), Vocab(root=""))
+    vocab.update(int(log.quality[i]))
+  return (time.perf_counter() - start) / limit
+
+
+def main(args):
+  log = synthetic_log(args.reviews, args.reviews_per_vocab)
+  per_review = python_replay(log, min(len(log), 200000))
+  print(f"Vocab.update loop: {per_review * len(log):.2f}s for "
+        f"{len(log)} reviews (extrapolated)")
+  candidates = [
+    dataclasses.replace(SM2_PARAMS, second_interval=second_interval,
+                        min_ease=min_ease)
+    for second_interval in (3, 4, 6) for min_ease in (1.3, 1.7)
+  ]
+  start = time.perf_counter()
+  for params in candidates:
+    evaluation = evaluate(log, params, args.horizon)
+    print(f"second_interval={params.second_interval} "
+          f"min_ease={params.min_ease}: retention "
+          f"{evaluation.retention:.3f}, "
+          f"{evaluation.due_per_user_day:.2f} due per user and day")
+  elapsed = time.perf_counter() - start
+  print(f"Evaluated {len(candidates)} parameter sets over {len(log)} reviews "
+        f"in {elapsed:.2f}s ({elapsed / len(candidates):.2f}s each)")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Replays synthetic answer logs with several SM-2 parameters")
+  parser.add_argument("--reviews", type=int, default=2000000)
+  parser.add_argument("--reviews-per-vocab", type=int, default=8)
+  parser.add_argument("--horizon", type=int, default=30)
+  main(parser.parse_args())
@@ -0,0 +1,102 @@
+import os
+import random
+import unittest
+import unittest.mock
+from datetime import date, datetime
+
+import numpy as np
+
+import data_models
+from data_models import (Keyword, LearningSession, Question, SM2Params,
+                         UserProfile, Vocab, sm2_params_from_env)
+from srs_engine import ReviewLog, SRSState, evaluate, forecast, replay
+
+
+def make_keyword(root):
+  return Keyword(root=root, word=root, pos="Noun", snippet="",
+                 definition=root)
+
+
+class TestSRSEngine(unittest.TestCase):
+
+  def test_replay_matches_vocab_update(self):
+    rng = random.Random(0)
+    params = SM2Params(second_interval=4, min_ease=1.5)
+    vocab, day, quality, vocabs = [], [], [], []
+    for i in range(200):
+      expected = Vocab(root=str(i))
+      for k in range(rng.randint(1, 12)):
+        q = rng.choice([1, 2, 3, 5])
+        expected.update(q, params)
+        vocab.append(i)
+        day.append(1000 + k)
+        quality.append(q)
+      vocabs.append(expected)
+    log = ReviewLog.from_columns(vocab, day, quality, [True] * len(vocab),
+                                 [1] * len(vocabs), [v.root for v in vocabs])
+    state = replay(log, params).state
+    for i, expected in enumerate(vocabs):
+      self.assertEqual(state.ease[i], expected.ease_factor)
+      self.assertEqual(state.interval[i], expected.interval)
+      self.assertEqual(state.repetitions[i], expected.repetitions)
+
+  def test_log_from_profiles(self):
+    user_profile = UserProfile(user_id=7)
+    user_profile.click_keyword(make_keyword("der Apfel"), session_id=0)
+    user_profile.define_vocab(make_keyword("die Birne"), session_id=-1)
+    answered = datetime(2023, 5, 2, 10)
+    user_profile.sessions.append(
+      LearningSession(session_id=1, chat_id="1", text="VocabQuiz",
+                      start_time=answered, vocab_roots=["der Apfel"],
+                      quiz=[Question(question="?", options=["a", "b"],
+                                     correct_idx=0, explanation="",
+                                     answer_time=answered, answer_idx=1)]))
+    log = ReviewLog.from_profiles([user_profile])
+    self.assertEqual(log.vocab_root, ["der Apfel", "die Birne"])
+    self.assertEqual(log.vocab.tolist(), [0, 0, 1])
+    self.assertEqual(log.quality.tolist(), [2, 3, 1])
+    self.assertEqual(log.is_quiz.tolist(), [True, False, False])
+
+  def test_uses_the_current_params(self):
+    log = ReviewLog.from_columns([0, 0], [1000, 1001], [5, 5], [True, True],
+                                 [1], ["der Apfel"])
+    original = data_models.SM2_PARAMS
+    data_models.SM2_PARAMS = SM2Params(second_interval=3)
+    try:
+      self.assertEqual(replay(log).state.interval[0], 3)
+    finally:
+      data_models.SM2_PARAMS = original
+
+  def test_params_from_env(self):
+    with unittest.mock.patch.dict(os.environ,
+                                  {"SM2_PARAMS": '{"second_interval": 4}'}):
+      self.assertEqual(sm2_params_from_env(), SM2Params(second_interval=4))
+    with unittest.mock.patch.dict(os.environ, {"SM2_PARAMS": ""}):
+      self.assertEqual(sm2_params_from_env(), SM2Params())
+
+  def test_forecast_per_user(self):
+    today = date(2023, 5, 1).toordinal()
+    state = SRSState.initial(3)
+    state.next_review[:] = [today - 3, today + 1, today + 1]
+    state.repetitions[:] = 2
+    state.interval[:] = 6
+    users, load = forecast(state, np.array([5, 5, 9]), today, 3)
+    self.assertEqual(users.tolist(), [5, 9])
+    self.assertEqual(load.tolist(), [[1, 1, 0], [0, 1, 0]])
+
+  def test_evaluate_reports_retention_and_load(self):
+    start = date(2023, 5, 1).toordinal()
+    log = ReviewLog.from_columns(
+      vocab=[0, 0, 0, 1, 1], day=[start, start + 1, start + 2, start,
+                                  start + 10],
+      quality=[3, 5, 2, 3, 5], is_quiz=[False, True, True, False, True],
+      vocab_user=[1, 1], vocab_root=["a", "b"])
+    evaluation = evaluate(log, horizon_days=10)
+    # Answer 3 came before the 6 day interval, the others were due.
+    self.assertEqual(evaluation.retention, 1.0)
+    self.assertEqual(evaluation.reviews, 5)
+    self.assertGreater(evaluation.due_reviews, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
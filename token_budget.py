@@ -0,0 +1,133 @@
+import collections
+import functools
+import logging
+import random
+from typing import Callable, Deque, Dict, List, Optional, Sequence, TypeVar
+
+import tiktoken
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+# Rough characters per token of German text, used when the tokenizer cannot
+# be loaded (tiktoken downloads its encodings on first use).
+CHARS_PER_TOKEN = 3.5
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder(model_name: str) -> Optional[Callable[[str], list]]:
+  try:
+    return tiktoken.encoding_for_model(model_name).encode
+  except Exception:
+    logger.warning(f"No tokenizer for {model_name}, estimating token counts")
+    return None
+
+
+def count_tokens(text: str, model_name: str = DEFAULT_MODEL) -> int:
+  encode = _encoder(model_name)
+  if encode is None:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+  return len(encode(text))
+
+
+# Output tokens a single call may produce before it risks being cut off.
+COMPLETION_BUDGET = 1500
+# A call is well formatted if it returns a record for this share of items.
+FORMAT_SUCCESS_RATIO = 0.8
+# Few-shot examples are dropped while calls without them succeed this often.
+SUCCESS_THRESHOLD = 0.95
+MIN_SAMPLES = 20
+# Share of calls made without examples while still measuring their rate.
+PROBE_RATE = 0.1
+STATS_WINDOW = 100
+
+prompt_size = registry.histogram("bot_llm_prompt_size_tokens",
+                                 "Prompt tokens per LLM call, counted locally",
+                                 ["extractor", "call"],
+                                 buckets=(100, 250, 500, 1000, 2000, 4000))
+tokens_saved = registry.counter(
+  "bot_llm_prompt_tokens_saved_total",
+  "Prompt tokens saved by leaving out few-shot examples",
+  ["extractor", "call"])
+batch_splits = registry.counter(
+  "bot_llm_batch_splits_total",
+  "Extra LLM calls made to keep completions within budget",
+  ["extractor", "call"])
+
+
+class PromptBudget:
+  """Keeps the prompts and completions of one LLM call type small.
+
+  Batches are split so that the expected completion, learned from earlier
+  outputs, fits in `completion_budget`. The few-shot examples are left out
+  of the prompt while calls without them keep a high format success rate,
+  which a small share of probe calls keeps measuring.
+  """
+
+  def __init__(self,
+               extractor: str,
+               call: str,
+               examples: str,
+               tokens_per_item: float,
+               completion_budget: int = COMPLETION_BUDGET,
+               model_name: str = DEFAULT_MODEL,
+               rand: Callable[[], float] = random.random):
+    self.extractor = extractor
+    self.call = call
+    self.examples = examples
+    self.tokens_per_item = tokens_per_item
+    self.completion_budget = completion_budget
+    self.model_name = model_name
+    self.rand = rand
+    # Format success of recent calls, with and without examples.
+    self.results: Dict[bool, Deque[bool]] = {
+      True: collections.deque(maxlen=STATS_WINDOW),
+      False: collections.deque(maxlen=STATS_WINDOW),
+    }
+
+  def batch_size(self) -> int:
+    return max(1, int(self.completion_budget / self.tokens_per_item))
+
+  def batches(self, items: Sequence[T]) -> List[List[T]]:
+    size = self.batch_size()
+    batches = [list(items[i:i + size]) for i in range(0, len(items), size)]
+    if len(batches) > 1:
+      batch_splits.inc(len(batches) - 1, extractor=self.extractor,
+                       call=self.call)
+    return batches
+
+  def success_rate(self, with_examples: bool) -> Optional[float]:
+    results = self.results[with_examples]
+    if len(results) < MIN_SAMPLES:
+      return None
+    return sum(results) / len(results)
+
+  def use_examples(self) -> bool:
+    rate = self.success_rate(with_examples=False)
+    if rate is not None and rate >= SUCCESS_THRESHOLD:
+      return False
+    # Not enough evidence yet, or examples are needed: probe now and then.
+    return self.rand() >= PROBE_RATE
+
+  def prompt_examples(self, with_examples: bool) -> str:
+    return self.examples if with_examples else ""
+
+  def record_prompt(self, prompt: str, with_examples: bool):
+    prompt_size.observe(count_tokens(prompt, self.model_name),
+                        extractor=self.extractor, call=self.call)
+    if not with_examples:
+      tokens_saved.inc(count_tokens(self.examples, self.model_name),
+                       extractor=self.extractor, call=self.call)
+
+  def record_result(self, with_examples: bool, num_items: int, output: str,
+                    num_records: int):
+    self.results[with_examples].append(
+      num_records >= FORMAT_SUCCESS_RATIO * num_items)
+    if num_records:
+      # Moving average of the completion tokens one record takes.
+      per_item = count_tokens(output, self.model_name) / num_records
+      self.tokens_per_item = 0.8 * self.tokens_per_item + 0.2 * per_item
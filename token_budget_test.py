@@ -0,0 +1,48 @@
+import unittest
+
+from token_budget import (MIN_SAMPLES, PromptBudget, count_tokens,
+                          tokens_saved)
+
+
+class TestPromptBudget(unittest.TestCase):
+
+  def setUp(self):
+    self.rand_value = 0.5
+    self.budget = PromptBudget("test", "call", examples=" Example: a=1;b=2",
+                               tokens_per_item=50, completion_budget=200,
+                               rand=lambda: self.rand_value)
+
+  def test_splits_batches_by_completion_budget(self):
+    self.assertEqual(self.budget.batches(list(range(10))),
+                     [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+  def test_learns_tokens_per_item(self):
+    output = "x " * 1000
+    self.budget.record_result(True, 10, output, 10)
+    self.assertGreater(self.budget.tokens_per_item, 50)
+    self.assertLess(self.budget.batch_size(), 4)
+
+  def test_probes_without_examples(self):
+    self.assertTrue(self.budget.use_examples())
+    self.rand_value = 0.01
+    self.assertFalse(self.budget.use_examples())
+
+  def test_drops_examples_once_format_success_is_high(self):
+    for _ in range(MIN_SAMPLES):
+      self.budget.record_result(False, 4, "a=1;b=2\n" * 4, 4)
+    self.assertFalse(self.budget.use_examples())
+    before = tokens_saved.values.get(("test", "call"), 0)
+    self.budget.record_prompt("prompt", with_examples=False)
+    self.assertEqual(tokens_saved.values[("test", "call")],
+                     before + count_tokens(" Example: a=1;b=2"))
+
+  def test_keeps_examples_when_format_fails_without(self):
+    for i in range(MIN_SAMPLES):
+      self.budget.record_result(False, 4, "", 4 if i % 2 else 0)
+    self.assertTrue(self.budget.use_examples())
+    self.assertEqual(self.budget.prompt_examples(True), " Example: a=1;b=2")
+    self.assertEqual(self.budget.prompt_examples(False), "")
+
+
+if __name__ == '__main__':
+  unittest.main()
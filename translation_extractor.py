@@ -1,12 +1,13 @@
 import re
 from typing import List
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import PromptTemplate
+from model_router import ModelRouter
 
 class TranslationExtractor:
 
-    def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7):
-        self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
+    def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7,
+                 router=None):
+        self.router = router or ModelRouter.single(model_name, temperature)
 
         self.template = PromptTemplate(
             template=(
@@ -21,7 +22,7 @@ class TranslationExtractor:
                 "(I am tired because I fell asleep very late yesterday)."),
             input_variables=["text"])
 
-        self.chain = LLMChain(prompt=self.template, llm=self.model, verbose=True)
-
     async def extract_translation(self, text: str) -> str:
-        return await self.chain.apredict(text=text)
+        translation, _ = await self.router.run(self.template, "translation",
+                                               "translate", text=text)
+        return translation
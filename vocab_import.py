@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import csv
+import io
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+from data_models import UserProfileDB, Vocab, VocabEncounter, Vocabs
+
+MAX_IMPORT_BYTES = 1 << 20
+MAX_IMPORT_ROWS = 2000
+# Imported vocabs without SRS state become due over several days, like new
+# cards in Anki, so the first reviews and quiz top-ups are spread out.
+NEW_VOCABS_PER_DAY = 20
+DEFINITION_CACHE_SIZE = 10000
+# Session id of imported encounters. /define uses -1, and unlike those an
+# import is not a review, see srs_engine.
+IMPORT_SESSION = -2
+
+EXPORT_FIELDS = [
+  "root", "pos", "definition", "example", "ease_factor", "interval",
+  "repetitions", "last_review", "next_review"
+]
+# Columns of files without a header row, e.g. Anki "front, back" exports.
+POSITIONAL_FIELDS = ["root", "definition", "example"]
+HEADER_ALIASES = {
+  **{name: name for name in EXPORT_FIELDS},
+  "word": "root",
+  "front": "root",
+  "def": "definition",
+  "meaning": "definition",
+  "back": "definition",
+  "ex": "example",
+}
+
+
+@dataclass
+class ImportRow:
+  root: str
+  definition: str = ""
+  example: str = ""
+  pos: str = ""
+  ease_factor: Optional[float] = None
+  interval: Optional[int] = None
+  repetitions: Optional[int] = None
+  last_review: Optional[date] = None
+  next_review: Optional[date] = None
+
+  def to_vocab(self, default_next_review: date) -> Vocab:
+    vocab = Vocab(root=self.root)
+    if self.definition:
+      vocab.encounters.append(
+        VocabEncounter(session_id=IMPORT_SESSION, word=self.root, pos=self.pos,
+                       snippet=self.example, definition=self.definition))
+    for name in ("ease_factor", "interval", "repetitions", "last_review"):
+      if getattr(self, name) is not None:
+        setattr(vocab, name, getattr(self, name))
+    vocab.next_review = self.next_review or default_next_review
+    return vocab
+
+
+@dataclass
+class ImportResult:
+  added: int = 0
+  known: int = 0
+  invalid: int = 0
+  undefined: int = 0
+
+  def summary(self) -> str:
+    lines = [f"Imported {self.added} vocabs."]
+    if self.known:
+      lines.append(f"{self.known} were already in your vocabs.")
+    if self.undefined:
+      lines.append(f"{self.undefined} have no definition.")
+    if self.invalid:
+      lines.append(f"Skipped {self.invalid} invalid lines.")
+    return " ".join(lines)
+
+
+def _sniff_delimiter(line: str) -> str:
+  if "\t" in line:
+    return "\t"
+  if ";" in line and "," not in line:
+    return ";"
+  return ","
+
+
+def _parse_row(values: dict) -> ImportRow:
+  root = values.get("root", "").strip()
+  if not root:
+    raise ValueError("Missing root")
+  row = ImportRow(root=root,
+                  definition=values.get("definition", "").strip(),
+                  example=values.get("example", "").strip(),
+                  pos=values.get("pos", "").strip())
+  for name, parse in (("ease_factor", float), ("interval", int),
+                      ("repetitions", int), ("last_review", date.fromisoformat),
+                      ("next_review", date.fromisoformat)):
+    if values.get(name, "").strip():
+      setattr(row, name, parse(values[name].strip()))
+  return row
+
+
+def _records(reader) -> Iterator[Optional[List[str]]]:
+  # None for lines the reader failed on, e.g. with an oversized field.
+  while True:
+    try:
+      yield next(reader)
+    except StopIteration:
+      return
+    except csv.Error:
+      yield None
+
+
+def parse_rows(text: str) -> Tuple[List[ImportRow], int]:
+  """Parses a CSV/TSV word list, with or without a header row. Returns the
+  rows and the number of invalid lines."""
+  # Anki exports start with "#separator:tab" style comments.
+  lines = [
+    line for line in text.splitlines() if line.strip() and
+    not line.startswith("#")
+  ]
+  if not lines:
+    return [], 0
+  reader = _records(csv.reader(lines, delimiter=_sniff_delimiter(lines[0])))
+  first = next(reader)
+  names = [HEADER_ALIASES.get(cell.strip().lower()) for cell in first or []]
+  if first and all(names) and "root" in names:
+    records = reader
+  else:
+    names = POSITIONAL_FIELDS
+    records = [first, *reader]
+  rows, invalid = [], 0
+  for record in records:
+    if record is None:
+      invalid += 1
+      continue
+    try:
+      rows.append(_parse_row(dict(zip(names, record))))
+    except ValueError:
+      invalid += 1
+  return rows, invalid
+
+
+def export_rows(vocabs: Vocabs) -> Iterator[List[str]]:
+  yield EXPORT_FIELDS
+  for vocab in vocabs.dictionary.values():
+    encounter = next((e for e in reversed(vocab.encounters) if e.definition),
+                     None)
+    yield [
+      vocab.root, encounter.pos if encounter else "",
+      encounter.definition if encounter else "",
+      encounter.snippet if encounter else "", vocab.ease_factor,
+      vocab.interval, vocab.repetitions,
+      vocab.last_review.isoformat() if vocab.last_review else "",
+      vocab.next_review.isoformat() if vocab.next_review else ""
+    ]
+
+
+def write_export(vocabs: Vocabs, file: TextIO):
+  """Writes vocabs and their SRS state as CSV, one row at a time."""
+  csv.writer(file).writerows(export_rows(vocabs))
+
+
+class VocabImporter:
+  """Imports word lists into a profile in a single write. Definitions that
+  are missing are looked up with batched LLM calls, and cached across users
+  since word lists are often shared."""
+
+  def __init__(self,
+               db: UserProfileDB,
+               keyword_extractor=None,
+               cache_size: int = DEFINITION_CACHE_SIZE,
+               new_per_day: int = NEW_VOCABS_PER_DAY):
+    self.db = db
+    self.keyword_extractor = keyword_extractor
+    self.cache_size = cache_size
+    self.new_per_day = new_per_day
+    self._cache: OrderedDict = OrderedDict()
+
+  async def enrich(self, rows: List[ImportRow]):
+    # Lowercase roots are the cache keys, the LLM gets the original ones as
+    # capitalization tells nouns apart.
+    missing = {}
+    for row in rows:
+      if not row.definition:
+        missing.setdefault(row.root.lower(), row.root)
+    to_define = [
+      root for key, root in missing.items() if key not in self._cache
+    ]
+    if to_define and self.keyword_extractor is not None:
+      for keyword in await self.keyword_extractor.define_keywords(to_define):
+        self._cache[keyword.word.lower()] = keyword
+        if len(self._cache) > self.cache_size:
+          self._cache.popitem(last=False)
+    for row in rows:
+      keyword = None if row.definition else self._cache.get(row.root.lower())
+      if keyword is None:
+        continue
+      self._cache.move_to_end(row.root.lower())
+      row.root = keyword.root
+      row.pos = row.pos or keyword.pos
+      row.definition = keyword.definition
+
+  async def import_rows(self,
+                        user_id: int,
+                        rows: List[ImportRow],
+                        today: Optional[date] = None) -> ImportResult:
+    today = today or date.today()
+    # The LLM calls happen before taking the lock, other handlers of the user
+    # can run meanwhile.
+    await self.enrich(rows)
+    vocabs = [
+      row.to_vocab(today + timedelta(days=i // self.new_per_day))
+      for i, row in enumerate(rows)
+    ]
+    async with self.db.lock(user_id):
+      user_profile = await self.db.get_user_profile(user_id)
+      added = user_profile.import_vocabs(vocabs)
+      await self.db.set_user_profile(user_profile)
+    return ImportResult(added=added,
+                        known=len(vocabs) - added,
+                        undefined=sum(1 for row in rows if not row.definition))
+
+  async def import_text(self, user_id: int, text: str) -> ImportResult:
+    rows, invalid = parse_rows(text)
+    if len(rows) > MAX_IMPORT_ROWS:
+      invalid += len(rows) - MAX_IMPORT_ROWS
+      rows = rows[:MAX_IMPORT_ROWS]
+    result = await self.import_rows(user_id, rows)
+    result.invalid = invalid
+    return result
+
+
+async def export_user(db: UserProfileDB, user_id: int, file: TextIO):
+  user_profile = await db.get_user_profile(user_id)
+  write_export(user_profile.vocabs, file)
+
+
+def export_bytes(vocabs: Vocabs) -> bytes:
+  buffer = io.StringIO()
+  write_export(vocabs, buffer)
+  return buffer.getvalue().encode("utf-8")
+
+
+async def _run_cli(args):
+  db = UserProfileDB(args.directory, manifest_name="vocab_import")
+  if args.command == "export":
+    if args.output == "-":
+      await export_user(db, args.user_id, sys.stdout)
+    else:
+      with open(args.output, "w", newline="", encoding="utf-8") as file:
+        await export_user(db, args.user_id, file)
+    return
+  keyword_extractor = None
+  if not args.no_enrich:
+    from keyword_extractor import KeywordExtractor
+    keyword_extractor = KeywordExtractor()
+  importer = VocabImporter(db, keyword_extractor)
+  with open(args.file, encoding="utf-8-sig") as file:
+    result = await importer.import_text(args.user_id, file.read())
+  print(result.summary())
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Imports or exports the vocabs of a user. Run it while the "
+    "bot is stopped, the bot caches profiles in memory.")
+  parser.add_argument("--directory", default="user_profiles")
+  commands = parser.add_subparsers(dest="command", required=True)
+  import_parser = commands.add_parser("import", help="import a CSV/TSV file")
+  import_parser.add_argument("user_id", type=int)
+  import_parser.add_argument("file")
+  import_parser.add_argument("--no-enrich", action="store_true",
+                             help="do not look up missing definitions")
+  export_parser = commands.add_parser("export", help="export vocabs as CSV")
+  export_parser.add_argument("user_id", type=int)
+  export_parser.add_argument("-o", "--output", default="-")
+  asyncio.run(_run_cli(parser.parse_args()))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,93 @@
+import csv
+import tempfile
+import unittest
+from datetime import date
+
+from data_models import Keyword, UserProfileDB
+from vocab_import import VocabImporter, export_bytes, parse_rows
+
+
+class FakeKeywordExtractor:
+
+  def __init__(self):
+    self.requested = []
+
+  async def define_keywords(self, words):
+    self.requested.append(sorted(words))
+    return [
+      Keyword(root=f"das {word.capitalize()}", word=word, pos="Noun",
+              snippet="", definition=f"meaning of {word}") for word in words
+    ]
+
+
+class TestParseRows(unittest.TestCase):
+
+  def test_positional_tsv(self):
+    rows, invalid = parse_rows("#separator:tab\nHaus\thouse\nBaum\t\n\ttree\n")
+    self.assertEqual([(r.root, r.definition) for r in rows],
+                     [("Haus", "house"), ("Baum", "")])
+    self.assertEqual(invalid, 1)
+
+  def test_header_csv_with_srs_state(self):
+    rows, invalid = parse_rows(
+      "word,meaning,interval,next_review\n"
+      "gehen,to go,6,2023-05-01\n"
+      "laufen,to run,x,\n")
+    self.assertEqual(invalid, 1)
+    self.assertEqual(rows[0].interval, 6)
+    self.assertEqual(rows[0].next_review, date(2023, 5, 1))
+
+  def test_malformed_lines_are_invalid(self):
+    huge = "x" * (csv.field_size_limit() + 1)
+    rows, invalid = parse_rows(f"Haus,house\n{huge},y\nBaum,tree\n")
+    self.assertEqual([r.root for r in rows], ["Haus", "Baum"])
+    self.assertEqual(invalid, 1)
+
+
+class TestVocabImporter(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.db = UserProfileDB(self.tmp_dir.name)
+    self.extractor = FakeKeywordExtractor()
+    self.importer = VocabImporter(self.db, self.extractor, new_per_day=2)
+
+  async def asyncTearDown(self):
+    self.tmp_dir.cleanup()
+
+  async def test_import_enriches_and_spreads_new_vocabs(self):
+    text = "haus\nbaum\ngehen,to go\nhaus\n"
+    rows, _ = parse_rows(text)
+    result = await self.importer.import_rows(1, rows, today=date(2023, 5, 1))
+    self.assertEqual(self.extractor.requested, [["baum", "haus"]])
+    self.assertEqual((result.added, result.known, result.undefined), (3, 1, 0))
+    vocabs = (await self.db.get_user_profile(1)).vocabs
+    self.assertEqual(vocabs.get("das Haus").encounters[0].definition,
+                     "meaning of haus")
+    self.assertEqual(vocabs.get("das Haus").next_review, date(2023, 5, 1))
+    self.assertEqual(vocabs.get("gehen").next_review, date(2023, 5, 2))
+
+  async def test_definitions_are_cached(self):
+    await self.importer.import_text(1, "haus\n")
+    await self.importer.import_text(2, "Haus\nbaum\n")
+    self.assertEqual(self.extractor.requested, [["haus"], ["baum"]])
+
+  async def test_roots_keep_their_capitalization(self):
+    await self.importer.import_text(1, "Haus\nhaus\nBaum\n")
+    self.assertEqual(self.extractor.requested, [["Baum", "Haus"]])
+
+  async def test_export_round_trip(self):
+    await self.importer.import_text(
+      1, "root,definition,ease_factor,interval,repetitions,next_review\n"
+      "gehen,to go,2.1,6,2,2023-05-07\n")
+    user_profile = await self.db.get_user_profile(1)
+    exported = export_bytes(user_profile.vocabs).decode()
+    await self.importer.import_text(2, exported)
+    vocab = (await self.db.get_user_profile(2)).vocabs.get("gehen")
+    self.assertEqual((vocab.ease_factor, vocab.interval, vocab.repetitions,
+                      vocab.next_review), (2.1, 6, 2, date(2023, 5, 7)))
+    self.assertEqual(vocab.encounters[0].definition, "to go")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,13 +1,37 @@
+import asyncio
 import re
 from typing import Dict, List, Tuple
-from langchain import PromptTemplate, LLMChain
-from langchain.chat_models import ChatOpenAI
+from langchain import PromptTemplate
 from data_models import Question, Vocab
+from metrics import record_parse
+from model_router import ModelRouter
+from token_budget import PromptBudget
+
+
+def parse_vocab_questions(output: str,
+                          roots: List[str]) -> List[Tuple[str, Question]]:
+  question_re = re.compile(
+      r"input=(.+);\s?text=(.+);\s?a=(.+);\s?b=(.+);\s?c=(.+);\s?d=(.+);\s?ans=(.+);\s?expl=(.+)")
+  questions = []
+  for match in question_re.finditer(output):
+    root, question_text, a, b, c, d, answer, explanation = match.groups()
+    question = Question(question=question_text,
+                        options=[a, b, c, d],
+                        correct_idx="abcd".index(answer),
+                        explanation=explanation.strip())
+    if not question.validate_telegram_poll():
+      continue
+    matched_root = next((r for r in roots if r.lower() == root.lower()), None)
+    if matched_root:
+      questions.append((matched_root, question))
+  return questions
+
 
 class VocabQuestionExtractor:
 
-  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7):
-    self.model = ChatOpenAI(model_name=model_name, temperature=temperature)
+  def __init__(self, model_name='gpt-3.5-turbo', temperature=0.7,
+               router=None):
+    self.router = router or ModelRouter.single(model_name, temperature)
     self.prompt_template = PromptTemplate(
         template=("Generate muti-choice questions to test my knowledge "
                   "of the following German keywords, "
@@ -21,33 +45,36 @@ class VocabQuestionExtractor:
                   "ans=correct answer, either a, b, c, or d;"
                   "expl=explains why ans is correct.\n\n"
                   "Keywords: {keywords}\n\n"
-                  "The output contains one question per line. Example:\n"
-              "input=...;text=...?;a=...;b=...;c=...;d=...;ans=d;expl=..."),
-        input_variables=["keywords"],
+                  "The output contains one question per line.{examples}"),
+        input_variables=["keywords", "examples"],
         partial_variables={})
-    self.llm_chain = LLMChain(prompt=self.prompt_template,
-                              llm=self.model,
-                              verbose=True)
+    self.budget = PromptBudget(
+      "vocab_question", "quiz",
+      examples=(" Example:\n"
+                "input=...;text=...?;a=...;b=...;c=...;d=...;ans=d;expl=..."),
+      tokens_per_item=60)
 
   async def extract_questions(self, 
                               vocabs: List[Vocab]) -> List[Tuple[str, Question]]:
+    # Large batches are split so that outputs are not cut off.
+    results = await asyncio.gather(
+      *[self._extract_batch(batch) for batch in self.budget.batches(vocabs)])
+    return [question for questions in results for question in questions]
+
+  async def _extract_batch(
+      self, vocabs: List[Vocab]) -> List[Tuple[str, Question]]:
     formatted_keywords = ", ".join([vocab.root for vocab in vocabs])
-    output = await self.llm_chain.apredict(keywords=formatted_keywords)
-    print(output)
-    question_re = re.compile(
-        r"input=(.+);\s?text=(.+);\s?a=(.+);\s?b=(.+);\s?c=(.+);\s?d=(.+);\s?ans=(.+);\s?expl=(.+)")
-    questions = []
-    for match in question_re.finditer(output):
-      root, question_text, a, b, c, d, answer, explanation = match.groups()
-      question = Question(question=question_text,
-                          options=[a, b, c, d],
-                          correct_idx="abcd".index(answer),
-                          explanation=explanation.strip())
-      if not question.validate_telegram_poll():
-        continue
-      matched_vocab = next((vocab for vocab in vocabs 
-                           if vocab.root.lower() == root.lower()), None)
-      if matched_vocab:
-        questions.append((matched_vocab.root, question))
-    print(questions)
+    with_examples = self.budget.use_examples()
+    inputs = dict(keywords=formatted_keywords,
+                  examples=self.budget.prompt_examples(with_examples))
+    self.budget.record_prompt(self.prompt_template.format(**inputs),
+                              with_examples)
+    output, questions = await self.router.run(
+      self.prompt_template, "vocab_question", "quiz",
+      parse=parse_vocab_questions,
+      parse_args=([vocab.root for vocab in vocabs],),
+      expected_records=len(vocabs), **inputs)
+    record_parse("vocab_question", "quiz", len(questions))
+    self.budget.record_result(with_examples, len(vocabs), output,
+                              len(questions))
     return questions
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import logging
+import time
+from typing import (Any, Awaitable, Callable, Dict, List, Optional, Set,
+                    Tuple)
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 1000
+NUM_CONSUMERS = 32
+# How long a request waits for room in a full queue before getting a 503,
+# Telegram then redelivers the update later.
+ENQUEUE_TIMEOUT = 1.0
+DRAIN_TIMEOUT = 30.0
+MAX_BODY_SIZE = 1 << 20
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+queue_latency = registry.histogram("bot_webhook_queue_latency_seconds",
+                                   "Time updates wait in the webhook queue")
+webhook_requests = registry.counter("bot_webhook_requests_total",
+                                    "Webhook requests by response status",
+                                    ["status"])
+
+
+class PayloadTooLarge(ValueError):
+  pass
+
+
+STATUS_TEXT = {
+  200: "OK",
+  400: "Bad Request",
+  403: "Forbidden",
+  404: "Not Found",
+  413: "Payload Too Large",
+  503: "Service Unavailable",
+}
+
+
+class WebhookServer:
+  """Minimal HTTP/1.1 server receiving Telegram webhook updates.
+
+  Updates go through a bounded queue consumed by a fixed number of tasks.
+  When the queue stays full, requests are answered with 503 so Telegram
+  backs off and retries.
+  """
+
+  def __init__(self,
+               process_update: Callable[[Dict[str, Any]], Awaitable[None]],
+               host: str = "0.0.0.0",
+               port: int = 8443,
+               path: str = "/telegram",
+               secret_token: Optional[str] = None,
+               queue_size: int = QUEUE_SIZE,
+               num_consumers: int = NUM_CONSUMERS,
+               enqueue_timeout: float = ENQUEUE_TIMEOUT):
+    self.process_update = process_update
+    self.host = host
+    self.port = port
+    self.path = path
+    self.secret_token = secret_token
+    self.num_consumers = num_consumers
+    self.enqueue_timeout = enqueue_timeout
+    self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+    self.server: Optional[asyncio.AbstractServer] = None
+    self.consumers: List[asyncio.Task] = []
+    self.connections: Set[asyncio.StreamWriter] = set()
+    self.draining = False
+
+  async def start(self):
+    self.consumers = [
+      asyncio.create_task(self._consume()) for _ in range(self.num_consumers)
+    ]
+    self.server = await asyncio.start_server(self._handle_connection,
+                                             self.host, self.port)
+    # Port 0 picks a free port, e.g. in tests.
+    self.port = self.server.sockets[0].getsockname()[1]
+    logger.info(f"Webhook listening on {self.host}:{self.port}{self.path}")
+
+  async def stop(self, drain_timeout: float = DRAIN_TIMEOUT):
+    """Stops accepting updates, then waits for the queued ones."""
+    self.draining = True
+    if self.server is not None:
+      self.server.close()
+      # Idle keep-alive connections would otherwise keep the server open.
+      for writer in list(self.connections):
+        writer.close()
+      await self.server.wait_closed()
+    try:
+      await asyncio.wait_for(self.queue.join(), drain_timeout)
+    except asyncio.TimeoutError:
+      logger.warning(f"Dropping {self.queue.qsize()} undrained updates")
+    for consumer in self.consumers:
+      consumer.cancel()
+    await asyncio.gather(*self.consumers, return_exceptions=True)
+
+  async def _consume(self):
+    while True:
+      received_at, update = await self.queue.get()
+      queue_latency.observe(time.monotonic() - received_at)
+      try:
+        await self.process_update(update)
+      except Exception:
+        logger.exception("Failed to process update")
+      finally:
+        self.queue.task_done()
+
+  async def _read_request(
+      self, reader: asyncio.StreamReader
+  ) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+      return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+      line = await reader.readline()
+      if line in (b"\r\n", b"\n", b""):
+        break
+      name, _, value = line.decode("latin-1").partition(":")
+      headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+      raise PayloadTooLarge()
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+  async def _handle_request(self, method: str, path: str,
+                            headers: Dict[str, str], body: bytes) -> int:
+    if method != "POST" or path != self.path:
+      return 404
+    if self.secret_token and headers.get(SECRET_HEADER) != self.secret_token:
+      return 403
+    if self.draining:
+      return 503
+    try:
+      update = json.loads(body)
+    except ValueError:
+      return 400
+    try:
+      await asyncio.wait_for(self.queue.put((time.monotonic(), update)),
+                             self.enqueue_timeout)
+    except asyncio.TimeoutError:
+      return 503
+    return 200
+
+  async def _handle_connection(self, reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter):
+    # Telegram keeps connections alive, so serve several requests on each.
+    self.connections.add(writer)
+    try:
+      while True:
+        try:
+          request = await self._read_request(reader)
+        except PayloadTooLarge:
+          self._write_response(writer, 413, close=True)
+          break
+        except (ValueError, asyncio.IncompleteReadError):
+          self._write_response(writer, 400, close=True)
+          break
+        if request is None:
+          break
+        method, path, headers, body = request
+        status = await self._handle_request(method, path, headers, body)
+        close = headers.get("connection", "").lower() == "close"
+        self._write_response(writer, status, close)
+        await writer.drain()
+        if close:
+          break
+    except ConnectionError:
+      pass
+    finally:
+      self.connections.discard(writer)
+      writer.close()
+
+  def _write_response(self, writer: asyncio.StreamWriter, status: int,
+                      close: bool):
+    webhook_requests.inc(status=status)
+    connection = "close" if close else "keep-alive"
+    writer.write((f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                  "Content-Length: 0\r\n"
+                  f"Connection: {connection}\r\n\r\n").encode())
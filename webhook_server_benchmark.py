@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import List
+
+from webhook_server import WebhookServer
+
+SECRET = "benchmark"
+
+
+def synthetic_update(update_id: int) -> bytes:
+  user_id = update_id % 1000
+  return json.dumps({
+    "update_id": update_id,
+    "message": {
+      "message_id": update_id,
+      "date": int(time.time()),
+      "chat": {"id": user_id, "type": "private"},
+      "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+      "text": "Warum steht das Verb am Ende?",
+    }
+  }).encode()
+
+
+async def client(port: int, update_ids: List[int], sent_at: dict):
+  # One keep-alive connection, like Telegram's webhook delivery.
+  reader, writer = await asyncio.open_connection("127.0.0.1", port)
+  for update_id in update_ids:
+    body = synthetic_update(update_id)
+    sent_at[update_id] = time.monotonic()
+    writer.write(("POST /telegram HTTP/1.1\r\nHost: localhost\r\n"
+                  f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+    # Status line, Content-Length, Connection and the empty line.
+    for _ in range(4):
+      await reader.readline()
+  writer.close()
+
+
+async def benchmark_webhook(num_updates: int, connections: int,
+                            handler_time: float) -> List[float]:
+  sent_at, latencies = {}, []
+
+  async def process_update(update):
+    latencies.append(time.monotonic() - sent_at[update["update_id"]])
+    await asyncio.sleep(handler_time)
+
+  server = WebhookServer(process_update, host="127.0.0.1", port=0,
+                         secret_token=SECRET)
+  await server.start()
+  start = time.monotonic()
+  await asyncio.gather(*[
+    client(server.port, list(range(i, num_updates, connections)), sent_at)
+    for i in range(connections)
+  ])
+  await server.stop()
+  elapsed = time.monotonic() - start
+  return [num_updates / elapsed] + sorted(latencies)
+
+
+async def benchmark_polling(num_updates: int, arrival_rate: float,
+                            round_trip: float, batch_size: int = 100):
+  # getUpdates: updates wait in Telegram until the next poll returns them.
+  arrivals = [i / arrival_rate for i in range(num_updates)]
+  latencies = []
+  now, next_idx = 0.0, 0
+  while next_idx < num_updates:
+    # A long poll returns as soon as an update is available.
+    now = max(now, arrivals[next_idx]) + round_trip
+    batch_end = next_idx
+    while (batch_end < num_updates and arrivals[batch_end] <= now and
+           batch_end - next_idx < batch_size):
+      batch_end += 1
+    latencies.extend(now - arrivals[i] for i in range(next_idx, batch_end))
+    next_idx = batch_end
+  return [num_updates / now] + sorted(latencies)
+
+
+def report(name: str, result: List[float]):
+  rate, latencies = result[0], result[1:]
+  p99 = latencies[int(len(latencies) * 0.99) - 1]
+  print(f"{name}: {rate:.0f} updates/s, queue latency "
+        f"p50={statistics.median(latencies) * 1000:.1f}ms "
+        f"p99={p99 * 1000:.1f}ms")
+
+
+async def main(args):
+  webhook = await benchmark_webhook(args.updates, args.connections,
+                                    args.handler_time)
+  report("webhook", webhook)
+  # Polling at the arrival rate the webhook sustained.
+  polling = await benchmark_polling(args.updates, webhook[0], args.round_trip)
+  report("polling (simulated)", polling)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="POSTs synthetic updates to a local webhook")
+  parser.add_argument("--updates", type=int, default=5000)
+  parser.add_argument("--connections", type=int, default=40)
+  parser.add_argument("--handler-time", type=float, default=0.005)
+  parser.add_argument("--round-trip", type=float, default=0.1,
+                      help="getUpdates round trip to Telegram, in seconds")
+  asyncio.run(main(parser.parse_args()))
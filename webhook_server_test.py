@@ -0,0 +1,72 @@
+import asyncio
+import json
+import unittest
+
+from webhook_server import WebhookServer
+
+
+async def post(port: int, body: bytes, headers: str = "",
+               path: str = "/telegram") -> int:
+  reader, writer = await asyncio.open_connection("127.0.0.1", port)
+  writer.write((f"POST {path} HTTP/1.1\r\nHost: localhost\r\n{headers}"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n").encode() + body)
+  await writer.drain()
+  status_line = await reader.readline()
+  writer.close()
+  return int(status_line.split()[1])
+
+
+class TestWebhookServer(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.processed = []
+    self.release = asyncio.Event()
+    self.release.set()
+
+    async def process_update(update):
+      await self.release.wait()
+      self.processed.append(update["update_id"])
+
+    self.server = WebhookServer(process_update, host="127.0.0.1", port=0,
+                                secret_token="s3cret", queue_size=2,
+                                num_consumers=1, enqueue_timeout=0.05)
+    await self.server.start()
+    self.headers = "X-Telegram-Bot-Api-Secret-Token: s3cret\r\n"
+
+  async def asyncTearDown(self):
+    self.release.set()
+    await self.server.stop(drain_timeout=1)
+
+  async def test_process_update(self):
+    status = await post(self.server.port,
+                        json.dumps({"update_id": 1}).encode(), self.headers)
+    self.assertEqual(status, 200)
+    await self.server.queue.join()
+    self.assertEqual(self.processed, [1])
+
+  async def test_rejects_bad_requests(self):
+    body = json.dumps({"update_id": 1}).encode()
+    self.assertEqual(await post(self.server.port, body), 403)
+    self.assertEqual(
+      await post(self.server.port, body, self.headers, path="/other"), 404)
+    self.assertEqual(await post(self.server.port, b"{", self.headers), 400)
+
+  async def test_backpressure_and_drain(self):
+    self.release.clear()
+    statuses = []
+    for update_id in range(5):
+      body = json.dumps({"update_id": update_id}).encode()
+      statuses.append(await post(self.server.port, body, self.headers))
+    # One update is being processed, two wait in the queue.
+    self.assertEqual(statuses, [200, 200, 200, 503, 503])
+
+    stop_task = asyncio.create_task(self.server.stop(drain_timeout=5))
+    await asyncio.sleep(0.05)
+    self.release.set()
+    await stop_task
+    self.assertEqual(self.processed, [0, 1, 2])
+
+
+if __name__ == '__main__':
+  unittest.main()